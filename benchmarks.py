@@ -0,0 +1,137 @@
+import argparse
+import json
+import platform
+import time
+import timeit
+import numpy as np
+from card_combinations import CardCombination, CardCombinationsGenerator
+from game import Game, Player
+from game_elements import Card
+from move_evaluator import default_move_score_cache
+from proba_engine import ProbaEngine
+
+# Microbenchmarks of the engine hot paths on reproducible positions.
+#
+# Positions are reached by self-play from a fixed seed, so that runs before
+# and after an engine change time the same work. Results are written as JSON
+# and two result files can be compared with --compare.
+
+BENCHMARK_SEED = 20240611
+# Number of cards played for each position
+POSITIONS = {"early": 2, "mid": 18, "late": 36}
+
+
+def get_position(n_played, seed=BENCHMARK_SEED):
+    # Game after n_played turns, and the player whose turn it is
+    game = Game(Player(), Player(), seed=seed)
+    for turn in range(n_played):
+        game.player_turn(turn % 2)
+        if game.game_winner() is not None:
+            raise ValueError("get_position: game over after {} turns".format(turn + 1))
+    return game, game.players[n_played % 2]
+
+
+def get_benchmarks(game, player):
+    # Benchmarks of a position: name -> function to time
+    game_state = game.game_state
+    my_slots = game_state.slots[player.index]
+    opp_slots = game_state.slots[player.opponent_index]
+    card = min(player.hand)
+    # A slot we can play in, and the opponent slot with the most cards
+    my_slot_index = min(range(9), key=lambda i: (len(my_slots[i]) == 3, -len(my_slots[i])))
+    opp_slot_index = max(range(9), key=lambda i: len(opp_slots[i]))
+    opp_started_slot = opp_slots[opp_slot_index]
+    opp_empty_slot = next((slot for slot in opp_slots if len(slot) == 0), None)
+    comb = CardCombination(*sorted(player.hand)[:3])
+    # After the first call, this player only looks the move scores up
+    cached_player = Player(player.index, move_score_cache=default_move_score_cache)
+    cached_player.hand = player.hand
+
+    benchmarks = {
+        "CardCombination": lambda: CardCombination(Card("red", 7), Card("brown", 9), Card("red", 8)),
+        "get_all_combinations": lambda: CardCombinationsGenerator().get_all_combinations(),
+        "get_all_combinations_forbidden":
+            lambda: CardCombinationsGenerator().get_all_combinations(game_state.played_cards),
+        "combination_probas_from_slot":
+            lambda: ProbaEngine.combination_probas_from_slot(player, game_state, my_slot_index),
+        "combination_probas_from_slot_opponent":
+            lambda: ProbaEngine.combination_probas_from_slot(player, game_state, opp_slot_index, True),
+        "get_winning_counter_combs_started":
+            lambda: player.get_winning_counter_combs(comb, opp_started_slot, game_state),
+        "get_move_scores":
+            lambda: player.get_move_scores(card, my_slots[my_slot_index], opp_slots[my_slot_index], game_state),
+        "make_move": lambda: player.make_move(game_state),
+        "make_move_cached": lambda: cached_player.make_move(game_state),
+    }
+    if opp_empty_slot is not None:
+        benchmarks["get_winning_counter_combs_empty"] = \
+            lambda: player.get_winning_counter_combs(comb, opp_empty_slot, game_state)
+    return benchmarks
+
+
+def time_function(function, repeat, min_time):
+    # Best and mean time per call, the number of calls per repeat being
+    # chosen so that a repeat lasts at least min_time
+    timer = timeit.Timer(function)
+    n_calls = 1
+    while True:
+        duration = timer.timeit(n_calls)
+        if duration >= min_time or n_calls >= 1 << 20:
+            break
+        n_calls *= 2 if duration == 0 else max(2, min(10, int(min_time / duration) + 1))
+    times = [duration / n_calls for duration in timer.repeat(repeat, n_calls)]
+    return {"n_calls": n_calls, "best": min(times), "mean": sum(times) / len(times)}
+
+
+def run_benchmarks(repeat=5, min_time=0.05, name_filter=None):
+    results = []
+    for position_name, n_played in POSITIONS.items():
+        game, player = get_position(n_played)
+        for name, function in get_benchmarks(game, player).items():
+            if name_filter is not None and name_filter not in name:
+                continue
+            # Warm up caches shared by all the runs
+            function()
+            result = {"name": name, "position": position_name}
+            result.update(time_function(function, repeat, min_time))
+            results.append(result)
+    return {"meta": {"seed": BENCHMARK_SEED,
+                     "python": platform.python_version(),
+                     "numpy": np.__version__,
+                     "machine": platform.machine(),
+                     "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+            "results": results}
+
+
+def compare(old_results, new_results):
+    # Best times with their ratio new / old, by position and benchmark.
+    # old_results may be None to only list the times.
+    old_times = {}
+    if old_results is not None:
+        old_times = {(r["position"], r["name"]): r["best"] for r in old_results["results"]}
+    lines = []
+    for r in new_results["results"]:
+        old_time = old_times.get((r["position"], r["name"]))
+        ratio = "" if old_time is None else "{:8.3f}x".format(r["best"] / old_time)
+        lines.append("{:6} {:40} {:12.3e} s {}".format(r["position"], r["name"], r["best"], ratio))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Times the engine hot paths.")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.05,
+                        help="minimum duration of a repeat, in seconds")
+    parser.add_argument("--filter", default=None, help="only run benchmarks whose name contains this")
+    parser.add_argument("--compare", default=None, help="previous results to compare to")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.repeat, args.min_time, args.filter)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=1)
+    old_results = None
+    if args.compare is not None:
+        with open(args.compare) as f:
+            old_results = json.load(f)
+    print(compare(old_results, results))
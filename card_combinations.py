@@ -1,6 +1,6 @@
-import itertools
-from utils import pairwise
-from game_elements import ALL_CARDS
+import numpy as np
+from game_elements import cards_to_mask
+from combination_table import CATEGORY_NAMES, N_COMBINATIONS, combination_id, pair_id, get_combination_table
 
 
 class CardCombination:
@@ -8,75 +8,35 @@ class CardCombination:
         assert card1 != card2
         assert card1 != card3
         self.cards = tuple(sorted([card1, card2, card3]))
+        self.mask = card1.mask | card2.mask | card3.mask
+        self.id = combination_id(self.cards[0].index, self.cards[1].index, self.cards[2].index)
         self.name = None
         self.category = None
         self.value = None
+        self.rank = None
         self.compute_name_value_category()
 
+    @staticmethod
+    def from_id(comb_id):
+        # Combinations are immutable so instances are shared
+        comb = _combinations_by_id[comb_id]
+        if comb is None:
+            comb = CardCombination(*get_combination_table().get_cards(comb_id))
+            _combinations_by_id[comb_id] = comb
+        return comb
+
     def compute_name_value_category(self):
-        has_single_color = True
-        for c1, c2 in pairwise(self.cards):
-            if c1.color != c2.color:
-                has_single_color = False
-
-        is_suite = True
-        for c1, c2 in pairwise(self.cards):
-            if c1.number < c2.number - 1 or \
-               c1.number == c2.number:
-                is_suite = False
-
-        is_set = True
-        for c1, c2 in pairwise(self.cards):
-            if c1.number != c2.number:
-                is_set = False
-
-        if has_single_color:
-            # Color suite. Strongest combination.
-            # The smallest card number gives its strength
-            # relative to other color suites
-            if is_suite:
-                self.name = "Color suite"
-                self.category = 4
-                self.value = self.cards[0].number
-            # Color.
-            # The sum of the card numbers gives its
-            # strength relative to other colors
-            else:
-                self.name = "Color"
-                self.category = 2
-                self.value = self.cards[0].number + \
-                             self.cards[1].number + \
-                             self.cards[2].number
-        elif is_suite:
-            # Suite. Strongest combination.
-            # The smallest card number gives its strength
-            # relative to other suites
-            if is_suite:
-                self.name = "Suite"
-                self.category = 1
-                self.value = self.cards[0].number
-        elif is_set:
-            # Set. Second strongest combination.
-            # Any card number gives its strength
-            # relative to other sets
-            self.name = "Set"
-            self.category = 3
-            self.value = self.cards[0].number
-        else:
-            # Sum: weakest combination.
-            # The sum of the card numbers gives its
-            # strength relative to other sums.
-            self.name = "Sum"
-            self.category = 0
-            self.value = self.cards[0].number + \
-                         self.cards[1].number + \
-                         self.cards[2].number
+        # Looked up in the precomputed table, see
+        # combination_table.compute_category_value
+        table = get_combination_table()
+        self.category = table.category_list[self.id]
+        self.value = table.value_list[self.id]
+        self.rank = table.rank_list[self.id]
+        self.name = CATEGORY_NAMES[self.category]
 
     def __eq__(self, other):
-        for c1, c2 in zip(self.cards, other.cards):
-            if c1 != c2:
-                return False
-        return True
+        # Same cards
+        return self.mask == other.mask
         """
         if self.category == other.category and self.value == other.value:
             return True
@@ -87,11 +47,8 @@ class CardCombination:
         return not self.__eq__(other)
 
     def __lt__(self, other):
-        if self.category < other.category:
-            return True
-        if self.category == other.category and self.value < other.value:
-            return True
-        return False
+        # Same as comparing categories then values
+        return self.rank < other.rank
 
     """
     # Not valid for use in sets
@@ -106,7 +63,7 @@ class CardCombination:
     """
 
     def __hash__(self):
-        return hash(self.cards)
+        return hash(self.mask)
 
     def __iter__(self):
         return self.cards.__iter__()
@@ -118,40 +75,64 @@ class CardCombination:
         return self.__str__()
 
 
+_combinations_by_id = [None] * N_COMBINATIONS
+
+
 class CardCombinationsGenerator:
 
     def __init__(self):
         self._all_combinations_cache = None
 
+    # The *_ids methods return numpy arrays of combination ids (increasing).
+    # Forbidden cards are filtered out of the precomputed inverted indexes
+    # with a mask test.
+    @staticmethod
+    def _filter_ids(comb_ids, forbidden_mask):
+        if forbidden_mask == 0:
+            return comb_ids
+        masks = get_combination_table().masks[comb_ids]
+        return comb_ids[(masks & np.uint64(forbidden_mask)) == 0]
+
+    @staticmethod
+    def get_all_combination_ids(forbidden_cards=0):
+        all_ids = np.arange(N_COMBINATIONS)
+        return CardCombinationsGenerator._filter_ids(all_ids, cards_to_mask(forbidden_cards))
+
+    @staticmethod
+    def get_combination_ids_from_card(c_card, forbidden_cards=0):
+        comb_ids = get_combination_table().card_comb_ids[c_card.index]
+        forbidden_mask = cards_to_mask(forbidden_cards) & ~c_card.mask
+        return CardCombinationsGenerator._filter_ids(comb_ids, forbidden_mask)
+
+    @staticmethod
+    def get_combination_ids_from_pair_of_cards(card1, card2, forbidden_cards=0):
+        comb_ids = get_combination_table().pair_comb_ids[pair_id(card1.index, card2.index)]
+        forbidden_mask = cards_to_mask(forbidden_cards) & ~(card1.mask | card2.mask)
+        return CardCombinationsGenerator._filter_ids(comb_ids, forbidden_mask)
+
+    @staticmethod
+    def combinations_from_ids(comb_ids):
+        return {CardCombination.from_id(comb_id) for comb_id in comb_ids.tolist()}
+
     def get_all_combinations(self, forbidden_cards={}):
-        if len(forbidden_cards) == 0:
+        forbidden_mask = cards_to_mask(forbidden_cards)
+        if forbidden_mask == 0:
             if self._all_combinations_cache is None:
-                self._all_combinations_cache = set()
-                for card1, card2, card3 in itertools.combinations(ALL_CARDS, 3):
-                    self._all_combinations_cache.add(CardCombination(card1, card2, card3))
+                self._all_combinations_cache = self.combinations_from_ids(self.get_all_combination_ids())
             return self._all_combinations_cache
         else:
-            allowed_cards = ALL_CARDS - set(forbidden_cards)
-            all_combs = set()
-            for card1, card2, card3 in itertools.combinations(allowed_cards, 3):
-                all_combs.add(CardCombination(card1, card2, card3))
-            return all_combs
+            return self.combinations_from_ids(self.get_all_combination_ids(forbidden_mask))
 
     @staticmethod
     def get_combinations_from_card(c_card, forbidden_cards=[]):
-        allowed_cards = ALL_CARDS - {c_card} - set(forbidden_cards)
-        all_combs = set()
-        for card1, card2 in itertools.combinations(allowed_cards, 2):
-            all_combs.add(CardCombination(c_card, card1, card2))
-        return all_combs
+        comb_ids = CardCombinationsGenerator.get_combination_ids_from_card(c_card, forbidden_cards)
+        return CardCombinationsGenerator.combinations_from_ids(comb_ids)
 
     @staticmethod
     def get_combinations_from_pair_of_cards(card1, card2, forbidden_cards=[]):
-        allowed_cards = ALL_CARDS - {card1, card2} - set(forbidden_cards)
-        all_combs = set()
-        for card in allowed_cards:
-            all_combs.add(CardCombination(card1, card2, card))
-        return all_combs
+        comb_ids = CardCombinationsGenerator.get_combination_ids_from_pair_of_cards(card1, card2,
+                                                                                    forbidden_cards)
+        return CardCombinationsGenerator.combinations_from_ids(comb_ids)
 
     """
     @staticmethod
@@ -1,10 +1,15 @@
+import numpy as np
 from utils import pairwise
+from combination_table import get_combination_table
 
 # Base scores are designed so that consecutive combinations have a difference
 # of 1 and that they are ordered according to they category first and
 # value second.
 # The importance of categories relative to each others can then be altered.
 
+# Base score minus combination value for each category
+BASE_SCORE_OFFSETS = (-3, 23, 24, 47, 56)
+
 
 class ScoringScheme:
     def __init__(self, category_factors=(1, 1, 1, 1, 1)):
@@ -14,9 +19,25 @@ class ScoringScheme:
             if f1 > f2:
                 raise ValueError("ScoringScheme: category factors must in non-decreasing order")
         self.category_factors = category_factors
+        # Scores of all the combinations, indexed by combination id
+        table = get_combination_table()
+        factors = np.asarray(category_factors)[table.categories]
+        self.scores = ScoringScheme.get_base_scores() * factors
+        self.score_list = self.scores.tolist()
+
+    def __reduce__(self):
+        # Pickled as its factors, the scores are computed again
+        return ScoringScheme, (tuple(self.category_factors),)
 
     def get_score(self, comb):
-        return ScoringScheme.get_base_score(comb) * self.category_factors[comb.category]
+        return self.score_list[comb.id]
+
+    @staticmethod
+    def get_base_scores():
+        # Same as get_base_score for all the combinations, indexed by
+        # combination id
+        table = get_combination_table()
+        return table.values.astype(np.int32) + np.array(BASE_SCORE_OFFSETS)[table.categories]
 
     @staticmethod
     def get_base_score(comb):
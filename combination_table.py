@@ -0,0 +1,267 @@
+import json
+import os
+import shutil
+import warnings
+import zlib
+import numpy as np
+from utils import pairwise
+from game_elements import CARDS_BY_INDEX, N_CARDS
+
+# Table of all the 3-card combinations, built once per process.
+# Combinations are identified by their colex index: for card indexes
+# i < j < k, the id is C(k, 3) + C(j, 2) + i. Ids therefore range from 0 to
+# C(54, 3) - 1 = 24803.
+# The strength rank is the dense rank of (category, value): comparing ranks
+# is the same as CardCombination.__lt__ and equal ranks are the ties
+# resolved by Game.get_slot_winner.
+
+CATEGORY_NAMES = ("Sum", "Suite", "Color", "Set", "Color suite")
+N_COMBINATIONS = N_CARDS * (N_CARDS - 1) * (N_CARDS - 2) // 6
+
+N_PAIRS = N_CARDS * (N_CARDS - 1) // 2
+
+BINOMIAL_2 = [k * (k - 1) // 2 for k in range(N_CARDS)]
+BINOMIAL_3 = [k * (k - 1) * (k - 2) // 6 for k in range(N_CARDS)]
+
+# The table is saved to TABLE_CACHE_DIR the first time it is computed and
+# memory-mapped from there afterwards, which is much faster than computing
+# it. TABLE_VERSION must be increased whenever the saved arrays change.
+# TABLE_CACHE_DIR is the SCHOTTEN_TOTTEN_CACHE_DIR environment variable if
+# set, else a directory of the user cache ($XDG_CACHE_HOME or ~/.cache).
+# Set it to None not to use the cache: the table is then computed by each
+# process, as it is when the cache cannot be written.
+TABLE_VERSION = 1
+TABLE_CACHE_DIR = os.environ.get("SCHOTTEN_TOTTEN_CACHE_DIR") or os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "schotten_totten_bot")
+# Arrays saved to the cache, the other attributes are derived from them:
+# name -> (dtype, shape)
+TABLE_ARRAYS = {"cards": (np.uint8, (N_COMBINATIONS, 3)),
+                "categories": (np.uint8, (N_COMBINATIONS,)),
+                "values": (np.uint8, (N_COMBINATIONS,)),
+                "ranks": (np.uint8, (N_COMBINATIONS,)),
+                "masks": (np.uint64, (N_COMBINATIONS,)),
+                "card_comb_ids": (np.intp, (N_CARDS, (N_CARDS - 1) * (N_CARDS - 2) // 2)),
+                "pair_comb_ids": (np.intp, (N_PAIRS, N_CARDS - 2))}
+# Written last to a saved table, with the version and a checksum of each
+# array
+TABLE_INFO_FILE = "table.json"
+
+
+def combination_id(i, j, k):
+    # Card indexes must be sorted: i < j < k
+    return BINOMIAL_3[k] + BINOMIAL_2[j] + i
+
+
+def pair_id(i, j):
+    # Colex index of a pair of cards, from 0 to 1430
+    if i > j:
+        i, j = j, i
+    return BINOMIAL_2[j] + i
+
+
+def compute_category_value(cards):
+    # cards must be sorted by increasing number
+    has_single_color = True
+    for c1, c2 in pairwise(cards):
+        if c1.color != c2.color:
+            has_single_color = False
+
+    is_suite = True
+    for c1, c2 in pairwise(cards):
+        if c1.number < c2.number - 1 or \
+           c1.number == c2.number:
+            is_suite = False
+
+    is_set = True
+    for c1, c2 in pairwise(cards):
+        if c1.number != c2.number:
+            is_set = False
+
+    if has_single_color:
+        # Color suite. Strongest combination.
+        # The smallest card number gives its strength
+        # relative to other color suites
+        if is_suite:
+            return 4, cards[0].number
+        # Color.
+        # The sum of the card numbers gives its
+        # strength relative to other colors
+        else:
+            return 2, cards[0].number + cards[1].number + cards[2].number
+    elif is_suite:
+        # Suite.
+        # The smallest card number gives its strength
+        # relative to other suites
+        return 1, cards[0].number
+    elif is_set:
+        # Set. Second strongest combination.
+        # Any card number gives its strength
+        # relative to other sets
+        return 3, cards[0].number
+    else:
+        # Sum: weakest combination.
+        # The sum of the card numbers gives its
+        # strength relative to other sums.
+        return 0, cards[0].number + cards[1].number + cards[2].number
+
+
+class CombinationTable:
+    # arrays: name -> array for each name of TABLE_ARRAYS, computed if None
+
+    def __init__(self, arrays=None):
+        if arrays is None:
+            arrays = self.compute_arrays()
+        for name in TABLE_ARRAYS:
+            setattr(self, name, arrays[name])
+        # Ranks are dense
+        self.n_ranks = int(self.ranks.max()) + 1
+
+        # Python lists for scalar accesses, which are much faster than
+        # indexing numpy arrays one element at a time
+        self.category_list = self.categories.tolist()
+        self.value_list = self.values.tolist()
+        self.rank_list = self.ranks.tolist()
+        self.mask_list = self.masks.tolist()
+        self.id_by_mask = {mask: comb_id for comb_id, mask in enumerate(self.mask_list)}
+
+    @staticmethod
+    def compute_arrays():
+        cards = np.empty((N_COMBINATIONS, 3), dtype=np.uint8)
+        categories = np.empty(N_COMBINATIONS, dtype=np.uint8)
+        values = np.empty(N_COMBINATIONS, dtype=np.uint8)
+        # Colex order: the running index is the combination id
+        comb_id = 0
+        for k in range(N_CARDS):
+            for j in range(k):
+                for i in range(j):
+                    cards[comb_id] = (i, j, k)
+                    categories[comb_id], values[comb_id] = compute_category_value(
+                        (CARDS_BY_INDEX[i], CARDS_BY_INDEX[j], CARDS_BY_INDEX[k]))
+                    comb_id += 1
+
+        # Dense rank of (category, value)
+        strength = categories.astype(np.int32) * 256 + values
+        _, ranks = np.unique(strength, return_inverse=True)
+
+        one = np.uint64(1)
+        masks = (one << cards[:, 0].astype(np.uint64)) | \
+                (one << cards[:, 1].astype(np.uint64)) | \
+                (one << cards[:, 2].astype(np.uint64))
+
+        # Inverted indexes: ids of the combinations containing a given card
+        # (54 x 1378) or a given pair of cards (1431 x 52), by increasing id
+        cards_i = cards.astype(np.intp)
+        card_comb_ids = np.argsort(cards_i.ravel(), kind="stable").reshape(N_CARDS, -1) // 3
+        binomial_2 = np.array(BINOMIAL_2)
+        comb_pair_ids = np.stack([binomial_2[cards_i[:, 1]] + cards_i[:, 0],
+                                  binomial_2[cards_i[:, 2]] + cards_i[:, 0],
+                                  binomial_2[cards_i[:, 2]] + cards_i[:, 1]], axis=1)
+        pair_comb_ids = np.argsort(comb_pair_ids.ravel(), kind="stable").reshape(N_PAIRS, -1) // 3
+
+        return {"cards": cards,
+                "categories": categories,
+                "values": values,
+                "ranks": ranks.reshape(-1).astype(np.uint8),
+                "masks": masks,
+                "card_comb_ids": card_comb_ids,
+                "pair_comb_ids": pair_comb_ids}
+
+    def save(self, directory):
+        # One .npy file per array. The directory is written next to its
+        # final place and renamed, so that concurrent processes never read
+        # it half written.
+        tmp_directory = "{}.tmp{}".format(directory, os.getpid())
+        try:
+            os.makedirs(tmp_directory, exist_ok=True)
+            checksums = {}
+            for name in TABLE_ARRAYS:
+                array = getattr(self, name)
+                np.save(os.path.join(tmp_directory, name + ".npy"), array)
+                checksums[name] = get_checksum(array)
+            with open(os.path.join(tmp_directory, TABLE_INFO_FILE), "w") as f:
+                json.dump({"version": TABLE_VERSION, "checksums": checksums}, f)
+        except OSError:
+            shutil.rmtree(tmp_directory, ignore_errors=True)
+            raise
+        try:
+            os.replace(tmp_directory, directory)
+        except OSError:
+            # Saved by another process in the meantime
+            shutil.rmtree(tmp_directory, ignore_errors=True)
+
+    @staticmethod
+    def load(directory):
+        # Arrays are memory-mapped, read only. Raises ValueError if the
+        # table is not the one of this version.
+        with open(os.path.join(directory, TABLE_INFO_FILE)) as f:
+            try:
+                info = json.load(f)
+            except ValueError:
+                raise ValueError("CombinationTable.load: unreadable {} in {}".format(TABLE_INFO_FILE, directory))
+        if not isinstance(info, dict) or info.get("version") != TABLE_VERSION or \
+           not isinstance(info.get("checksums"), dict):
+            raise ValueError("CombinationTable.load: the table in {} is not of version {}"
+                             .format(directory, TABLE_VERSION))
+        arrays = {}
+        for name, (dtype, shape) in TABLE_ARRAYS.items():
+            array = np.load(os.path.join(directory, name + ".npy"), mmap_mode="r")
+            if array.dtype != dtype or array.shape != shape:
+                raise ValueError("CombinationTable.load: {} in {} is {} {}, expected {} {}"
+                                 .format(name, directory, array.dtype, array.shape, np.dtype(dtype), shape))
+            if get_checksum(array) != info["checksums"].get(name):
+                raise ValueError("CombinationTable.load: wrong checksum of {} in {}".format(name, directory))
+            # Plain arrays over the mapped memory: numpy.memmap results are
+            # slower to handle
+            arrays[name] = array.view(np.ndarray)
+        return CombinationTable(arrays)
+
+    def get_id(self, cards):
+        return self.id_by_mask[cards[0].mask | cards[1].mask | cards[2].mask]
+
+    def get_name(self, comb_id):
+        return CATEGORY_NAMES[self.category_list[comb_id]]
+
+    def get_cards(self, comb_id):
+        return tuple(CARDS_BY_INDEX[i] for i in self.cards[comb_id].tolist())
+
+
+def get_checksum(array):
+    return zlib.crc32(np.ascontiguousarray(array).view(np.uint8))
+
+
+_combination_table = None
+
+
+def get_table_path():
+    return os.path.join(TABLE_CACHE_DIR, "combination_table_v{}".format(TABLE_VERSION))
+
+
+def get_combination_table():
+    global _combination_table
+    if _combination_table is None:
+        if TABLE_CACHE_DIR is None:
+            _combination_table = CombinationTable()
+        else:
+            table_path = get_table_path()
+            try:
+                _combination_table = CombinationTable.load(table_path)
+            except (OSError, ValueError) as error:
+                _combination_table = CombinationTable()
+                if os.path.exists(table_path):
+                    # Corrupt or stale: moved out of the way first, since the
+                    # computed table cannot be saved over it
+                    warnings.warn("get_combination_table: cannot load {} ({}), it is saved again"
+                                  .format(table_path, error))
+                    bad_path = "{}.bad{}".format(table_path, os.getpid())
+                    try:
+                        os.replace(table_path, bad_path)
+                    except OSError:
+                        # Already moved by another process
+                        pass
+                    shutil.rmtree(bad_path, ignore_errors=True)
+                try:
+                    _combination_table.save(table_path)
+                except OSError:
+                    # Read-only installation: the table is computed each time
+                    pass
+    return _combination_table
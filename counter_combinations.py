@@ -0,0 +1,240 @@
+import collections
+import contextlib
+import threading
+import numpy as np
+import profiling
+from combination_table import BINOMIAL_2, get_combination_table
+from game_elements import N_CARDS
+from card_combinations import CardCombinationsGenerator
+
+# Counting of the opponent combinations which beat or tie a combination.
+# Playable counter combinations are summarized by histograms over strength
+# ranks with suffix sums, so that the number of combinations stronger than
+# a given one, or as strong, is read in O(1) instead of enumerating and
+# comparing them.
+
+
+def suffix_counts(histograms):
+    # at_least[..., r] is the number of combinations with rank >= r. An extra
+    # zero column makes at_least[..., rank + 1] valid for the highest rank
+    shape = histograms.shape[:-1] + (histograms.shape[-1] + 1,)
+    at_least = np.zeros(shape, dtype=np.int64)
+    at_least[..., :-1] = np.cumsum(histograms[..., ::-1], axis=-1)[..., ::-1]
+    return at_least
+
+
+def rank_histograms(comb_ids, weights=None):
+    # Histograms of the ranks of the combinations in each row of comb_ids
+    table = get_combination_table()
+    comb_ids = np.atleast_2d(comb_ids)
+    n_rows = comb_ids.shape[0]
+    bins = np.arange(n_rows)[:, None] * table.n_ranks + table.ranks[comb_ids]
+    histograms = np.bincount(bins.ravel(), weights=None if weights is None else weights.ravel(),
+                             minlength=n_rows * table.n_ranks)
+    return histograms.astype(np.int64).reshape(n_rows, table.n_ranks)
+
+
+_counter_rank_masks = None
+
+
+def get_counter_rank_masks():
+    # Cards of the combinations of strength rank r or more: all of them,
+    # those with a given card and those with a given pair of cards, as
+    # masks indexed [r], [card index][r] and [pair id][r]. Cards outside
+    # these masks cannot be part of a counter combination of a combination
+    # of rank r.
+    global _counter_rank_masks
+    if _counter_rank_masks is None:
+        table = get_combination_table()
+
+        def suffix_masks(comb_ids):
+            masks = np.zeros((comb_ids.shape[0], table.n_ranks + 1), dtype=np.uint64)
+            rows = np.repeat(np.arange(comb_ids.shape[0]), comb_ids.shape[1])
+            np.bitwise_or.at(masks, (rows, table.ranks[comb_ids].ravel()), table.masks[comb_ids].ravel())
+            return np.bitwise_or.accumulate(masks[:, ::-1], axis=1)[:, ::-1].tolist()
+        _counter_rank_masks = (suffix_masks(np.arange(len(table.ranks))[None, :])[0],
+                               suffix_masks(table.card_comb_ids), suffix_masks(table.pair_comb_ids))
+    return _counter_rank_masks
+
+
+class SlotCounterCounts:
+    # Counter combinations of an opponent slot holding 1 to 3 cards: they all
+    # contain the slot cards and the other cards must not have been played.
+
+    def __init__(self, opp_slot, played_mask):
+        ccg = CardCombinationsGenerator
+        if len(opp_slot) == 1:
+            slot_card, = opp_slot
+            comb_ids = ccg.get_combination_ids_from_card(slot_card, played_mask)
+        elif len(opp_slot) == 2:
+            slot_card1, slot_card2, = opp_slot
+            comb_ids = ccg.get_combination_ids_from_pair_of_cards(slot_card1, slot_card2, played_mask)
+        elif len(opp_slot) == 3:
+            comb_ids = np.array([get_combination_table().id_by_mask[opp_slot.mask]])
+        else:
+            raise ValueError("SlotCounterCounts: slot must contain between 1 and 3 cards. "
+                             "{} found".format(len(opp_slot)))
+        self.at_least = suffix_counts(rank_histograms(comb_ids))[0]
+
+    def count(self, comb_ids):
+        # Numbers of counter combinations strictly stronger than and as strong
+        # as each combination
+        ranks = get_combination_table().ranks[comb_ids].astype(np.intp)
+        n_better = self.at_least[ranks + 1]
+        n_equal = self.at_least[ranks] - n_better
+        return n_better, n_equal
+
+
+class EmptySlotCounterCounts:
+    # Counter combinations of an empty opponent slot: any combination with
+    # no played card and no card of the combination it counters.
+    # Histograms are computed once for the combinations without played cards:
+    # overall, for each card and for each pair of cards. The counter
+    # combinations of a given combination are then counted by
+    # inclusion-exclusion over its cards and pairs of cards.
+
+    def __init__(self, played_mask):
+        table = get_combination_table()
+        self.played_mask = played_mask
+        allowed = (table.masks & np.uint64(played_mask)) == 0
+        self.all_at_least = suffix_counts(rank_histograms(np.flatnonzero(allowed)))[0]
+        self.card_at_least = suffix_counts(rank_histograms(table.card_comb_ids,
+                                                           allowed[table.card_comb_ids]))
+        # The largest array, counts fit in 32 bits
+        self.pair_at_least = suffix_counts(rank_histograms(table.pair_comb_ids,
+                                                           allowed[table.pair_comb_ids])).astype(np.int32)
+        self.allowed = allowed
+
+    def copy(self):
+        counts = EmptySlotCounterCounts.__new__(EmptySlotCounterCounts)
+        counts.played_mask = self.played_mask
+        counts.all_at_least = self.all_at_least.copy()
+        counts.card_at_least = self.card_at_least.copy()
+        counts.pair_at_least = self.pair_at_least.copy()
+        counts.allowed = self.allowed.copy()
+        return counts
+
+    def add_played_cards(self, played_mask):
+        # Updates the counts to more played cards, played_mask holding the
+        # current ones: the combinations with a newly played card are taken
+        # out of the histograms, which costs far less than counting again.
+        table = get_combination_table()
+        new_mask = played_mask & ~self.played_mask
+        removed = np.flatnonzero(self.allowed & ((table.masks & np.uint64(new_mask)) != 0))
+        self.played_mask = played_mask
+        if len(removed) == 0:
+            return
+        self.allowed[removed] = False
+        ranks = table.ranks[removed].astype(np.intp)
+        cards = table.cards[removed].astype(np.intp)
+        binomial_2 = np.array(BINOMIAL_2)
+        pairs = np.stack([binomial_2[cards[:, 1]] + cards[:, 0],
+                          binomial_2[cards[:, 2]] + cards[:, 0],
+                          binomial_2[cards[:, 2]] + cards[:, 1]], axis=1)
+        n_ranks = table.n_ranks
+        self.all_at_least -= suffix_counts(np.bincount(ranks, minlength=n_ranks))
+        card_histograms = np.bincount((cards * n_ranks + ranks[:, None]).ravel(), minlength=N_CARDS * n_ranks)
+        self.card_at_least -= suffix_counts(card_histograms.reshape(N_CARDS, n_ranks))
+        # Only the pairs of the removed combinations change
+        changed_pairs, pair_rows = np.unique(pairs, return_inverse=True)
+        pair_histograms = np.bincount((pair_rows.reshape(pairs.shape) * n_ranks + ranks[:, None]).ravel(),
+                                      minlength=len(changed_pairs) * n_ranks)
+        self.pair_at_least[changed_pairs] -= suffix_counts(pair_histograms.reshape(len(changed_pairs), n_ranks))
+
+    def count(self, comb_ids):
+        table = get_combination_table()
+        ranks = table.ranks[comb_ids].astype(np.intp)
+        cards = table.cards[comb_ids].astype(np.intp)
+        binomial_2 = np.array(BINOMIAL_2)
+        pairs = (binomial_2[cards[:, 1]] + cards[:, 0],
+                 binomial_2[cards[:, 2]] + cards[:, 0],
+                 binomial_2[cards[:, 2]] + cards[:, 1])
+
+        def n_at_least(r):
+            n = self.all_at_least[r]
+            for i in range(3):
+                n = n - self.card_at_least[cards[:, i], r]
+            for pair in pairs:
+                n = n + self.pair_at_least[pair, r]
+            return n
+
+        n_better = n_at_least(ranks + 1)
+        # The combination itself is the only one with all its cards
+        n_equal = n_at_least(ranks) - n_better - self.allowed[comb_ids]
+        return n_better, n_equal
+
+
+# Counts for empty slots by played cards, most recently used last. Counts
+# for new played cards are derived from those of a subset of them, typically
+# the previous turn of the same game. Counts take about 0.5 MB. They are
+# never changed once cached, the lock only guards the cache itself from the
+# players thinking in other threads (see game_server).
+_empty_slot_counts = collections.OrderedDict()
+_empty_slot_counts_maxsize = 32
+# Sizes reserved by the reserve_empty_slot_counts() contexts running
+_empty_slot_counts_reserved = []
+_empty_slot_counts_lock = threading.Lock()
+
+
+def _shrink_empty_slot_counts():
+    # Evicts the least recently used counts beyond the size. Called with the
+    # lock held.
+    maxsize = max([_empty_slot_counts_maxsize] + _empty_slot_counts_reserved)
+    while len(_empty_slot_counts) > maxsize:
+        _empty_slot_counts.popitem(last=False)
+
+
+@contextlib.contextmanager
+def reserve_empty_slot_counts(n_counts):
+    # Makes room for the counts of n_counts played cards while the context
+    # runs, for example those of games played in lockstep and of their
+    # previous turn. The cache shrinks back when the context exits.
+    with _empty_slot_counts_lock:
+        _empty_slot_counts_reserved.append(n_counts)
+    try:
+        yield
+    finally:
+        with _empty_slot_counts_lock:
+            _empty_slot_counts_reserved.remove(n_counts)
+            _shrink_empty_slot_counts()
+
+
+def get_empty_slot_counts(played_mask):
+    profiler = profiling.active_profiler
+    with _empty_slot_counts_lock:
+        counts = _empty_slot_counts.get(played_mask)
+        if counts is not None:
+            _empty_slot_counts.move_to_end(played_mask)
+        else:
+            # Cached counts with the most played cards among those played
+            base_counts = None
+            base_n_played = -1
+            for cached_mask, cached_counts in _empty_slot_counts.items():
+                if cached_mask & ~played_mask == 0:
+                    n_played = cached_mask.bit_count()
+                    if n_played > base_n_played:
+                        base_counts = cached_counts
+                        base_n_played = n_played
+    if counts is not None:
+        if profiler is not None:
+            profiler.count("empty_slot_counts_hits")
+        return counts
+    if profiler is not None:
+        profiler.count("empty_slot_counts_misses")
+    if base_counts is None:
+        counts = EmptySlotCounterCounts(played_mask)
+    else:
+        counts = base_counts.copy()
+        counts.add_played_cards(played_mask)
+    with _empty_slot_counts_lock:
+        _empty_slot_counts[played_mask] = counts
+        _shrink_empty_slot_counts()
+    return counts
+
+
+def get_counter_counts(opp_slot, played_mask):
+    # Counts for empty slots only depend on the played cards and are shared
+    # by all the empty slots of a turn, see get_empty_slot_counts
+    if len(opp_slot) == 0:
+        return get_empty_slot_counts(played_mask)
+    return SlotCounterCounts(opp_slot, played_mask)
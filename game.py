@@ -1,19 +1,31 @@
 import random
-import itertools
+import time
 import numpy as np
-from collections import defaultdict
-from collections.abc import MutableSet
-from proba_engine import ProbaEngine
-from combination_scoring import ScoringScheme
+import profiling
+from collections import namedtuple
 from card_combinations import CardCombinationsGenerator, CardCombination
-from game_elements import ALL_CARDS, Card
+from combination_table import get_combination_table
+from counter_combinations import get_counter_counts
+from move_evaluator import MoveEvaluator
+from game_observers import ConsoleObserver
+from zobrist import PLACEMENT_KEYS, SIDE_TO_MOVE_KEY, hand_key
+from slot_outcomes import get_decided_slot_winner, get_decided_slots
+from game_elements import CARDS_BY_INDEX, CardSet, cards_to_mask
 
 
-DEBUG =True
+DEBUG = False
 # seed = random.randrange(sys.maxsize)
 seed = 850806568202399433
-rng = random.Random(seed)
-print("Seed was:", seed)
+# Shuffles the decks of the games which are not seeded, see get_rng()
+rng = None
+
+
+def get_rng():
+    # The module rng is only created when a game needs it
+    global rng
+    if rng is None:
+        rng = random.Random(seed)
+    return rng
 
 
 
@@ -21,7 +33,7 @@ class HumanPlayer:
     def __init__(self, index=0):
         self.index = index
         self.opponent_index = 1 if self.index == 0 else 0
-        self.hand = set()
+        self.hand = CardSet()
 
     def make_move(self, game_state):
         cards_list = []
@@ -66,21 +78,83 @@ class HumanPlayer:
 
 
 class Player:
-    def __init__(self, index=0):
+    # skip_decided_slots: do not play in slots whose winner is already known
+    #   while other slots are left
+    # time_budget: seconds per move, see make_move(). None for no limit.
+    # scoring_scheme: ScoringScheme weighting the combinations a move can
+    #   lead to by their score, None to weight them all the same
+    # move_score_cache: MoveScoreCache to share move scores in, for example
+    #   move_evaluator.default_move_score_cache, None not to cache them. It
+    #   pays off when the same positions are evaluated again (replays,
+    #   benchmarks); in games most moves are new and evaluating them is
+    #   faster than the cache lookups.
+    def __init__(self, index=0, skip_decided_slots=False, time_budget=None, scoring_scheme=None,
+                 move_score_cache=None):
         self.index = index
         self.opponent_index = 1 if self.index == 0 else 0
-        self.hand = set()
+        self.hand = CardSet()
         self.ccg = CardCombinationsGenerator()
+        self.move_evaluator = MoveEvaluator(move_score_cache, scoring_scheme)
+        self.skip_decided_slots = skip_decided_slots
+        self.time_budget = time_budget
+        # Whether all the moves were evaluated by the last make_move()
+        self.last_move_finished = None
+
+    def make_move(self, game_state, deadline=None):
+        # deadline: time.perf_counter() value after which the best move found
+        # so far is played. Defaults to the time budget of the player.
+        # Moves are then scored slot by slot, the cheapest first (slots with
+        # the most cards have the fewest candidate combinations), and the
+        # deadline is checked between slots, see
+        # MoveEvaluator.evaluate_moves_until(). The moves of one slot are
+        # always scored.
+        profiler = profiling.active_profiler
+        if profiler is None:
+            return self._make_move(game_state, deadline)
+        profiler.begin_move()
+        move = self._make_move(game_state, deadline)
+        profiler.end_move(self.index)
+        return move
+
+    def _make_move(self, game_state, deadline):
+        if deadline is None and self.time_budget is not None:
+            deadline = time.perf_counter() + self.time_budget
+        slot_indexes = self.get_playable_slots(game_state)
+        moves_scores = self.get_moves_scores(game_state, slot_indexes, deadline)
+        self.last_move_finished = len(moves_scores) == len(slot_indexes) * len(self.hand)
+        return self.choose_move(moves_scores)
+
+    def make_moves(self, positions):
+        # One move per position (game_state, hand, index of the player to
+        # move), typically from different games, chosen as make_move() does
+        # with the settings of this player but without time budget. The moves
+        # of all the positions are evaluated together, see
+        # MoveEvaluator.evaluate_batch().
+        batch = []
+        for game_state, hand, index in positions:
+            batch.append((hand, game_state.slots[index], game_state.slots[1 - index],
+                          game_state.played_cards.mask, self.get_playable_slots(game_state, index)))
+        return [self.choose_move(moves_scores) for moves_scores in self.move_evaluator.evaluate_batch(batch)]
 
-    def make_move(self, game_state):
-        moves_scores = self.get_moves_scores(game_state)
+    @staticmethod
+    def choose_move(moves_scores):
+        profiler = profiling.active_profiler
+        if profiler is None:
+            return Player._choose_move(moves_scores)
+        start = time.perf_counter()
+        move = Player._choose_move(moves_scores)
+        profiler.add_time("ranking", time.perf_counter() - start)
+        return move
+
+    @staticmethod
+    def _choose_move(moves_scores):
         # Moves with exactly one combination with no counter move. Priority.
         zero_counter_eq_1 = []
         # Moves with one or more combination with no counter move. Good moves.
         zero_counter_gt_1 = []
         # Other moves to be sorted according to their score.
         zero_counter_0 = []
-        for move, scores in moves_scores:
+        for move, scores in moves_scores.items():
             if scores[0] == 1:
                 zero_counter_eq_1.append((move, scores[1]))
             elif scores[0] > 1:
@@ -107,63 +181,71 @@ class Player:
         s0 = sorted(zero_counter_0, key=lambda x: -x[1])
         return s0[0][0]
 
-    def get_moves_scores(self, game_state):
-        # caching for empty slots
-        empty_slot_scores = None
-
-        moves_scores = {}
-        for my_slot, opp_slot in zip(game_state.slots[self.index],
-                                    game_state.slots[self.opponent_index]):
-            if len(my_slot == 0) and empty_slot_scores is not None:
-                moves_scores = empty_slot_scores
-            else:
-                for card in self.hand:
-                    moves_scores[(card, my_slot)] = self.get_move_scores(card, my_slot, opp_slot, game_state)
-                if len(my_slot == 0):
-                    empty_slot_scores = moves_scores
+    def get_playable_slots(self, game_state, index=None):
+        # Slots which are not full. With skip_decided_slots, slots whose
+        # winner is known are left out unless they are the only ones.
+        # index: player to move, this player if None
+        if index is None:
+            index = self.index
+        my_slots = game_state.slots[index]
+        slot_indexes = [i for i in range(9) if len(my_slots[i]) < 3]
+        if self.skip_decided_slots:
+            decided_slots = get_decided_slots(my_slots, game_state.slots[1 - index],
+                                              game_state.played_cards.mask)
+            undecided_slots = [i for i in slot_indexes if i not in decided_slots]
+            if len(undecided_slots) > 0:
+                slot_indexes = undecided_slots
+        return slot_indexes
+
+    def get_moves_scores(self, game_state, slot_indexes=None, deadline=None):
+        # Scores of every move (slot index, card) on the playable slots, or
+        # on the slots in slot_indexes, see get_move_scores. All the moves
+        # are evaluated at once, or until the deadline when given.
+        if slot_indexes is None:
+            slot_indexes = self.get_playable_slots(game_state)
+        return self.move_evaluator.evaluate(self.hand,
+                                            game_state.slots[self.index],
+                                            game_state.slots[self.opponent_index],
+                                            game_state.played_cards.mask,
+                                            slot_indexes, deadline)
 
-        return moves_scores
-
-    # TODO: test this
     def get_move_scores(self, card, my_slot, opp_slot, game_state):
-        # Number of combinations with 0 winning counter combinations
-        n_zero_counter = 0
-        # Sum over possible combinations of the inverse number of
-        # winning counter combinations
-        move_score = 0
-
         # get playable combinations
+        played_mask = game_state.played_cards.mask
         if len(my_slot) == 0:
-            combs = self.ccg.get_combinations_from_card(card, game_state.played_cards)
+            comb_ids = self.ccg.get_combination_ids_from_card(card, played_mask)
         elif len(my_slot) == 1:
             slot_card, = my_slot
-            combs = self.ccg.get_combinations_from_pair_of_cards(card, slot_card, game_state.played_cards)
+            comb_ids = self.ccg.get_combination_ids_from_pair_of_cards(card, slot_card, played_mask)
         elif len(my_slot) == 2:
-            slot_card1, slots_card2, = my_slot
-            combs = [CardCombination(card, slot_card1, slots_card2)]
+            comb_ids = np.array([get_combination_table().id_by_mask[my_slot.mask | card.mask]])
         else:
             assert False
 
-        for comb in combs:
-            comb_score = 0
-            winning_counter_combs = self.get_winning_counter_combs(comb, opp_slot, game_state)
-            # Cannot be beaten
-            if len(winning_counter_combs) == 0:
-                n_zero_counter += 1
-            # Combination with same "power" only count for half
-            for wcc in winning_counter_combs:
-                if wcc == comb:
-                    comb_score += 0.5
-                else:
-                    comb_score += 1
-            move_score += 1 / comb_score
+        n_better, n_equal = get_counter_counts(opp_slot, played_mask).count(comb_ids)
+        # Combination with same "power" only count for half
+        comb_scores = n_better + 0.5 * n_equal
+        # Number of combinations with 0 winning counter combinations
+        # (cannot be beaten)
+        n_zero_counter = int(np.count_nonzero(comb_scores == 0))
+        # Sum over possible combinations of the inverse number of
+        # winning counter combinations
+        move_score = float(np.sum(1 / comb_scores[comb_scores > 0]))
 
         return n_zero_counter, move_score
 
+    def count_counter_combs(self, comb, opp_slot, game_state):
+        # Number of playable opponent combinations strictly stronger than comb
+        # and number of those as strong as comb (same category and value).
+        # Same combinations as get_winning_counter_combs, without building them
+        counts = get_counter_counts(opp_slot, game_state.played_cards.mask)
+        n_better, n_equal = counts.count(np.array([comb.id]))
+        return int(n_better[0]), int(n_equal[0])
+
     def get_winning_counter_combs(self, comb, opp_slot, game_state):
 
         if len(opp_slot) == 0:
-            playable_combs = self.ccg.get_all_combinations(game_state.played_cards | set(comb.cards))
+            playable_combs = self.ccg.get_all_combinations(game_state.played_cards.mask | comb.mask)
         elif len(opp_slot) == 1:
             slot_card, = opp_slot
             playable_combs = self.ccg.get_combinations_from_card(slot_card, game_state.played_cards)
@@ -182,52 +264,49 @@ class Player:
         return winning_counter_combs
 
 
-class Slot(MutableSet):
-
-    def __init__(self):
-        self.elements = set()
+class Slot(CardSet):
+    __slots__ = ()
 
     def add(self, element):
         if element in self:
             raise ValueError("Slot.add(): cannot have duplicate elements")
-        if len(self.elements) == 3:
+        if len(self) == 3:
             raise ValueError("Slot.add(): cannot have more than 3 elements")
         else:
-            self.elements.add(element)
+            self.mask |= element.mask
 
     def discard(self, element):
         raise NotImplementedError("Slot.discard(): cannot discard elements")
 
-    def __contains__(self, element):
-        return True if element in self.elements else False
-
-    def __iter__(self):
-        return self.elements.__iter__()
-
-    def __len__(self):
-        return len(self.elements)
 
-    def __repr__(self):
-        return self.elements.__repr__()
-
-    def __str__(self):
-        return self.elements.__str__()
+# Records to undo a move, returned by GameState.apply_move and Game.apply_move
+StateUndo = namedtuple("StateUndo", ["player_index", "slot_index", "card", "drawn_card"])
+MoveUndo = namedtuple("MoveUndo", ["state_undo", "set_first_to_finish", "claimed_slot_winners"])
 
 
 class GameState:
+    # Slots and played cards are card masks and the deck is a tuple shared by
+    # all the copies of a state, only the number of cards left being copied,
+    # so that clone(), snapshot() and restore() are cheap enough for search.
+    # key is the Zobrist key of the placements, see position_key().
+    __slots__ = ("slots", "played_cards", "key", "_deck", "_deck_size", "_is_init")
+
     def __init__(self, deck=None):
         self._is_init = False
         # Where players build their combinations
         self.slots = [[Slot() for _ in range(9)], [Slot() for _ in range(9)]]
-        self.played_cards = set()
+        self.played_cards = CardSet()
+        self.key = 0
+        # The deck is drawn from the end
         if deck is None:
-            self.deck = set([])
+            self.deck = ()
         else:
-            self.deck = set(deck)
+            self.deck = tuple(deck)
 
     def add_to_slot(self, player_index, slot_index, card):
         self.slots[player_index][slot_index].add(card)
         self.played_cards.add(card)
+        self.key ^= PLACEMENT_KEYS[player_index][slot_index][card.index]
 
     @property
     def deck(self):
@@ -239,6 +318,7 @@ class GameState:
     def deck(self, deck):
         if not self._is_init:
             self._deck = deck
+            self._deck_size = len(deck)
             self._is_init = True
         else:
             raise AttributeError("GameState.deck is private."
@@ -247,111 +327,246 @@ class GameState:
 
     @property
     def deck_size(self):
-        return len(self._deck)
+        return self._deck_size
+
+    def deck_cards(self):
+        # Cards left in the deck, the next one drawn last. Players must not
+        # look at them: this is for observers, such as game records.
+        return self._deck[:self._deck_size]
 
     def draw_deck(self):
-        return self._deck.pop()
+        if self._deck_size == 0:
+            raise IndexError("GameState.draw_deck(): the deck is empty")
+        self._deck_size -= 1
+        return self._deck[self._deck_size]
+
+    def remove_from_slot(self, player_index, slot_index, card):
+        slot = self.slots[player_index][slot_index]
+        if card not in slot:
+            raise ValueError("GameState.remove_from_slot(): {} is not in the slot".format(card))
+        slot.mask &= ~card.mask
+        self.played_cards.discard(card)
+        self.key ^= PLACEMENT_KEYS[player_index][slot_index][card.index]
+
+    def undraw_deck(self, card):
+        # Puts back the last card drawn
+        if self._deck_size == len(self._deck) or self._deck[self._deck_size] != card:
+            raise ValueError("GameState.undraw_deck(): {} is not the last card drawn".format(card))
+        self._deck_size += 1
+
+    def apply_move(self, player_index, slot_index, card):
+        # Adds card to the slot and draws a card if the deck is not empty.
+        # Returns the record undo_move() needs.
+        self.add_to_slot(player_index, slot_index, card)
+        drawn_card = self.draw_deck() if self._deck_size > 0 else None
+        return StateUndo(player_index, slot_index, card, drawn_card)
+
+    def undo_move(self, undo):
+        if undo.drawn_card is not None:
+            self.undraw_deck(undo.drawn_card)
+        self.remove_from_slot(undo.player_index, undo.slot_index, undo.card)
+
+    def snapshot(self):
+        # Immutable record of the state, see restore()
+        return (tuple(slot.mask for slot in self.slots[0]), tuple(slot.mask for slot in self.slots[1]),
+                self.played_cards.mask, self.key, self._deck, self._deck_size)
+
+    def restore(self, snapshot):
+        # Puts the state back as it was when snapshot was taken
+        slot_masks0, slot_masks1, played_mask, self.key, self._deck, self._deck_size = snapshot
+        for slot, mask in zip(self.slots[0], slot_masks0):
+            slot.mask = mask
+        for slot, mask in zip(self.slots[1], slot_masks1):
+            slot.mask = mask
+        self.played_cards.mask = played_mask
+
+    @staticmethod
+    def from_snapshot(snapshot):
+        game_state = GameState()
+        game_state.restore(snapshot)
+        return game_state
+
+    def clone(self):
+        # Independent copy of the state
+        return GameState.from_snapshot(self.snapshot())
+
+    def position_key(self, side_to_move, hand=None):
+        # 64 bits key of the position with side_to_move to play, and the
+        # hand of that player if given
+        key = self.key
+        if side_to_move == 1:
+            key ^= SIDE_TO_MOVE_KEY
+        if hand is not None:
+            key ^= hand_key(cards_to_mask(hand))
+        return key
 
 
 class Game:
-    def __init__(self, player0, player1):
+    # seed: seed of the deck shuffle. The module level rng is used if None.
+    # early_claims: slots whose winner is already known count as won before
+    #   they are complete, so that the game may end earlier
+    def __init__(self, player0, player1, seed=None, early_claims=False):
         self.players = [player0, player1]
         self.players[0].index = 0
+        self.players[0].opponent_index = 1
         self.players[1].index = 1
+        self.players[1].opponent_index = 0
         self.first_to_finish_slot = [None for _ in range(9)]
-
-        cards = list(ALL_CARDS)
-        rng.shuffle(cards)
+        self.early_claims = early_claims
+        # Winners of the slots decided before they are complete, claimed in
+        # apply_move(). Claimed slots stay decided, they are not checked again.
+        self.claimed_slot_winners = [None for _ in range(9)]
+        self.n_turns = 0
+        self.observers = []
+
+        self.seed = seed
+        cards = list(CARDS_BY_INDEX)
+        if seed is None:
+            get_rng().shuffle(cards)
+        else:
+            random.Random(seed).shuffle(cards)
         for i in range(6):
             self.players[0].hand.add(cards.pop())
             self.players[1].hand.add(cards.pop())
         self.game_state = GameState(cards)
 
+    def add_observer(self, observer):
+        self.observers.append(observer)
+
+    def remove_observer(self, observer):
+        self.observers.remove(observer)
+
     def player_turn(self, player_index):
+        # Observers are notified once the move is played and the card drawn.
+        # Returns the record to undo the move.
         slot_index, card = self.players[player_index].make_move(self.game_state)
         assert(card in self.players[player_index].hand)
-
-        self.game_state.add_to_slot(player_index, slot_index, card)
-        if len(self.game_state.slots[player_index][slot_index]) == 3 and \
-                self.first_to_finish_slot[slot_index] is None:
+        return self.play_move(player_index, slot_index, card)
+
+    def play_move(self, player_index, slot_index, card):
+        # apply_move() notifying observers, for moves chosen outside of
+        # player_turn(). Returns the record to undo the move.
+        undo = self.apply_move(player_index, slot_index, card)
+
+        if self.observers:
+            slot_completed = len(self.game_state.slots[player_index][slot_index]) == 3
+            drawn_card = undo.state_undo.drawn_card
+            for observer in self.observers:
+                observer.on_move_played(self, player_index, slot_index, card)
+                if slot_completed:
+                    observer.on_slot_completed(self, player_index, slot_index)
+            if drawn_card is not None:
+                for observer in self.observers:
+                    observer.on_card_drawn(self, player_index, drawn_card)
+            for observer in self.observers:
+                observer.on_turn_end(self, player_index)
+        return undo
+
+    def apply_move(self, player_index, slot_index, card):
+        # Plays card from the hand of the player and draws a card, without
+        # notifying observers. Returns the record undo_move() needs.
+        claimed_slot_winners = tuple(self.claimed_slot_winners)
+        hand = self.players[player_index].hand
+        if card not in hand:
+            raise ValueError("Game.apply_move(): {} is not in the hand of player {}".format(card, player_index))
+        state_undo = self.game_state.apply_move(player_index, slot_index, card)
+        hand.remove(card)
+        if state_undo.drawn_card is not None:
+            hand.add(state_undo.drawn_card)
+
+        set_first_to_finish = False
+        if len(self.game_state.slots[player_index][slot_index]) == 3 \
+                and self.first_to_finish_slot[slot_index] is None:
             self.first_to_finish_slot[slot_index] = player_index
-
-        self.players[player_index].hand.remove(card)
-
-        if self.game_state.deck_size > 0:
-            self.players[player_index].hand.add(self.game_state.draw_deck())
+            set_first_to_finish = True
+        if self.early_claims:
+            self.claim_decided_slots()
+        self.n_turns += 1
+        return MoveUndo(state_undo, set_first_to_finish, claimed_slot_winners)
+
+    def claim_decided_slots(self):
+        # Claims the incomplete slots whose winner is known
+        played_mask = self.game_state.played_cards.mask
+        for i, (slot0, slot1) in enumerate(zip(self.game_state.slots[0], self.game_state.slots[1])):
+            if self.claimed_slot_winners[i] is None and (len(slot0) < 3 or len(slot1) < 3):
+                self.claimed_slot_winners[i] = get_decided_slot_winner(slot0, slot1, played_mask,
+                                                                       self.first_to_finish_slot[i])
+
+    def undo_move(self, undo):
+        # Puts the game back as it was before the move, moves being undone
+        # in the reverse order they were applied
+        state_undo = undo.state_undo
+        hand = self.players[state_undo.player_index].hand
+        if state_undo.drawn_card is not None:
+            hand.remove(state_undo.drawn_card)
+        hand.add(state_undo.card)
+        self.game_state.undo_move(state_undo)
+        if undo.set_first_to_finish:
+            self.first_to_finish_slot[state_undo.slot_index] = None
+        self.claimed_slot_winners = list(undo.claimed_slot_winners)
+        self.n_turns -= 1
 
     def game_winner(self):
         player_n_slot_won = [0, 0]
-        for i, (slot0, slot1) in enumerate(zip(self.game_state.slots[0], self.game_state.slots[1])):
-            if len(slot0) == 3 and len(slot1) == 3:
-                slot_winner = self.get_slot_winner(i)
-                if slot_winner is not None:
-                    player_n_slot_won[slot_winner] += 1
-        if player_n_slot_won[0] == 5:
+        for slot_winner in self.slot_winners():
+            if slot_winner is not None:
+                player_n_slot_won[slot_winner] += 1
+        if player_n_slot_won[0] >= 5:
             return 0
-        elif player_n_slot_won[1] == 5:
+        elif player_n_slot_won[1] >= 5:
             return 1
         else:
             return None
 
+    def slot_winners(self):
+        # Winner of each slot, None if the slot is not finished, or with
+        # early claims, not claimed yet
+        winners = []
+        for i, (slot0, slot1) in enumerate(zip(self.game_state.slots[0], self.game_state.slots[1])):
+            if len(slot0) == 3 and len(slot1) == 3:
+                winners.append(self.get_slot_winner(i))
+            else:
+                winners.append(self.claimed_slot_winners[i])
+        return winners
+
     def get_slot_winner(self, slot_index):
-        (card1, card2, card3, ) = self.game_state.slots[0][slot_index]
-        p0_comb = CardCombination(card1, card2, card3)
-        (card1, card2, card3, ) = self.game_state.slots[1][slot_index]
-        p1_comb = CardCombination(card1, card2, card3)
-        if p0_comb.category > p1_comb.category:
+        table = get_combination_table()
+        p0_rank = table.rank_list[table.id_by_mask[self.game_state.slots[0][slot_index].mask]]
+        p1_rank = table.rank_list[table.id_by_mask[self.game_state.slots[1][slot_index].mask]]
+        # Same rank: same category and value
+        if p0_rank > p1_rank:
             return 0
-        elif p0_comb.category == p1_comb.category and p0_comb.value > p1_comb.value:
-            return 0
-        elif p0_comb.category < p1_comb.category:
-            return 1
-        elif p0_comb.category == p1_comb.category and p0_comb.value < p1_comb.value:
+        elif p0_rank < p1_rank:
             return 1
         else:
             return self.first_to_finish_slot[slot_index]
 
-    @staticmethod
-    def display_slot(slot_index, slot):
-        if len(slot) == 3:
-            (c1, c2, c3,) = slot
-            comb = CardCombination(c1, c2, c3)
-            print("  - {}: {}".format(slot_index + 1, comb))
-        else:
-            print("  - {}: {}".format(slot_index + 1, slot))
-
-    def display_game(self):
-        print("deck_size: {}".format(self.game_state.deck_size))
-        print("--")
-        print("p0 hand: {}".format(self.players[0].hand))
-        for i, slot in enumerate(self.game_state.slots[0]):
-            Game.display_slot(i, slot)
-        print("--")
-        print("p1 hand: {}".format(self.players[1].hand))
-        for i, slot in enumerate(self.game_state.slots[1]):
-            Game.display_slot(i, slot)
+    def run(self):
+        # Plays the game until the end and returns the winner. Nothing is
+        # displayed unless an observer does it, see play().
+        if self.observers:
+            for observer in self.observers:
+                observer.on_game_start(self)
 
-    def play(self):
-        self.display_game()
-        print("")
         game_over = None
         while game_over is None:
             self.player_turn(0)
-            self.display_game()
             self.player_turn(1)
-            self.display_game()
             game_over = self.game_winner()
-            print("")
 
-        print("Winner: {}".format(self.game_winner()))
-        for i, (slot0, slot1) in enumerate(zip(self.game_state.slots[0], self.game_state.slots[1])):
-            slot_winner = None
-            if len(slot0) == 3 and len(slot1) == 3:
-                slot_winner = self.get_slot_winner(i)
-            print("Winner for slot {}: player {}".format(i, slot_winner))
-            print(Game.display_slot(i, slot0))
-            print(Game.display_slot(i, slot1))
-            print("--")
+        if self.observers:
+            for observer in self.observers:
+                observer.on_game_over(self, game_over)
+        return game_over
+
+    def play(self):
+        # Plays the game on the console
+        console_observer = ConsoleObserver()
+        self.add_observer(console_observer)
+        try:
+            return self.run()
+        finally:
+            self.remove_observer(console_observer)
 
 
 
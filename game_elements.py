@@ -1,12 +1,24 @@
 import itertools
+from collections.abc import MutableSet
 
 # Globals for the time being
 CARD_COLORS = {"red", "blue", "green", "brown", "purple", "yellow"}
 CARD_NUMBERS = set(range(1, 10))
 MAX_CARDS_PER_HAND = 6
 
+# Canonical card encoding. Cards are indexed from 0 to 53 by increasing
+# number first and color second, so that the index order is the Card order.
+# A set of cards is encoded as a 54-bit integer mask in which bit i is set
+# if the card of index i belongs to the set.
+SORTED_CARD_COLORS = sorted(CARD_COLORS)
+COLOR_INDEXES = {color: i for i, color in enumerate(SORTED_CARD_COLORS)}
+N_CARDS = len(CARD_COLORS) * len(CARD_NUMBERS)
+ALL_CARDS_MASK = (1 << N_CARDS) - 1
+
 
 class Card:
+    __slots__ = ("color", "number", "index", "mask")
+
     def __init__(self, color, number):
         if color not in CARD_COLORS:
             raise ValueError("Card: invalid color value {}".format(color))
@@ -14,24 +26,25 @@ class Card:
             raise ValueError("Card: invalid number value {}".format(repr(number)))
         self.color = color
         self.number = number
+        self.index = (number - 1) * len(SORTED_CARD_COLORS) + COLOR_INDEXES[color]
+        self.mask = 1 << self.index
+
+    @staticmethod
+    def from_index(index):
+        return CARDS_BY_INDEX[index]
 
     def __eq__(self, other):
-        if self.color == other.color and self.number == other.number:
-            return True
-        return False
+        return self.index == other.index
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
     def __lt__(self, other):
-        if self.number < other.number:
-            return True
-        if self.number == other.number and self.color < other.color:
-            return True
-        return False
+        # Same as comparing numbers then colors
+        return self.index < other.index
 
     def __hash__(self):
-        return hash((self.color, self.number))
+        return self.index
 
     def __str__(self):
         return "Card({}, {})".format(self.color, self.number)
@@ -40,5 +53,81 @@ class Card:
         return "Card(\"{}\", {})".format(self.color, self.number)
 
 
-ALL_CARDS = {Card(c, n) for c, n in itertools.product(CARD_COLORS, CARD_NUMBERS)}
+CARDS_BY_INDEX = [Card(c, n) for n, c in itertools.product(sorted(CARD_NUMBERS), SORTED_CARD_COLORS)]
+ALL_CARDS = set(CARDS_BY_INDEX)
+
+
+def cards_to_mask(cards):
+    # Accepts a mask, a CardSet or any iterable of cards
+    if isinstance(cards, int):
+        return cards
+    if isinstance(cards, CardSet):
+        return cards.mask
+    mask = 0
+    for card in cards:
+        mask |= card.mask
+    return mask
+
+
+def mask_to_cards(mask):
+    # Cards are returned by increasing index
+    cards = []
+    while mask:
+        low_bit = mask & -mask
+        cards.append(CARDS_BY_INDEX[low_bit.bit_length() - 1])
+        mask ^= low_bit
+    return cards
+
+
+# Set of cards backed by a card mask
+class CardSet(MutableSet):
+    __slots__ = ("mask",)
+
+    def __init__(self, cards=()):
+        self.mask = cards_to_mask(cards)
+
+    def add(self, card):
+        self.mask |= card.mask
+
+    def discard(self, card):
+        self.mask &= ~card.mask
 
+    def copy(self):
+        return CardSet(self.mask)
+
+    def isdisjoint(self, other):
+        if isinstance(other, CardSet):
+            return self.mask & other.mask == 0
+        return super().isdisjoint(other)
+
+    def __or__(self, other):
+        if isinstance(other, CardSet):
+            return CardSet(self.mask | other.mask)
+        return super().__or__(other)
+
+    def __and__(self, other):
+        if isinstance(other, CardSet):
+            return CardSet(self.mask & other.mask)
+        return super().__and__(other)
+
+    def __sub__(self, other):
+        if isinstance(other, CardSet):
+            return CardSet(self.mask & ~other.mask)
+        return super().__sub__(other)
+
+    def __contains__(self, card):
+        return self.mask & card.mask != 0
+
+    def __iter__(self):
+        return iter(mask_to_cards(self.mask))
+
+    def __len__(self):
+        return self.mask.bit_count()
+
+    def __repr__(self):
+        if self.mask == 0:
+            return "set()"
+        return "{" + ", ".join(repr(card) for card in self) + "}"
+
+    def __str__(self):
+        return self.__repr__()
@@ -0,0 +1,72 @@
+from card_combinations import CardCombination
+
+# Observers are notified of the events of a Game they are attached to with
+# Game.add_observer(). Events are only emitted when at least one observer is
+# attached. The events of a move are emitted once it is played and the card
+# drawn.
+
+
+class GameObserver:
+    # All the events do nothing: observers override the ones they need
+
+    def on_game_start(self, game):
+        pass
+
+    def on_move_played(self, game, player_index, slot_index, card):
+        pass
+
+    def on_slot_completed(self, game, player_index, slot_index):
+        pass
+
+    def on_card_drawn(self, game, player_index, card):
+        pass
+
+    def on_turn_end(self, game, player_index):
+        pass
+
+    def on_game_over(self, game, winner):
+        pass
+
+
+class ConsoleObserver(GameObserver):
+    # Prints the game as it goes
+
+    @staticmethod
+    def display_slot(slot_index, slot):
+        if len(slot) == 3:
+            (c1, c2, c3,) = slot
+            comb = CardCombination(c1, c2, c3)
+            print("  - {}: {}".format(slot_index + 1, comb))
+        else:
+            print("  - {}: {}".format(slot_index + 1, slot))
+
+    @staticmethod
+    def display_game(game):
+        print("deck_size: {}".format(game.game_state.deck_size))
+        print("--")
+        print("p0 hand: {}".format(game.players[0].hand))
+        for i, slot in enumerate(game.game_state.slots[0]):
+            ConsoleObserver.display_slot(i, slot)
+        print("--")
+        print("p1 hand: {}".format(game.players[1].hand))
+        for i, slot in enumerate(game.game_state.slots[1]):
+            ConsoleObserver.display_slot(i, slot)
+
+    def on_game_start(self, game):
+        if game.seed is not None:
+            print("Seed was:", game.seed)
+        self.display_game(game)
+        print("")
+
+    def on_turn_end(self, game, player_index):
+        self.display_game(game)
+        if player_index == 1:
+            print("")
+
+    def on_game_over(self, game, winner):
+        print("Winner: {}".format(winner))
+        for i, slot_winner in enumerate(game.slot_winners()):
+            print("Winner for slot {}: player {}".format(i, slot_winner))
+            self.display_slot(i, game.game_state.slots[0][i])
+            self.display_slot(i, game.game_state.slots[1][i])
+            print("--")
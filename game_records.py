@@ -0,0 +1,106 @@
+import gzip
+import json
+from game_elements import N_CARDS
+from game_observers import GameObserver
+
+# Game records, one JSON line per game:
+#
+#   {"v": 1, "seed": 42, "hands": [[...], [...]], "deck": [...],
+#    "moves": [...], "winner": 0, "n_turns": 50, "slot_winners": [...]}
+#
+# Cards are card indexes (see game_elements.Card). hands are the initial
+# hands, deck the initial deck, drawn from the end. Each move (player
+# index, slot index, card index) is packed in one integer, see encode_move.
+# seed is None when the game was not seeded.
+#
+# Files are opened in append mode, and compressed with gzip when their name
+# ends with ".gz". Records are read lazily, one line at a time.
+
+RECORD_VERSION = 1
+
+
+def encode_move(player_index, slot_index, card_index):
+    return (player_index * 9 + slot_index) * N_CARDS + card_index
+
+
+def decode_move(move_code):
+    # Returns (player index, slot index, card index)
+    player_slot, card_index = divmod(move_code, N_CARDS)
+    player_index, slot_index = divmod(player_slot, 9)
+    return player_index, slot_index, card_index
+
+
+def get_moves(record):
+    return [decode_move(move_code) for move_code in record["moves"]]
+
+
+class GameRecorder(GameObserver):
+    # Builds the record of the game it observes from the start. The record
+    # is complete once the game is over.
+
+    def __init__(self):
+        self.record = None
+
+    def on_game_start(self, game):
+        game_state = game.game_state
+        # The deck is private to players, not to observers
+        deck = game_state.deck_cards()
+        self.record = {"v": RECORD_VERSION,
+                       "seed": game.seed,
+                       "hands": [[card.index for card in player.hand] for player in game.players],
+                       "deck": [card.index for card in deck],
+                       "moves": []}
+
+    def on_move_played(self, game, player_index, slot_index, card):
+        self.record["moves"].append(encode_move(player_index, slot_index, card.index))
+
+    def on_game_over(self, game, winner):
+        self.record["winner"] = winner
+        self.record["n_turns"] = game.n_turns
+        self.record["slot_winners"] = game.slot_winners()
+
+
+def open_records_file(path, mode):
+    # Text file, gzipped if its name ends with ".gz"
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class GameRecordWriter:
+    # Appends records to a file:
+    #     with GameRecordWriter("games.jsonl.gz") as writer:
+    #         writer.write(record)
+
+    def __init__(self, path):
+        self.path = path
+        self.n_records = 0
+        self._file = open_records_file(path, "a")
+
+    def write(self, record):
+        self._file.write(json.dumps(record, separators=(",", ":")))
+        self._file.write("\n")
+        self.n_records += 1
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_game_records(path):
+    # Iterates over the records of a file without loading it
+    with open_records_file(path, "r") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                if record.get("v") != RECORD_VERSION:
+                    raise ValueError("read_game_records: unsupported record version {}".format(record.get("v")))
+                yield record
@@ -0,0 +1,514 @@
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import itertools
+import json
+import os
+import pickle
+import threading
+from game import Game, GameState, Player
+from game_elements import CARDS_BY_INDEX, CardSet
+from game_observers import GameObserver
+from self_play import make_player
+from tournament import load_entrants
+
+# Asyncio server hosting many games at once, over TCP or a Unix socket.
+#
+# The protocol is line-delimited JSON: each message is a JSON object on one
+# line, with a "type". Cards are card indexes (see game_elements.Card),
+# slots are slot indexes from 0 to 8. Client messages:
+#
+#   {"type": "bots"}                                  names of the bots
+#   {"type": "new_game", "opponent": "player", "seat": 0, "seed": null,
+#    "early_claims": false}                           new game against a bot,
+#                                                     or "human" to wait for
+#                                                     another client to join
+#   {"type": "join", "game_id": 1}                    free seat of a game
+#   {"type": "move", "game_id": 1, "slot": 4, "card": 12}
+#   {"type": "state", "game_id": 1}
+#
+# Server messages are "bots", "game_created" (game id and seat of the
+# client), "state" (hand of the client, slots, deck size and whether the
+# client is to move, sent when the game starts and before each move of the
+# client), "move_played", "game_over" (winner is null when a client left
+# the game) and "error".
+#
+# The seats of a game are pluggable: a seat is the player of a Game and
+# returns moves from a coroutine. Human seats wait for the moves of their
+# client; bot seats run a player (a player spec, see self_play) in an
+# executor, so that a bot thinking does not stall the other games. Bots are
+# built from their spec once per worker (process or thread) and reused for
+# every move, which gives them the state of the game. They can be run on a
+# process pool, or on threads: the caches the players of a process share
+# are safe to use from several threads.
+#
+# The moves that bots of the same spec are waiting for are batched (see
+# BotBatcher): they are evaluated together by Player.make_moves(), so that
+# the more games are played, the less each move costs. The time budget of
+# Players does not apply to batched moves.
+
+
+# Players of the worker, by spec and index, see get_bot_player()
+_bot_players = threading.local()
+
+
+def get_bot_player(player_spec, player_index):
+    players = getattr(_bot_players, "players", None)
+    if players is None:
+        players = _bot_players.players = {}
+    # Specs hold dicts of arguments: they are told apart by their pickle,
+    # which they must have to be sent to worker processes anyway
+    key = (pickle.dumps(player_spec), player_index)
+    player = players.get(key)
+    if player is None:
+        player = players[key] = make_player(player_spec, player_index)
+    return player
+
+
+def _bot_move(player_spec, player_index, hand_mask, snapshot):
+    player = get_bot_player(player_spec, player_index)
+    player.hand = CardSet(hand_mask)
+    slot_index, card = player.make_move(GameState.from_snapshot(snapshot))
+    return slot_index, card.index
+
+
+def _bot_moves(player_spec, positions):
+    # Moves of positions (player index, hand mask, snapshot), one by one for
+    # players which cannot make moves by batches
+    player = get_bot_player(player_spec, 0)
+    if not hasattr(player, "make_moves"):
+        return [_bot_move(player_spec, *position) for position in positions]
+    moves = player.make_moves([(GameState.from_snapshot(snapshot), CardSet(hand_mask), player_index)
+                               for player_index, hand_mask, snapshot in positions])
+    return [(slot_index, card.index) for slot_index, card in moves]
+
+
+class BotBatcher:
+    # Moves of the bots of a spec, sent to the executor by batches. A batch
+    # is sent as soon as one of max_batches is free, with the moves waiting
+    # then, up to max_batch_size: moves wait for each other only when the
+    # executor is busy.
+
+    def __init__(self, player_spec, executor=None, max_batch_size=32, max_batches=1):
+        self.player_spec = player_spec
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self._free_batches = asyncio.Semaphore(max_batches)
+        # (future, position) of the moves waiting
+        self._pending = collections.deque()
+        self._tasks = set()
+        self._dispatch_task = None
+
+    async def get_move(self, player_index, hand_mask, snapshot):
+        # (slot index, card index) of the position
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((future, (player_index, hand_mask, snapshot)))
+        if self._dispatch_task is None or self._dispatch_task.done():
+            self._dispatch_task = self._create_task(self._dispatch())
+        return await future
+
+    def _create_task(self, coroutine):
+        # Tasks are referenced until they are done
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _dispatch(self):
+        while self._pending:
+            await self._free_batches.acquire()
+            batch = []
+            while self._pending and len(batch) < self.max_batch_size:
+                future, position = self._pending.popleft()
+                # Moves of abandoned games are cancelled
+                if not future.done():
+                    batch.append((future, position))
+            if batch:
+                self._create_task(self._run_batch(batch))
+            else:
+                self._free_batches.release()
+
+    async def _run_batch(self, batch):
+        try:
+            moves = await asyncio.get_running_loop().run_in_executor(
+                self.executor, _bot_moves, self.player_spec, [position for _, position in batch])
+            for (future, _), move in zip(batch, moves):
+                if not future.done():
+                    future.set_result(move)
+        except Exception as e:
+            for future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._free_batches.release()
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+class Seat:
+    # Player of a served game. The game sets index and deals the hand.
+
+    def __init__(self):
+        self.index = None
+        self.opponent_index = None
+        self.hand = CardSet()
+
+    async def ready(self):
+        # Returns once the seat can play
+        pass
+
+    async def get_move(self, served_game):
+        # (slot index, card) of the seat, to move in served_game
+        raise NotImplementedError
+
+    def send(self, message):
+        # Message of the game for the seat
+        pass
+
+
+class BotSeat(Seat):
+    # executor: where the bot thinks, the default executor of the loop if None
+    # batcher: BotBatcher of the spec to batch moves with, None to send them
+    #   one by one to executor
+    def __init__(self, player_spec, executor=None, batcher=None):
+        super().__init__()
+        self.player_spec = player_spec
+        self.executor = executor
+        self.batcher = batcher
+
+    async def get_move(self, served_game):
+        snapshot = served_game.game.game_state.snapshot()
+        if self.batcher is not None:
+            slot_index, card_index = await self.batcher.get_move(self.index, self.hand.mask, snapshot)
+        else:
+            loop = asyncio.get_running_loop()
+            slot_index, card_index = await loop.run_in_executor(
+                self.executor, _bot_move, self.player_spec, self.index, self.hand.mask, snapshot)
+        return slot_index, CARDS_BY_INDEX[card_index]
+
+
+class HumanSeat(Seat):
+    # Seat played by a client connection, None until a client joins it
+    def __init__(self, connection=None):
+        super().__init__()
+        self.connection = None
+        self._joined = asyncio.Event()
+        self._moves = asyncio.Queue()
+        if connection is not None:
+            self.join(connection)
+
+    def join(self, connection):
+        self.connection = connection
+        self._joined.set()
+
+    async def ready(self):
+        await self._joined.wait()
+
+    def put_move(self, slot_index, card_index):
+        # One move at a time: the client sends its next move once it has seen
+        # the state the pending one leads to
+        if not self._moves.empty():
+            raise ValueError("HumanSeat.put_move: a move is already pending")
+        self._moves.put_nowait((slot_index, card_index))
+
+    async def get_move(self, served_game):
+        served_game.send_state(self)
+        while True:
+            slot_index, card_index = await self._moves.get()
+            try:
+                return served_game.check_move(self.index, slot_index, card_index)
+            except ValueError as e:
+                self.send({"type": "error", "game_id": served_game.game_id, "message": str(e)})
+
+    def send(self, message):
+        if self.connection is not None:
+            self.connection.send(message)
+
+
+class ServedGame(GameObserver):
+    def __init__(self, game_id, seats, seed=None, early_claims=False):
+        self.game_id = game_id
+        self.seats = seats
+        self.game = Game(seats[0], seats[1], seed=seed, early_claims=early_claims)
+        self.game.add_observer(self)
+        # Index of the player whose move is awaited
+        self.to_move = None
+        self.winner = None
+        self.task = None
+
+    def get_state(self, seat):
+        game_state = self.game.game_state
+        return {"type": "state", "game_id": self.game_id, "seat": seat.index,
+                "hand": [card.index for card in seat.hand],
+                "slots": [[[card.index for card in slot] for slot in slots] for slots in game_state.slots],
+                "deck_size": game_state.deck_size,
+                "slot_winners": self.game.slot_winners(),
+                "to_move": self.to_move == seat.index}
+
+    def send_state(self, seat):
+        seat.send(self.get_state(seat))
+
+    def broadcast(self, message):
+        for seat in self.seats:
+            seat.send(message)
+
+    def check_move(self, player_index, slot_index, card_index):
+        # Returns the move as (slot index, card), raises ValueError if it is
+        # not legal
+        if not isinstance(slot_index, int) or not 0 <= slot_index < 9:
+            raise ValueError("ServedGame.check_move: invalid slot {}".format(slot_index))
+        if len(self.game.game_state.slots[player_index][slot_index]) == 3:
+            raise ValueError("ServedGame.check_move: slot {} is full".format(slot_index))
+        if not isinstance(card_index, int) or not 0 <= card_index < len(CARDS_BY_INDEX) \
+                or CARDS_BY_INDEX[card_index] not in self.seats[player_index].hand:
+            raise ValueError("ServedGame.check_move: card {} is not in the hand".format(card_index))
+        return slot_index, CARDS_BY_INDEX[card_index]
+
+    async def run(self):
+        # Plays the game as Game.run() does, and returns the winner
+        try:
+            for seat in self.seats:
+                await seat.ready()
+            for observer in self.game.observers:
+                observer.on_game_start(self.game)
+            while self.winner is None:
+                for player_index in range(2):
+                    self.to_move = player_index
+                    slot_index, card = await self.seats[player_index].get_move(self)
+                    slot_index, card = self.check_move(player_index, slot_index, card.index)
+                    self.to_move = None
+                    self.game.play_move(player_index, slot_index, card)
+                self.winner = self.game.game_winner()
+            for observer in self.game.observers:
+                observer.on_game_over(self.game, self.winner)
+            return self.winner
+        except asyncio.CancelledError:
+            self.broadcast({"type": "game_over", "game_id": self.game_id, "winner": None, "abandoned": True})
+            raise
+
+    def on_game_start(self, game):
+        for seat in self.seats:
+            self.send_state(seat)
+
+    def on_move_played(self, game, player_index, slot_index, card):
+        self.broadcast({"type": "move_played", "game_id": self.game_id, "player_index": player_index,
+                        "slot": slot_index, "card": card.index})
+
+    def on_game_over(self, game, winner):
+        self.broadcast({"type": "game_over", "game_id": self.game_id, "winner": winner,
+                        "slot_winners": game.slot_winners(), "n_turns": game.n_turns})
+
+
+class Connection:
+    # A client of the server, which may play several games at once
+
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        # game id -> HumanSeat of the client
+        self.seats = {}
+
+    def send(self, message):
+        self.writer.write(json.dumps(message, separators=(",", ":")).encode() + b"\n")
+
+    async def run(self):
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    self.handle(json.loads(line))
+                except (ValueError, KeyError, TypeError) as e:
+                    self.send({"type": "error", "message": str(e)})
+                await self.writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            # The games of the client are abandoned
+            for game_id, seat in list(self.seats.items()):
+                seat.connection = None
+                self.server.abandon(game_id)
+            self.seats.clear()
+            self.writer.close()
+
+    def get_served_game(self, message):
+        game_id = message["game_id"]
+        if game_id not in self.seats:
+            raise ValueError("Connection.handle: not in game {}".format(game_id))
+        return self.server.games[game_id]
+
+    def handle(self, message):
+        message_type = message["type"]
+        if message_type == "bots":
+            self.send({"type": "bots", "bots": sorted(self.server.bots)})
+        elif message_type == "new_game":
+            seat_index = message.get("seat", 0)
+            if seat_index not in (0, 1):
+                raise ValueError("Connection.handle: invalid seat {}".format(seat_index))
+            seat = HumanSeat(self)
+            opponent = message.get("opponent", "human")
+            opponent_seat = HumanSeat() if opponent == "human" else self.server.get_bot_seat(opponent)
+            seats = [seat, opponent_seat] if seat_index == 0 else [opponent_seat, seat]
+            served_game = self.server.new_game(seats, message.get("seed"), message.get("early_claims", False))
+            self.seats[served_game.game_id] = seat
+            self.send({"type": "game_created", "game_id": served_game.game_id, "seat": seat_index,
+                       "opponent": opponent})
+        elif message_type == "join":
+            game_id = message["game_id"]
+            served_game = self.server.games.get(game_id)
+            free_seats = [] if served_game is None else [seat for seat in served_game.seats
+                                                        if isinstance(seat, HumanSeat) and seat.connection is None]
+            if not free_seats:
+                raise ValueError("Connection.handle: no free seat in game {}".format(game_id))
+            self.seats[game_id] = free_seats[0]
+            self.send({"type": "game_created", "game_id": game_id, "seat": free_seats[0].index,
+                       "opponent": "human"})
+            free_seats[0].join(self)
+        elif message_type == "move":
+            served_game = self.get_served_game(message)
+            seat = self.seats[served_game.game_id]
+            if served_game.to_move != seat.index:
+                raise ValueError("Connection.handle: not your turn in game {}".format(served_game.game_id))
+            seat.put_move(message["slot"], message["card"])
+        elif message_type == "state":
+            served_game = self.get_served_game(message)
+            served_game.send_state(self.seats[served_game.game_id])
+        else:
+            raise ValueError("Connection.handle: unknown message type {}".format(message_type))
+
+
+class GameServer:
+    # bots: name -> player spec of the bots clients can play against
+    # executor: where bots think, a process pool of n_workers processes if
+    #   None
+    # max_games: games hosted at once
+    # max_batch_size: bot moves evaluated together, 1 not to batch them
+    # max_batches: batches of a bot thinking at once, n_workers or the
+    #   number of CPUs if None
+    def __init__(self, bots=None, executor=None, n_workers=None, max_games=1000, max_batch_size=32,
+                 max_batches=None):
+        self.bots = {"player": Player} if bots is None else dict(bots)
+        self._own_executor = executor is None
+        self.executor = concurrent.futures.ProcessPoolExecutor(n_workers) if executor is None else executor
+        self.max_games = max_games
+        self.max_batch_size = max_batch_size
+        if max_batches is None:
+            max_batches = os.cpu_count() if n_workers is None else n_workers
+        self.max_batches = max_batches
+        # bot name -> BotBatcher, created with the first game of the bot
+        self.batchers = {}
+        # game id -> ServedGame, while it is played
+        self.games = {}
+        self._game_ids = itertools.count(1)
+        # Connection -> task handling it
+        self.connections = {}
+        self.server = None
+
+    async def start(self, host="127.0.0.1", port=0, path=None):
+        # Listens on a Unix socket if path is given, on TCP otherwise. Port 0
+        # picks a free port, see get_address().
+        if path is not None:
+            self.server = await asyncio.start_unix_server(self.handle_connection, path)
+        else:
+            self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server
+
+    def get_address(self):
+        return self.server.sockets[0].getsockname()
+
+    async def handle_connection(self, reader, writer):
+        connection = Connection(self, reader, writer)
+        self.connections[connection] = asyncio.current_task()
+        try:
+            await connection.run()
+        finally:
+            del self.connections[connection]
+
+    def get_bot_seat(self, name):
+        if name not in self.bots:
+            raise ValueError("GameServer.get_bot_seat: unknown bot {}".format(name))
+        if self.max_batch_size <= 1:
+            return BotSeat(self.bots[name], self.executor)
+        if name not in self.batchers:
+            self.batchers[name] = BotBatcher(self.bots[name], self.executor, self.max_batch_size, self.max_batches)
+        return BotSeat(self.bots[name], self.executor, self.batchers[name])
+
+    def new_game(self, seats, seed=None, early_claims=False):
+        if len(self.games) >= self.max_games:
+            raise ValueError("GameServer.new_game: {} games are already played".format(self.max_games))
+        served_game = ServedGame(next(self._game_ids), seats, seed, early_claims)
+        self.games[served_game.game_id] = served_game
+        served_game.task = asyncio.create_task(served_game.run())
+        served_game.task.add_done_callback(lambda task: self._end_game(served_game))
+        return served_game
+
+    def _end_game(self, served_game):
+        self.games.pop(served_game.game_id, None)
+        task = served_game.task
+        if not task.cancelled() and task.exception() is not None:
+            served_game.broadcast({"type": "game_over", "game_id": served_game.game_id, "winner": None,
+                                   "error": str(task.exception())})
+        for seat in served_game.seats:
+            if isinstance(seat, HumanSeat) and seat.connection is not None:
+                seat.connection.seats.pop(served_game.game_id, None)
+
+    def abandon(self, game_id):
+        served_game = self.games.get(game_id)
+        if served_game is not None:
+            served_game.task.cancel()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for served_game in list(self.games.values()):
+            served_game.task.cancel()
+        # Connections end once their stream is closed
+        tasks = list(self.connections.values())
+        for connection in list(self.connections):
+            connection.writer.close()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for batcher in self.batchers.values():
+            await batcher.close()
+        if self._own_executor:
+            # Waits for the bots still thinking without blocking the loop
+            await asyncio.to_thread(self.executor.shutdown, cancel_futures=True)
+
+
+async def serve(server, host, port, path):
+    await server.start(host, port, path)
+    print("Serving on {}".format(server.get_address()))
+    try:
+        await server.server.serve_forever()
+    finally:
+        await server.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serves games to clients over line-delimited JSON.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7777)
+    parser.add_argument("--unix", default=None, help="Unix socket path to listen on instead of TCP")
+    parser.add_argument("--bots", default=None,
+                        help='JSON file: {name: {"class": "module.Class", "kwargs": {...}}}. '
+                             'Defaults to Player, as "player".')
+    parser.add_argument("--workers", type=int, default=None, help="processes the bots think in")
+    parser.add_argument("--max-games", type=int, default=1000)
+    parser.add_argument("--max-batch-size", type=int, default=32, help="bot moves evaluated together")
+    args = parser.parse_args()
+
+    bots = None if args.bots is None else load_entrants(args.bots)
+    game_server = GameServer(bots, n_workers=args.workers, max_games=args.max_games,
+                             max_batch_size=args.max_batch_size)
+    try:
+        asyncio.run(serve(game_server, args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,298 @@
+import math
+import multiprocessing
+import random
+import time
+from combination_table import get_combination_table
+from game_elements import ALL_CARDS_MASK, CARDS_BY_INDEX, N_CARDS, CardSet
+
+# Information set Monte Carlo tree search player (single observer ISMCTS).
+#
+# The opponent hand and the deck order are unknown. Each iteration samples
+# them among the unseen cards (neither played nor in our hand), then walks
+# down a tree shared by all the samples, choosing among the moves legal in
+# the sample, and finishes the game with random moves. Visits of the root
+# moves are summed over the worker processes and the most visited move is
+# played.
+#
+# Games are simulated on SimulationState: slots are masks of card indexes
+# and hands lists of card indexes, so that a state is cheap to copy.
+
+# Number of iterations between two checks of the time budget
+TIME_CHECK_PERIOD = 16
+
+
+class SimulationState:
+    __slots__ = ("slot_masks", "slot_sizes", "hands", "deck", "first_to_finish",
+                 "n_slots_won", "to_move")
+
+    def __init__(self, slot_masks, slot_sizes, hands, deck, first_to_finish, n_slots_won, to_move):
+        self.slot_masks = slot_masks
+        self.slot_sizes = slot_sizes
+        self.hands = hands
+        self.deck = deck
+        self.first_to_finish = first_to_finish
+        self.n_slots_won = n_slots_won
+        self.to_move = to_move
+
+    def copy(self):
+        return SimulationState([self.slot_masks[0][:], self.slot_masks[1][:]],
+                               [self.slot_sizes[0][:], self.slot_sizes[1][:]],
+                               [self.hands[0][:], self.hands[1][:]],
+                               self.deck[:], self.first_to_finish[:], self.n_slots_won[:],
+                               self.to_move)
+
+    def legal_moves(self):
+        # Moves (slot index, card index) of the player to move
+        sizes = self.slot_sizes[self.to_move]
+        return [(slot_index, card_index)
+                for slot_index in range(9) if sizes[slot_index] < 3
+                for card_index in self.hands[self.to_move]]
+
+    def play(self, slot_index, card_index):
+        # Plays a move of the player to move. Returns the winner when the
+        # game is over, None otherwise. As in Game.run, the winner is only
+        # checked after player 1 moves.
+        player_index = self.to_move
+        self.hands[player_index].remove(card_index)
+        self.slot_masks[player_index][slot_index] |= 1 << card_index
+        self.slot_sizes[player_index][slot_index] += 1
+        if self.slot_sizes[player_index][slot_index] == 3:
+            if self.first_to_finish[slot_index] is None:
+                self.first_to_finish[slot_index] = player_index
+            elif self.slot_sizes[1 - player_index][slot_index] == 3:
+                slot_winner = get_slot_winner(self.slot_masks[0][slot_index], self.slot_masks[1][slot_index],
+                                              self.first_to_finish[slot_index])
+                self.n_slots_won[slot_winner] += 1
+        if self.deck:
+            self.hands[player_index].append(self.deck.pop())
+        self.to_move = 1 - player_index
+        if player_index == 1:
+            if self.n_slots_won[0] >= 5:
+                return 0
+            elif self.n_slots_won[1] >= 5:
+                return 1
+        return None
+
+
+def get_slot_winner(mask0, mask1, first_to_finish):
+    table = get_combination_table()
+    p0_rank = table.rank_list[table.id_by_mask[mask0]]
+    p1_rank = table.rank_list[table.id_by_mask[mask1]]
+    if p0_rank > p1_rank:
+        return 0
+    elif p0_rank < p1_rank:
+        return 1
+    else:
+        return first_to_finish
+
+
+class Node:
+    # Node reached by playing move, player_index being the player who moved.
+    # avails counts the iterations in which the move was legal.
+    __slots__ = ("move", "player_index", "parent", "children", "visits", "wins", "avails")
+
+    def __init__(self, move=None, player_index=None, parent=None):
+        self.move = move
+        self.player_index = player_index
+        self.parent = parent
+        self.children = {}
+        self.visits = 0
+        self.wins = 0.
+        self.avails = 0
+
+    def select_child(self, legal_moves, exploration):
+        best_child = None
+        best_value = None
+        for move in legal_moves:
+            child = self.children[move]
+            child.avails += 1
+            value = child.wins / child.visits + exploration * math.sqrt(math.log(child.avails) / child.visits)
+            if best_value is None or value > best_value:
+                best_child = child
+                best_value = value
+        return best_child
+
+
+def get_search_position(player, game_state):
+    # What the player knows of the game, as picklable values
+    slots = game_state.slots
+    slot_masks = [[slot.mask for slot in slots[0]], [slot.mask for slot in slots[1]]]
+    slot_sizes = [[len(slot) for slot in slots[0]], [len(slot) for slot in slots[1]]]
+    # The player who finished a slot first is only known when the other
+    # side is not full yet. When both are full, only slots won on rank are
+    # counted: a tie is given to nobody.
+    first_to_finish = [None] * 9
+    n_slots_won = [0, 0]
+    for slot_index in range(9):
+        full = [slot_sizes[0][slot_index] == 3, slot_sizes[1][slot_index] == 3]
+        if full[0] and full[1]:
+            slot_winner = get_slot_winner(slot_masks[0][slot_index], slot_masks[1][slot_index], None)
+            first_to_finish[slot_index] = slot_winner
+            if slot_winner is not None:
+                n_slots_won[slot_winner] += 1
+        elif full[0] or full[1]:
+            first_to_finish[slot_index] = 0 if full[0] else 1
+    hand_mask = player.hand.mask
+    unseen_mask = ALL_CARDS_MASK & ~game_state.played_cards.mask & ~hand_mask
+    n_unseen = bin(unseen_mask).count("1")
+    return {"player_index": player.index,
+            "slot_masks": slot_masks,
+            "slot_sizes": slot_sizes,
+            "first_to_finish": first_to_finish,
+            "n_slots_won": n_slots_won,
+            "hand": [card.index for card in player.hand],
+            "unseen": [i for i in range(N_CARDS) if unseen_mask >> i & 1],
+            "opp_hand_size": n_unseen - game_state.deck_size}
+
+
+def determinize(position, rng):
+    # Sample of the opponent hand and of the deck order among the unseen cards
+    unseen = position["unseen"][:]
+    rng.shuffle(unseen)
+    opp_hand = unseen[:position["opp_hand_size"]]
+    deck = unseen[position["opp_hand_size"]:]
+    player_index = position["player_index"]
+    hands = [None, None]
+    hands[player_index] = position["hand"][:]
+    hands[1 - player_index] = opp_hand
+    return SimulationState([position["slot_masks"][0][:], position["slot_masks"][1][:]],
+                           [position["slot_sizes"][0][:], position["slot_sizes"][1][:]],
+                           hands, deck, position["first_to_finish"][:], position["n_slots_won"][:],
+                           player_index)
+
+
+def search(position, n_iterations=None, time_budget=None, exploration=0.7, seed=None):
+    # Runs ISMCTS iterations until n_iterations or time_budget (in seconds)
+    # is reached. Returns the root statistics: move -> [visits, wins].
+    if n_iterations is None and time_budget is None:
+        raise ValueError("search: n_iterations or time_budget must be given")
+    rng = random.Random(seed)
+    deadline = None if time_budget is None else time.perf_counter() + time_budget
+    root = Node()
+    iteration = 0
+    while n_iterations is None or iteration < n_iterations:
+        if deadline is not None and iteration % TIME_CHECK_PERIOD == 0 \
+                and iteration > 0 and time.perf_counter() >= deadline:
+            break
+        iteration += 1
+        state = determinize(position, rng)
+        node = root
+        winner = None
+
+        # Selection, while all the legal moves have been tried
+        legal_moves = state.legal_moves()
+        while legal_moves and all(move in node.children for move in legal_moves):
+            node = node.select_child(legal_moves, exploration)
+            winner = state.play(*node.move)
+            if winner is not None:
+                break
+            legal_moves = state.legal_moves()
+
+        # Expansion
+        if winner is None and legal_moves:
+            untried_moves = [move for move in legal_moves if move not in node.children]
+            move = rng.choice(untried_moves)
+            child = Node(move, state.to_move, node)
+            node.children[move] = child
+            child.avails += 1
+            node = child
+            winner = state.play(*move)
+            if winner is None:
+                legal_moves = state.legal_moves()
+
+        # Random playout
+        while winner is None and legal_moves:
+            winner = state.play(*rng.choice(legal_moves))
+            if winner is None:
+                legal_moves = state.legal_moves()
+
+        # Backpropagation. A game with no winner (tied slots of unknown
+        # owner) counts as half a win.
+        while node is not root:
+            node.visits += 1
+            if winner is None:
+                node.wins += 0.5
+            elif winner == node.player_index:
+                node.wins += 1
+            node = node.parent
+        root.visits += 1
+
+    return {move: [child.visits, child.wins] for move, child in root.children.items()}
+
+
+def _search_task(args):
+    return search(*args)
+
+
+def merge_root_stats(all_root_stats):
+    merged = {}
+    for root_stats in all_root_stats:
+        for move, (visits, wins) in root_stats.items():
+            stats = merged.setdefault(move, [0, 0.])
+            stats[0] += visits
+            stats[1] += wins
+    return merged
+
+
+class MCTSPlayer:
+    # n_iterations: iterations per move and per worker
+    # time_budget: seconds per move. At least one of both must be given,
+    #   the search stops at the first reached.
+    # n_workers: processes searching in parallel, their root statistics
+    #   are merged. Use 1 when the player itself runs in a worker process,
+    #   such as in SelfPlayRunner.
+    # pool: multiprocessing.Pool the workers run in, owned by the caller.
+    #   Without it the player starts its own pool at its first move, which
+    #   close() terminates: use the player in a with block.
+    def __init__(self, index=0, n_iterations=None, time_budget=1., n_workers=1, exploration=0.7, seed=None,
+                 pool=None):
+        if n_iterations is None and time_budget is None:
+            raise ValueError("MCTSPlayer.__init__: n_iterations or time_budget must be given")
+        self.index = index
+        self.opponent_index = 1 if self.index == 0 else 0
+        self.hand = CardSet()
+        self.n_iterations = n_iterations
+        self.time_budget = time_budget
+        self.n_workers = n_workers
+        self.exploration = exploration
+        self.rng = random.Random(seed)
+        self.last_root_stats = None
+        self.pool = pool
+        self._own_pool = None
+
+    def make_move(self, game_state):
+        position = get_search_position(self, game_state)
+        tasks = [(position, self.n_iterations, self.time_budget, self.exploration, self.rng.getrandbits(63))
+                 for _ in range(self.n_workers)]
+        if self.n_workers <= 1:
+            all_root_stats = [_search_task(task) for task in tasks]
+        else:
+            pool = self.pool
+            if pool is None:
+                if self._own_pool is None:
+                    self._own_pool = multiprocessing.Pool(self.n_workers)
+                pool = self._own_pool
+            all_root_stats = pool.map(_search_task, tasks)
+        self.last_root_stats = merge_root_stats(all_root_stats)
+        # Most visited move, then most won
+        slot_index, card_index = max(self.last_root_stats, key=lambda move: self.last_root_stats[move])
+        return slot_index, CARDS_BY_INDEX[card_index]
+
+    def close(self):
+        if self._own_pool is not None:
+            self._own_pool.close()
+            self._own_pool.join()
+            self._own_pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __del__(self):
+        # Last resort for players which were not closed: joining the
+        # workers here could block the garbage collector
+        own_pool = getattr(self, "_own_pool", None)
+        if own_pool is not None:
+            own_pool.terminate()
@@ -0,0 +1,368 @@
+import collections
+import threading
+import time
+import numpy as np
+import profiling
+from combination_table import BINOMIAL_2, get_combination_table, pair_id
+from counter_combinations import get_counter_counts, get_counter_rank_masks, rank_histograms, suffix_counts
+from game_elements import mask_to_cards
+
+# Batched evaluation of Player.get_move_scores for all the moves of a turn.
+# The candidate combinations of every (card, slot) move are gathered in one
+# array of combination ids, their counter combinations are counted in one
+# pass against the rank histograms of the opponent slots, and the scores are
+# summed per move.
+
+
+MoveScoreCacheInfo = collections.namedtuple("MoveScoreCacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+class MoveScoreCache:
+    # Bounded LRU cache of move scores, shared by the players of a process
+    # across turns and games.
+    # The scores of a move only depend on the card, the contents of both
+    # slots and the played cards. When our slot holds 2 cards, the move
+    # makes a single combination, and only the played cards which could be
+    # part of a counter combination at least as strong are kept in the key,
+    # so that entries are reused on later turns: none when the opponent's
+    # slot is complete, few for a strong combination.
+
+    def __init__(self, maxsize=200000):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # Players may think in threads, see game_server
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_key(card, my_slot, opp_slot, played_mask, weights_key=None):
+        # weights_key identifies the combination weights of the evaluator
+        if len(my_slot) == 2:
+            table = get_combination_table()
+            rank = table.rank_list[table.id_by_mask[card.mask | my_slot.mask]]
+            all_masks, card_masks, pair_masks = get_counter_rank_masks()
+            opp_mask = opp_slot.mask
+            n_opp_cards = len(opp_slot)
+            if n_opp_cards == 3:
+                played_mask = 0
+            elif n_opp_cards == 2:
+                low_mask = opp_mask & -opp_mask
+                played_mask &= pair_masks[pair_id(low_mask.bit_length() - 1, opp_mask.bit_length() - 1)][rank]
+            elif n_opp_cards == 1:
+                played_mask &= card_masks[opp_mask.bit_length() - 1][rank]
+            else:
+                played_mask &= all_masks[rank]
+        return card.index, my_slot.mask, opp_slot.mask, played_mask, weights_key
+
+    def get(self, key):
+        with self._lock:
+            scores = self.entries.get(key)
+            if scores is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+        return scores
+
+    def put(self, key, scores):
+        with self._lock:
+            self.entries[key] = scores
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def info(self):
+        return MoveScoreCacheInfo(self.hits, self.misses, self.maxsize, len(self.entries))
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+default_move_score_cache = MoveScoreCache()
+
+
+class MoveEvaluator:
+
+    # cache: MoveScoreCache, or None not to cache scores
+    # scoring_scheme: ScoringScheme weighting the combinations of a move by
+    #   their score, or None to weight them all the same
+    def __init__(self, cache=None, scoring_scheme=None):
+        self.cache = cache
+        self.scoring_scheme = scoring_scheme
+        self.weights_key = None if scoring_scheme is None else tuple(scoring_scheme.category_factors)
+
+    @staticmethod
+    def get_candidate_comb_ids(card_indexes, slot_masks, n_slot_cards, played_masks):
+        # Combinations which can be completed by each move, a move being given
+        # by the card played, the mask and number of cards of its slot and
+        # the played cards. Returns the combination ids and, for each of them,
+        # the position of its move. The combinations of a move are in
+        # increasing id order.
+        table = get_combination_table()
+        all_comb_ids = []
+        all_move_positions = []
+        for n_cards in range(3):
+            move_positions = np.flatnonzero(n_slot_cards == n_cards)
+            if len(move_positions) == 0:
+                continue
+            cards = card_indexes[move_positions]
+            if n_cards == 2:
+                comb_ids = np.array([table.id_by_mask[slot_mask | (1 << card_index)] for slot_mask, card_index
+                                     in zip(slot_masks[move_positions].tolist(), cards.tolist())])
+                all_comb_ids.append(comb_ids)
+                all_move_positions.append(move_positions)
+                continue
+            if n_cards == 0:
+                comb_ids = table.card_comb_ids[cards]
+                forbidden_masks = played_masks[move_positions]
+            else:
+                slot_cards = np.array([slot_mask.bit_length() - 1 for slot_mask in slot_masks[move_positions].tolist()])
+                pair_ids = np.where(cards < slot_cards, np.array(BINOMIAL_2)[slot_cards] + cards,
+                                    np.array(BINOMIAL_2)[cards] + slot_cards)
+                comb_ids = table.pair_comb_ids[pair_ids]
+                forbidden_masks = played_masks[move_positions] & ~slot_masks[move_positions]
+            rows, columns = np.nonzero((table.masks[comb_ids] & forbidden_masks[:, None]) == 0)
+            all_comb_ids.append(comb_ids[rows, columns])
+            all_move_positions.append(move_positions[rows])
+        return np.concatenate(all_comb_ids), np.concatenate(all_move_positions)
+
+    @staticmethod
+    def get_slot_suffix_counts(opp_slots, played_masks):
+        # Suffix counts (see SlotCounterCounts) of opponent slots holding 1 to
+        # 3 cards, one row per slot, computed together
+        table = get_combination_table()
+        at_least = np.zeros((len(opp_slots), table.n_ranks + 1), dtype=np.int64)
+        slot_sizes = np.array([len(opp_slot) for opp_slot in opp_slots])
+        slot_masks = np.array([opp_slot.mask for opp_slot in opp_slots], dtype=np.uint64)
+        for n_cards in range(1, 4):
+            rows = np.flatnonzero(slot_sizes == n_cards)
+            if len(rows) == 0:
+                continue
+            if n_cards == 3:
+                comb_ids = np.array([[table.id_by_mask[opp_slots[row].mask]] for row in rows.tolist()])
+                at_least[rows] = suffix_counts(rank_histograms(comb_ids))
+                continue
+            slot_cards = [mask_to_cards(opp_slots[row].mask) for row in rows.tolist()]
+            if n_cards == 1:
+                comb_ids = table.card_comb_ids[[cards[0].index for cards in slot_cards]]
+            else:
+                comb_ids = table.pair_comb_ids[[pair_id(cards[0].index, cards[1].index) for cards in slot_cards]]
+            forbidden_masks = played_masks[rows] & ~slot_masks[rows]
+            allowed = (table.masks[comb_ids] & forbidden_masks[:, None]) == 0
+            at_least[rows] = suffix_counts(rank_histograms(comb_ids, allowed))
+        return at_least
+
+    @staticmethod
+    def count_counter_combs(comb_ids, opp_slots, slot_positions, played_masks):
+        # Counter combinations of each candidate combination, in the opponent
+        # slot given by slot_positions, played_masks being the played cards
+        # of each opponent slot
+        table = get_combination_table()
+        n_better = np.zeros(len(comb_ids), dtype=np.int64)
+        n_equal = np.zeros(len(comb_ids), dtype=np.int64)
+
+        ranks = table.ranks[comb_ids].astype(np.intp)
+        started = np.array([len(opp_slot) > 0 for opp_slot in opp_slots])
+        if started.any():
+            # One row of suffix counts per started opponent slot
+            started_positions = np.flatnonzero(started)
+            at_least = np.zeros((len(opp_slots), table.n_ranks + 1), dtype=np.int64)
+            at_least[started_positions] = MoveEvaluator.get_slot_suffix_counts(
+                [opp_slots[i] for i in started_positions.tolist()], played_masks[started_positions])
+            rows = started[slot_positions]
+            n_better[rows] = at_least[slot_positions[rows], ranks[rows] + 1]
+            n_equal[rows] = at_least[slot_positions[rows], ranks[rows]] - n_better[rows]
+        if not started.all():
+            # Counts of empty slots only depend on the played cards
+            empty_rows = np.flatnonzero(~started[slot_positions])
+            empty_played_masks = played_masks[slot_positions[empty_rows]]
+            empty_slot = opp_slots[np.flatnonzero(~started)[0]]
+            distinct_played_masks, mask_indexes = np.unique(empty_played_masks, return_inverse=True)
+            # Rows grouped by played cards
+            empty_rows = empty_rows[np.argsort(mask_indexes, kind="stable")]
+            bounds = np.searchsorted(np.sort(mask_indexes), np.arange(len(distinct_played_masks) + 1))
+            for i, played_mask in enumerate(distinct_played_masks.tolist()):
+                rows = empty_rows[bounds[i]:bounds[i + 1]]
+                empty_slot_counts = get_counter_counts(empty_slot, played_mask)
+                n_better[rows], n_equal[rows] = empty_slot_counts.count(comb_ids[rows])
+        return n_better, n_equal
+
+    def evaluate_moves(self, moves, my_slots, opp_slots, played_mask):
+        # Scores (n_zero_counter, move_score) of a list of moves
+        # (slot index, card), as computed by Player.get_move_scores
+        return self.evaluate_moves_batch([(moves, my_slots, opp_slots, played_mask)])[0]
+
+    def evaluate_moves_batch(self, positions, deadline=None):
+        # evaluate_moves() for positions (moves, my_slots, opp_slots,
+        # played_mask), typically from different games. The candidate and
+        # counter combinations of all the moves are counted together, in one
+        # pass.
+        # deadline: time.perf_counter() value after which no more moves are
+        #   scored. The moves are then scored slot by slot, see
+        #   evaluate_moves_until(), and the scores of the moves left are None.
+        if deadline is not None:
+            return self.evaluate_moves_until(positions, deadline)
+        profiler = profiling.active_profiler
+        if profiler is not None:
+            start = time.perf_counter()
+        card_indexes = []
+        slot_masks = []
+        n_slot_cards = []
+        move_played_masks = []
+        # One opponent slot per position and slot index
+        move_slot_positions = []
+        slot_positions = {}
+        opp_slot_list = []
+        slot_played_masks = []
+        n_moves = []
+        for position_index, (moves, my_slots, opp_slots, played_mask) in enumerate(positions):
+            n_moves.append(len(moves))
+            for slot_index, card in moves:
+                slot_key = (position_index, slot_index)
+                if slot_key not in slot_positions:
+                    slot_positions[slot_key] = len(opp_slot_list)
+                    opp_slot_list.append(opp_slots[slot_index])
+                    slot_played_masks.append(played_mask)
+                my_slot = my_slots[slot_index]
+                card_indexes.append(card.index)
+                slot_masks.append(my_slot.mask)
+                n_slot_cards.append(len(my_slot))
+                move_played_masks.append(played_mask)
+                move_slot_positions.append(slot_positions[slot_key])
+        total_moves = len(card_indexes)
+        if total_moves == 0:
+            return [[] for _ in positions]
+
+        comb_ids, move_indexes = self.get_candidate_comb_ids(
+            np.array(card_indexes, dtype=np.intp), np.array(slot_masks, dtype=np.uint64), np.array(n_slot_cards),
+            np.array(move_played_masks, dtype=np.uint64))
+        if profiler is not None:
+            profiler.add_time("combination_generation", time.perf_counter() - start)
+            profiler.count("combinations_generated", len(comb_ids))
+            profiler.count("moves_evaluated", total_moves)
+            start = time.perf_counter()
+
+        n_better, n_equal = self.count_counter_combs(comb_ids, opp_slot_list,
+                                                     np.array(move_slot_positions)[move_indexes],
+                                                     np.array(slot_played_masks, dtype=np.uint64))
+
+        # Combination with same "power" only count for half
+        comb_scores = n_better + 0.5 * n_equal
+        unbeatable = comb_scores == 0
+        inverse_scores = 1 / np.where(unbeatable, 1, comb_scores)
+        inverse_scores[unbeatable] = 0
+        if self.scoring_scheme is not None:
+            inverse_scores *= self.scoring_scheme.scores[comb_ids]
+        n_zero_counter = np.bincount(move_indexes, weights=unbeatable, minlength=total_moves)
+        move_score = np.bincount(move_indexes, weights=inverse_scores, minlength=total_moves)
+        if profiler is not None:
+            profiler.add_time("counter_scoring", time.perf_counter() - start)
+        scores = list(zip(n_zero_counter.astype(int).tolist(), move_score.tolist()))
+        ends = np.cumsum(n_moves).tolist()
+        return [scores[end - n:end] for n, end in zip(n_moves, ends)]
+
+    def evaluate_moves_until(self, positions, deadline):
+        # Moves of each slot scored together, those of the slots with the
+        # most cards first (they have the fewest candidate combinations),
+        # until the deadline. The moves of the first slot are always scored.
+        slot_moves = []
+        for position_index, (moves, my_slots, _, _) in enumerate(positions):
+            move_positions = {}
+            for move_position, (slot_index, card) in enumerate(moves):
+                move_positions.setdefault(slot_index, []).append(move_position)
+            for slot_index in sorted(move_positions, key=lambda i: -len(my_slots[i])):
+                slot_moves.append((len(my_slots[slot_index]), position_index, move_positions[slot_index]))
+        slot_moves.sort(key=lambda item: -item[0])
+        all_scores = [[None] * len(moves) for moves, _, _, _ in positions]
+        for i, (_, position_index, move_positions) in enumerate(slot_moves):
+            if i > 0 and time.perf_counter() >= deadline:
+                break
+            moves, my_slots, opp_slots, played_mask = positions[position_index]
+            scores, = self.evaluate_moves_batch([([moves[j] for j in move_positions], my_slots, opp_slots,
+                                                  played_mask)])
+            for move_position, move_scores in zip(move_positions, scores):
+                all_scores[position_index][move_position] = move_scores
+        return all_scores
+
+    @staticmethod
+    def get_slot_groups(my_slots, opp_slots, slot_indexes=None):
+        # Slots with the same contents facing opponent slots with the same
+        # contents (typically empty ones) give the same scores: they are only
+        # evaluated once. Returns the lists of such slots which are not full.
+        if slot_indexes is None:
+            slot_indexes = range(len(my_slots))
+        slot_groups = {}
+        for slot_index in slot_indexes:
+            my_slot, opp_slot = my_slots[slot_index], opp_slots[slot_index]
+            if len(my_slot) < 3:
+                slot_groups.setdefault((my_slot.mask, opp_slot.mask), []).append(slot_index)
+        return list(slot_groups.values())
+
+    def evaluate(self, hand, my_slots, opp_slots, played_mask, slot_indexes=None, deadline=None):
+        # Scores of every move (slot index, card) on a slot which is not
+        # full. Only the slots in slot_indexes are evaluated when given.
+        return self.evaluate_batch([(hand, my_slots, opp_slots, played_mask, slot_indexes)], deadline)[0]
+
+    def evaluate_batch(self, positions, deadline=None):
+        # evaluate() for positions (hand, my_slots, opp_slots, played_mask,
+        # slot_indexes), typically from different games: the moves missing
+        # from the cache are evaluated together, see evaluate_moves_batch().
+        # With a deadline, the moves which could not be scored in time are
+        # left out.
+        profiler = profiling.active_profiler
+        position_groups = []
+        group_scores = []
+        missing_positions = []
+        missing_keys = []
+        for hand, my_slots, opp_slots, played_mask, slot_indexes in positions:
+            cards = list(hand)
+            slot_groups = self.get_slot_groups(my_slots, opp_slots, slot_indexes)
+            position_groups.append((cards, slot_groups))
+            scores_by_move = {}
+            group_scores.append(scores_by_move)
+            missing_moves = []
+            for slot_indexes in slot_groups:
+                slot_index = slot_indexes[0]
+                for card in cards:
+                    if self.cache is not None:
+                        key = self.cache.get_key(card, my_slots[slot_index], opp_slots[slot_index], played_mask,
+                                                 self.weights_key)
+                        scores = self.cache.get(key)
+                        if profiler is not None:
+                            profiler.count("move_score_cache_misses" if scores is None
+                                           else "move_score_cache_hits")
+                        if scores is not None:
+                            scores_by_move[(slot_index, card)] = scores
+                            continue
+                        missing_keys.append(key)
+                    missing_moves.append((slot_index, card))
+            missing_positions.append((missing_moves, my_slots, opp_slots, played_mask))
+
+        missing_scores = self.evaluate_moves_batch(missing_positions, deadline)
+        key_index = 0
+        for scores_by_move, (missing_moves, _, _, _), position_scores in zip(group_scores, missing_positions,
+                                                                              missing_scores):
+            for move, scores in zip(missing_moves, position_scores):
+                if scores is not None:
+                    scores_by_move[move] = scores
+                    if self.cache is not None:
+                        self.cache.put(missing_keys[key_index], scores)
+                key_index += 1
+
+        # Same order with or without cache, for ties to be broken the same way
+        all_moves_scores = []
+        for (cards, slot_groups), scores_by_move in zip(position_groups, group_scores):
+            moves_scores = {}
+            for slot_indexes in slot_groups:
+                for card in cards:
+                    scores = scores_by_move.get((slot_indexes[0], card))
+                    if scores is None:
+                        continue
+                    for slot_index in slot_indexes:
+                        moves_scores[(slot_index, card)] = scores
+            all_moves_scores.append(moves_scores)
+        return all_moves_scores
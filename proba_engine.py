@@ -1,6 +1,10 @@
 from card_combinations import CardCombination, CardCombinationsGenerator
-import collections
-from game_elements import MAX_CARDS_PER_HAND
+import time
+import numpy as np
+import profiling
+from combination_table import N_COMBINATIONS, pair_id, get_combination_table
+from game_elements import MAX_CARDS_PER_HAND, N_CARDS, cards_to_mask
+from game_observers import GameObserver
 
 
 class ProbaEngine:
@@ -41,65 +45,66 @@ class ProbaEngine:
         return 1 if deck_size == 0 else (MAX_CARDS_PER_HAND + 1) / (deck_size + MAX_CARDS_PER_HAND)
 
     @staticmethod
-    def card_is_in_slots(card, slots, pass_index=None):
+    def slots_mask(slots, pass_index=None):
+        mask = 0
         for i, slot in enumerate(slots):
-            if i == pass_index:
-                continue
-            if card in slot:
-                return True
-        return False
+            if i != pass_index:
+                mask |= slot.mask
+        return mask
+
+    @staticmethod
+    def card_is_in_slots(card, slots, pass_index=None):
+        return ProbaEngine.slots_mask(slots, pass_index) & card.mask != 0
+
+    @staticmethod
+    def get_slot_masks(player, game_state, slot_index, for_opponent=False):
+        # Masks of the cards which cannot be part of a combination in the slot
+        # (unavailable to the player building it) and of the cards it
+        # already has (proba 1)
+        my_slots = game_state.slots[player.index]
+        op_slots = game_state.slots[player.opponent_index]
+        hand_mask = cards_to_mask(player.hand)
+        if for_opponent:
+            # Cards played in our slots, in the other slots of the opponent,
+            # or in our hand
+            unavailable_mask = ProbaEngine.slots_mask(my_slots) | \
+                ProbaEngine.slots_mask(op_slots, slot_index) | hand_mask
+            known_mask = op_slots[slot_index].mask
+        else:
+            # Cards played in the other slots
+            unavailable_mask = ProbaEngine.slots_mask(my_slots, slot_index) | \
+                ProbaEngine.slots_mask(op_slots)
+            known_mask = hand_mask | my_slots[slot_index].mask
+        return unavailable_mask, known_mask
+
+    @staticmethod
+    def missing_cards_probas(deck_size, for_opponent=False):
+        # Proba of a combination given its number of missing cards (0 to 3)
+        if for_opponent:
+            card_proba = ProbaEngine.deck_or_hand_proba(deck_size)
+        else:
+            card_proba = ProbaEngine.deck_proba(deck_size)
+        return [1, card_proba, card_proba * card_proba, card_proba * card_proba * card_proba]
 
     # For_opponent: compute the opponent combination proba given our
     # own knowledge
     @staticmethod
     def _compute_probas_for_slot(player, allowed_combs, slot_index,
                                  game_state, for_opponent=False):
+        unavailable_mask, known_mask = ProbaEngine.get_slot_masks(player, game_state,
+                                                                  slot_index, for_opponent)
+        missing_cards_probas = ProbaEngine.missing_cards_probas(game_state.deck_size, for_opponent)
+        unknown_mask = ~known_mask
 
-        if for_opponent:
-            my_slot_index = None
-            op_slot_index = slot_index
-            slot = game_state.slots[player.opponent_index][slot_index]
-        else:
-            my_slot_index = slot_index
-            op_slot_index = None
-            slot = game_state.slots[player.index][slot_index]
-
-        # comb_probas = collections.defaultdict(int)
         comb_probas = {}
         for comb in allowed_combs:
-            proba = 1
-
-            for card in comb:
-                # One card in the combination has been played in
-                # another slot already
-                if ProbaEngine.card_is_in_slots(card, game_state.slots[player.index], my_slot_index):
-                    proba = 0
-                    break
-                if ProbaEngine.card_is_in_slots(card, game_state.slots[player.opponent_index], op_slot_index):
-                    proba = 0
-                    break
-
-                if for_opponent:
-                    # We have that card in our hand so the opponent cannot have it
-                    if card in player.hand:
-                        proba = 0
-                        break
-                    # The card is in the current (opponent's) slot so
-                    # the proba of the combination remains the same
-                    if card in slot:
-                        pass  # proba *= 1
-                    # Proba the opponent has the card or gets it from the deck
-                    else:
-                        proba *= ProbaEngine.deck_or_hand_proba(game_state.deck_size)
-                else:
-                    # We have that card in our hand or it is in the current
-                    # slot so the proba of the combination remains the same
-                    if card in player.hand or card in slot:
-                        pass  # proba *= 1
-                    # Proba to get the card from the deck
-                    else:
-                        proba *= ProbaEngine.deck_proba(game_state.deck_size)
-
+            # One card in the combination has been played in another slot
+            # already, or is in our hand for the opponent
+            if comb.mask & unavailable_mask:
+                continue
+            # Cards in the slot or in our hand have proba 1, the others
+            # must come from the deck (or from the opponent's hand)
+            proba = missing_cards_probas[(comb.mask & unknown_mask).bit_count()]
             if proba != 0:
                 comb_probas[comb] = proba
 
@@ -109,6 +114,9 @@ class ProbaEngine:
     def combination_probas_from_slot(player, game_state,
                                      slot_index, for_opponent=False):
         ccg = CardCombinationsGenerator()
+        profiler = profiling.active_profiler
+        if profiler is not None:
+            start = time.perf_counter()
 
         if for_opponent:
             c_slot = game_state.slots[player.opponent_index][slot_index]
@@ -119,11 +127,9 @@ class ProbaEngine:
             # The only thing we now is that the opponent cannot play with
             # our cards whether in a slot or in our hand
             if for_opponent:
-                forbidden_cards = player.hand.copy()
-                for slot in game_state.slots[player.index]:
-                    for card in slot:
-                        forbidden_cards.add(card)
-                allowed_combs = ccg.get_combinations_excluding_cards(forbidden_cards)
+                forbidden_mask = cards_to_mask(player.hand) | \
+                    ProbaEngine.slots_mask(game_state.slots[player.index])
+                allowed_combs = ccg.get_all_combinations(forbidden_mask)
             else:
                 allowed_combs = set()
                 for card in player.hand:
@@ -150,7 +156,126 @@ class ProbaEngine:
                              "slot must contain between 0 and 2 cards." +
                              "{} found".format(len(c_slot)))
 
+        if profiler is not None:
+            profiler.add_time("proba_combination_generation", time.perf_counter() - start)
+            profiler.count("proba_combinations_generated", len(allowed_combs))
+            start = time.perf_counter()
         comb_probas = ProbaEngine._compute_probas_for_slot(player, allowed_combs,
                                                            slot_index, game_state,
                                                            for_opponent)
+        if profiler is not None:
+            profiler.add_time("proba_computation", time.perf_counter() - start)
+            profiler.count("proba_combinations_possible", len(comb_probas))
         return comb_probas
+
+
+# Stateful version of ProbaEngine.combination_probas_from_slot for one player.
+# For each slot of each player, the engine keeps for every combination the
+# number of its cards which must still come from the deck (or from the
+# opponent's hand), or -1 if the combination is impossible. Probabilities
+# are derived from these counts and the deck size when queried, so the
+# deck shrinking needs no update.
+# Attached to a Game as an observer, it only updates the combinations
+# containing the played or drawn card, plus the table of the slot the card
+# was played in.
+class IncrementalProbaEngine(GameObserver):
+
+    def __init__(self, player, game_state):
+        self.player = player
+        self.game_state = game_state
+        # n_missing[0] for the player's slots, n_missing[1] for the opponent's
+        self.n_missing = np.full((2, 9, N_COMBINATIONS), -1, dtype=np.int8)
+        self.sync()
+
+    def _slots(self, for_opponent):
+        if for_opponent:
+            return self.game_state.slots[self.player.opponent_index]
+        return self.game_state.slots[self.player.index]
+
+    @staticmethod
+    def _card_flags(mask):
+        # Boolean array of the cards in a mask
+        return (np.int64(mask) >> np.arange(N_CARDS)) & 1 == 1
+
+    def _candidate_ids(self, slot):
+        # Combinations containing the cards of a non-empty slot
+        table = get_combination_table()
+        slot_cards = list(slot)
+        if len(slot_cards) == 1:
+            return table.card_comb_ids[slot_cards[0].index]
+        if len(slot_cards) == 2:
+            return table.pair_comb_ids[pair_id(slot_cards[0].index, slot_cards[1].index)]
+        return np.array([table.id_by_mask[slot.mask]])
+
+    def _update(self, for_opponent, slot_index, comb_ids):
+        # Same rules as ProbaEngine._compute_probas_for_slot and
+        # combination_probas_from_slot, for an array of combinations
+        table = get_combination_table()
+        slot = self._slots(for_opponent)[slot_index]
+        hand_mask = cards_to_mask(self.player.hand)
+        unavailable_mask, known_mask = ProbaEngine.get_slot_masks(self.player, self.game_state,
+                                                                  slot_index, for_opponent)
+
+        masks = table.masks[comb_ids]
+        possible = (masks & np.uint64(unavailable_mask)) == 0
+        # The combination must contain the cards of the slot
+        possible &= (masks & np.uint64(slot.mask)) == np.uint64(slot.mask)
+        if not for_opponent:
+            if len(slot) == 3:
+                possible[:] = False
+            elif len(slot) == 0:
+                # Combinations for which we have at least one card
+                possible &= (masks & np.uint64(hand_mask)) != 0
+
+        known_cards = self._card_flags(known_mask)
+        n_missing = 3 - known_cards[table.cards[comb_ids]].sum(axis=1)
+        self.n_missing[int(for_opponent), slot_index, comb_ids] = np.where(possible, n_missing, -1)
+
+    def _reset_slot(self, for_opponent, slot_index):
+        slot = self._slots(for_opponent)[slot_index]
+        self.n_missing[int(for_opponent), slot_index] = -1
+        if len(slot) == 0:
+            self._update(for_opponent, slot_index, np.arange(N_COMBINATIONS))
+        else:
+            self._update(for_opponent, slot_index, self._candidate_ids(slot))
+
+    def sync(self):
+        # Rebuilds all the tables from the game state and the player's hand
+        for for_opponent in (False, True):
+            for slot_index in range(9):
+                self._reset_slot(for_opponent, slot_index)
+
+    def _update_card(self, card):
+        profiler = profiling.active_profiler
+        if profiler is not None:
+            start = time.perf_counter()
+        comb_ids = get_combination_table().card_comb_ids[card.index]
+        for for_opponent in (False, True):
+            for slot_index in range(9):
+                self._update(for_opponent, slot_index, comb_ids)
+        if profiler is not None:
+            profiler.add_time("proba_update", time.perf_counter() - start)
+            profiler.count("proba_combinations_updated", 18 * len(comb_ids))
+
+    def on_move_played(self, game, player_index, slot_index, card):
+        self._update_card(card)
+        self._reset_slot(player_index != self.player.index, slot_index)
+
+    def on_card_drawn(self, game, player_index, card):
+        # Cards drawn by the opponent are unknown
+        if player_index == self.player.index:
+            self._update_card(card)
+
+    def combination_proba_arrays(self, slot_index, for_opponent=False):
+        # Ids and probabilities of the combinations with non zero probability
+        n_missing = self.n_missing[int(for_opponent), slot_index]
+        comb_ids = np.flatnonzero(n_missing >= 0)
+        missing_cards_probas = ProbaEngine.missing_cards_probas(self.game_state.deck_size, for_opponent)
+        probas = np.array(missing_cards_probas)[n_missing[comb_ids]]
+        non_zero = probas != 0
+        return comb_ids[non_zero], probas[non_zero]
+
+    def combination_probas_from_slot(self, slot_index, for_opponent=False):
+        comb_ids, probas = self.combination_proba_arrays(slot_index, for_opponent)
+        return {CardCombination.from_id(comb_id): proba
+                for comb_id, proba in zip(comb_ids.tolist(), probas.tolist())}
@@ -0,0 +1,116 @@
+import json
+import time
+from collections import defaultdict
+
+# Wall time per phase and counters of the engine, for players and
+# ProbaEngine.
+#
+# Profiling is off unless a Profiler is enabled. Instrumented code reads
+# active_profiler once and only does anything when it is not None, so that
+# disabled profiling costs a global lookup:
+#
+#     profiler = profiling.active_profiler
+#     if profiler is not None:
+#         start = time.perf_counter()
+#     ...
+#     if profiler is not None:
+#         profiler.add_time("phase", time.perf_counter() - start)
+#
+# Counters named "<name>_hits" and "<name>_misses" are reported with a
+# "<name>_hit_rate".
+
+active_profiler = None
+
+
+class Profiler:
+    # keep_moves: keep the stats of every move, on top of the totals
+    def __init__(self, keep_moves=True):
+        self.keep_moves = keep_moves
+        # phase -> [number of calls, seconds]
+        self.times = defaultdict(lambda: [0, 0.])
+        self.counters = defaultdict(int)
+        self.n_moves = 0
+        self.moves = []
+        self._move_times = None
+        self._move_counters = None
+        self._move_start = None
+
+    def add_time(self, phase, duration):
+        phase_time = self.times[phase]
+        phase_time[0] += 1
+        phase_time[1] += duration
+        if self._move_times is not None:
+            move_phase_time = self._move_times[phase]
+            move_phase_time[0] += 1
+            move_phase_time[1] += duration
+
+    def count(self, counter, n=1):
+        self.counters[counter] += n
+        if self._move_counters is not None:
+            self._move_counters[counter] += n
+
+    def begin_move(self):
+        self._move_times = defaultdict(lambda: [0, 0.])
+        self._move_counters = defaultdict(int)
+        self._move_start = time.perf_counter()
+
+    def end_move(self, player_index):
+        duration = time.perf_counter() - self._move_start
+        move_times, move_counters = self._move_times, self._move_counters
+        self._move_times = self._move_counters = self._move_start = None
+        self.add_time("move", duration)
+        self.n_moves += 1
+        if self.keep_moves:
+            move_times["move"] = [1, duration]
+            self.moves.append({"player_index": player_index,
+                               "times": dict(move_times),
+                               "counters": with_hit_rates(move_counters)})
+
+    def merge(self, stats):
+        # Adds the totals of stats, as returned by to_dict(), for example
+        # from another process
+        for phase, (n_calls, seconds) in stats["times"].items():
+            self.times[phase][0] += n_calls
+            self.times[phase][1] += seconds
+        for counter, n in stats["counters"].items():
+            if not counter.endswith("_hit_rate"):
+                self.counters[counter] += n
+        self.n_moves += stats["n_moves"]
+        if self.keep_moves:
+            self.moves.extend(stats.get("moves", []))
+
+    def to_dict(self):
+        stats = {"n_moves": self.n_moves,
+                 "times": {phase: list(phase_time) for phase, phase_time in self.times.items()},
+                 "counters": with_hit_rates(self.counters)}
+        if self.keep_moves:
+            stats["moves"] = self.moves
+        return stats
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=1)
+
+
+def with_hit_rates(counters):
+    counters = dict(counters)
+    for counter in list(counters):
+        if counter.endswith("_hits"):
+            name = counter[:-len("_hits")]
+            n_lookups = counters[counter] + counters.get(name + "_misses", 0)
+            counters[name + "_hit_rate"] = counters[counter] / n_lookups if n_lookups > 0 else 0.
+    return counters
+
+
+def enable(profiler=None):
+    # Makes profiler (a new one if None) the active profiler and returns it
+    global active_profiler
+    active_profiler = Profiler() if profiler is None else profiler
+    return active_profiler
+
+
+def disable():
+    # Returns the profiler which was active
+    global active_profiler
+    profiler, active_profiler = active_profiler, None
+    return profiler
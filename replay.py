@@ -0,0 +1,199 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+from counter_combinations import reserve_empty_slot_counts
+from game import GameState, Player
+from game_elements import CARDS_BY_INDEX, CardSet
+from game_records import get_moves, open_records_file, read_game_records
+from self_play import make_player
+
+# Replay of recorded games: the position before each recorded move is
+# rebuilt from the record and given to a player, whose decision is compared
+# with the recorded move. Positions are far cheaper to rebuild than games
+# to play again, so a changed player or scoring scheme can be checked
+# against many logged games.
+#
+# Games are replayed on a process pool, each task being a batch of recorded
+# games replayed together (one recorded game for players other than
+# Player), and the results of the positions are streamed as they come. With
+# mode="make_move" a result holds the move of the player, with
+# mode="moves_scores" the scores of every move (see Player.get_moves_scores)
+# and the move chosen from them.
+
+
+def iter_positions(record):
+    # (ply, player index, game state, hand, recorded move) before each move
+    # of a record. The game state and hands are updated in place from one
+    # position to the next: use or copy them before moving on.
+    game_state = GameState(CARDS_BY_INDEX[card_index] for card_index in record["deck"])
+    hands = [CardSet(CARDS_BY_INDEX[card_index] for card_index in hand) for hand in record["hands"]]
+    for ply, (player_index, slot_index, card_index) in enumerate(get_moves(record)):
+        card = CARDS_BY_INDEX[card_index]
+        yield ply, player_index, game_state, hands[player_index], (slot_index, card)
+        hands[player_index].remove(card)
+        undo = game_state.apply_move(player_index, slot_index, card)
+        if undo.drawn_card is not None:
+            hands[player_index].add(undo.drawn_card)
+
+
+def position_result(record, game_index, ply, player_index, recorded_move, move, moves_scores=None):
+    slot_index, card = recorded_move
+    result = {"game_index": game_index, "seed": record["seed"], "ply": ply,
+              "player_index": player_index, "recorded_move": [slot_index, card.index]}
+    if moves_scores is not None:
+        result["scores"] = [[move_slot_index, move_card.index, n_zero_counter, move_score]
+                            for (move_slot_index, move_card), (n_zero_counter, move_score)
+                            in moves_scores.items()]
+    result["move"] = [move[0], move[1].index]
+    result["agree"] = result["move"] == result["recorded_move"]
+    return result
+
+
+def replay_record(record, player_spec=Player, mode="make_move", game_index=None):
+    # Results of the positions of a record, see the module comment
+    if mode not in ("make_move", "moves_scores"):
+        raise ValueError("replay_record: unknown mode {}".format(mode))
+    players = [make_player(player_spec, 0), make_player(player_spec, 1)]
+    results = []
+    for ply, player_index, game_state, hand, recorded_move in iter_positions(record):
+        player = players[player_index]
+        player.hand = hand.copy()
+        moves_scores = None
+        if mode == "make_move":
+            move = player.make_move(game_state)
+        else:
+            moves_scores = player.get_moves_scores(game_state)
+            move = player.choose_move(moves_scores)
+        results.append(position_result(record, game_index, ply, player_index, recorded_move, move, moves_scores))
+    return results
+
+
+def replay_records_batch(records, player_spec=Player, mode="make_move", first_game_index=0):
+    # replay_record() for several records replayed in lockstep: the
+    # positions of the same ply of all the records are evaluated together
+    # by MoveEvaluator.evaluate_batch(), so that the player must be a
+    # Player, and its time budget does not apply. Returns the results of the
+    # records one after the other.
+    if mode not in ("make_move", "moves_scores"):
+        raise ValueError("replay_records_batch: unknown mode {}".format(mode))
+    player = make_player(player_spec, 0)
+    records_positions = [iter_positions(record) for record in records]
+    records_results = [[] for _ in records]
+    record_indexes = list(range(len(records)))
+    # The counts of empty slots of a ply are derived from those of the
+    # previous ply of the same record, see counter_combinations
+    with reserve_empty_slot_counts(2 * len(records)):
+        while record_indexes:
+            ply_positions = []
+            batch = []
+            for i in record_indexes:
+                position = next(records_positions[i], None)
+                if position is None:
+                    continue
+                ply, player_index, game_state, hand, recorded_move = position
+                ply_positions.append((i, ply, player_index, recorded_move))
+                batch.append((hand, game_state.slots[player_index], game_state.slots[1 - player_index],
+                              game_state.played_cards.mask, player.get_playable_slots(game_state, player_index)))
+            for (i, ply, player_index, recorded_move), moves_scores in zip(
+                    ply_positions, player.move_evaluator.evaluate_batch(batch)):
+                move = player.choose_move(moves_scores)
+                records_results[i].append(position_result(records[i], first_game_index + i, ply, player_index,
+                                                           recorded_move, move,
+                                                           moves_scores if mode == "moves_scores" else None))
+            record_indexes = [i for i, _, _, _ in ply_positions]
+    return [result for results in records_results for result in results]
+
+
+def _replay_task(args):
+    return replay_record(*args)
+
+
+def _replay_batch_task(args):
+    return replay_records_batch(*args)
+
+
+class ReplayEngine:
+    # batch_size: records replayed in lockstep by a task, see
+    #   replay_records_batch(), when the player is a Player. Other players
+    #   replay the records one by one.
+    def __init__(self, player_spec=Player, mode="make_move", n_workers=None, chunksize=4, batch_size=16):
+        self.player_spec = player_spec
+        self.mode = mode
+        self.n_workers = multiprocessing.cpu_count() if n_workers is None else n_workers
+        self.chunksize = chunksize
+        self.batch_size = batch_size
+
+    def iter_results(self, records):
+        # Results of all the positions of records, an iterable which is only
+        # read as needed. Results of a game are yielded together, in the
+        # order of the games.
+        player_class = self.player_spec[0] if isinstance(self.player_spec, tuple) else self.player_spec
+        if issubclass(player_class, Player) and self.batch_size is not None:
+            task_function = _replay_batch_task
+            tasks = self.iter_batch_tasks(records)
+            chunksize = 1
+        else:
+            task_function = _replay_task
+            tasks = ((record, self.player_spec, self.mode, game_index)
+                     for game_index, record in enumerate(records))
+            chunksize = self.chunksize
+        if self.n_workers <= 1:
+            for task in tasks:
+                for result in task_function(task):
+                    yield result
+        else:
+            with multiprocessing.Pool(self.n_workers) as pool:
+                for results in pool.imap(task_function, tasks, chunksize):
+                    for result in results:
+                        yield result
+
+    def iter_batch_tasks(self, records):
+        records = iter(records)
+        first_game_index = 0
+        while True:
+            batch = list(itertools.islice(records, self.batch_size))
+            if len(batch) == 0:
+                return
+            yield batch, self.player_spec, self.mode, first_game_index
+            first_game_index += len(batch)
+
+
+def summarize_replay(results):
+    n_positions = 0
+    n_agree = 0
+    for result in results:
+        n_positions += 1
+        n_agree += result["agree"]
+    return {"n_positions": n_positions,
+            "n_agree": n_agree,
+            "agreement": n_agree / n_positions if n_positions > 0 else 0}
+
+
+def write_results(results, path):
+    # Writes results as JSON lines, gzipped if path ends with ".gz", and
+    # yields them back so that they can be summarized on the way
+    with open_records_file(path, "w") as f:
+        for result in results:
+            f.write(json.dumps(result, separators=(",", ":")))
+            f.write("\n")
+            yield result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replays the positions of recorded games with Player.")
+    parser.add_argument("records", help="game records, see game_records")
+    parser.add_argument("--output", default=None, help="file to write the result of each position to")
+    parser.add_argument("--mode", choices=["make_move", "moves_scores"], default="make_move")
+    parser.add_argument("--player-kwargs", default="{}", help="arguments of Player, as JSON")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=16,
+                        help="games replayed in lockstep by each task, their positions being evaluated together")
+    args = parser.parse_args()
+
+    engine = ReplayEngine((Player, json.loads(args.player_kwargs)), args.mode, args.workers,
+                          batch_size=args.batch_size)
+    results = engine.iter_results(read_game_records(args.records))
+    if args.output is not None:
+        results = write_results(results, args.output)
+    print(summarize_replay(results))
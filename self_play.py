@@ -0,0 +1,232 @@
+import argparse
+import collections
+import multiprocessing
+import json
+import random
+import profiling
+from counter_combinations import reserve_empty_slot_counts
+from game import Game, Player
+from game_records import GameRecordWriter, GameRecorder
+
+# Headless self-play: games between two configurable players are run on a
+# process pool, each with its own seed, and only their results are kept.
+#
+# A player spec is a player class or a (class, kwargs) pair, for example
+# (Player, {}) or (MyPlayer, {"scoring_scheme": ScoringScheme((1, 2, 3, 6, 10))}).
+# Specs are sent to the worker processes so they must be picklable.
+
+# profile: stats of the game, see profiling.Profiler.to_dict(), when profiled
+# record: record of the game, see game_records, when recorded
+GameResult = collections.namedtuple("GameResult", ["game_index", "seed", "winner",
+                                                   "n_turns", "slot_winners", "profile", "record"],
+                                    defaults=(None, None))
+
+
+def make_player(player_spec, index):
+    if isinstance(player_spec, tuple):
+        player_class, kwargs = player_spec
+    else:
+        player_class, kwargs = player_spec, {}
+    return player_class(index=index, **kwargs)
+
+
+def close_players(players):
+    # Releases what the players hold, such as the process pool of an
+    # MCTSPlayer with several workers
+    for player in players:
+        close = getattr(player, "close", None)
+        if close is not None:
+            close()
+
+
+def game_seed(base_seed, game_index):
+    # Independent and reproducible seed for each game of a run
+    return random.Random("{}:{}".format(base_seed, game_index)).getrandbits(63)
+
+
+def play_game(player_specs, seed, game_index=0, early_claims=False, profile=False, record=False):
+    game = Game(make_player(player_specs[0], 0), make_player(player_specs[1], 1), seed=seed,
+                early_claims=early_claims)
+    recorder = None
+    if record:
+        recorder = GameRecorder()
+        game.add_observer(recorder)
+    profiler = None
+    try:
+        if profile:
+            profiler = profiling.enable()
+            try:
+                winner = game.run()
+            finally:
+                profiling.disable()
+        else:
+            winner = game.run()
+    finally:
+        close_players(game.players)
+    return GameResult(game_index, seed, winner, game.n_turns, game.slot_winners(),
+                      None if profiler is None else profiler.to_dict(),
+                      None if recorder is None else recorder.record)
+
+
+def _play_game_task(args):
+    return play_game(*args)
+
+
+def play_games_batch(player_specs, seeds, first_game_index=0, early_claims=False, record=False):
+    # Games played in lockstep: on each turn, the moves of all the games
+    # which are not over are chosen together by Player.make_moves(), so that
+    # the players must be Players, and their time budget does not apply.
+    # Returns the results in the order of seeds.
+    games = [Game(make_player(player_specs[0], 0), make_player(player_specs[1], 1), seed=seed,
+                  early_claims=early_claims) for seed in seeds]
+    recorders = [None] * len(games)
+    if record:
+        for game_index, game in enumerate(games):
+            recorders[game_index] = GameRecorder()
+            game.add_observer(recorders[game_index])
+            recorders[game_index].on_game_start(game)
+    winners = [None] * len(games)
+    # Games which are not over
+    game_indexes = list(range(len(games)))
+    # The counts of empty slots of a turn are derived from those of the
+    # previous turn of the same game, see counter_combinations
+    with reserve_empty_slot_counts(2 * len(games)):
+        while game_indexes:
+            for player_index in range(2):
+                positions = [(games[i].game_state, games[i].players[player_index].hand, player_index)
+                             for i in game_indexes]
+                moves = games[game_indexes[0]].players[player_index].make_moves(positions)
+                for i, (slot_index, card) in zip(game_indexes, moves):
+                    games[i].play_move(player_index, slot_index, card)
+            for i in game_indexes:
+                winners[i] = games[i].game_winner()
+                if winners[i] is not None and recorders[i] is not None:
+                    recorders[i].on_game_over(games[i], winners[i])
+            game_indexes = [i for i in game_indexes if winners[i] is None]
+    return [GameResult(first_game_index + i, seed, winners[i], game.n_turns, game.slot_winners(), None,
+                       None if recorders[i] is None else recorders[i].record)
+            for i, (seed, game) in enumerate(zip(seeds, games))]
+
+
+def _play_games_batch_task(args):
+    return play_games_batch(*args)
+
+
+class SelfPlayRunner:
+    # batch_size: games played in lockstep by a worker, see
+    #   play_games_batch(), None to play them one by one
+    def __init__(self, player_specs=(Player, Player), n_workers=None, base_seed=0, chunksize=16,
+                 early_claims=False, profile=False, record=False, batch_size=None):
+        if profile and batch_size is not None:
+            raise ValueError("SelfPlayRunner.__init__: batched games cannot be profiled")
+        self.player_specs = tuple(player_specs)
+        self.n_workers = multiprocessing.cpu_count() if n_workers is None else n_workers
+        self.base_seed = base_seed
+        self.chunksize = chunksize
+        self.early_claims = early_claims
+        self.profile = profile
+        self.record = record
+        self.batch_size = batch_size
+
+    def _tasks(self, n_games, first_game_index):
+        for game_index in range(first_game_index, first_game_index + n_games):
+            yield (self.player_specs, game_seed(self.base_seed, game_index), game_index,
+                   self.early_claims, self.profile, self.record)
+
+    def _batch_tasks(self, n_games, first_game_index):
+        end_game_index = first_game_index + n_games
+        for batch_start in range(first_game_index, end_game_index, self.batch_size):
+            game_indexes = range(batch_start, min(batch_start + self.batch_size, end_game_index))
+            yield (self.player_specs, [game_seed(self.base_seed, game_index) for game_index in game_indexes],
+                   batch_start, self.early_claims, self.record)
+
+    def iter_results(self, n_games, first_game_index=0):
+        # Results are yielded as soon as games end, not in game order
+        if self.batch_size is not None:
+            for result in self._iter_batch_results(n_games, first_game_index):
+                yield result
+            return
+        tasks = self._tasks(n_games, first_game_index)
+        if self.n_workers <= 1:
+            for task in tasks:
+                yield _play_game_task(task)
+        else:
+            with multiprocessing.Pool(self.n_workers) as pool:
+                for result in pool.imap_unordered(_play_game_task, tasks, self.chunksize):
+                    yield result
+
+    def _iter_batch_results(self, n_games, first_game_index):
+        tasks = self._batch_tasks(n_games, first_game_index)
+        if self.n_workers <= 1:
+            for task in tasks:
+                for result in _play_games_batch_task(task):
+                    yield result
+        else:
+            with multiprocessing.Pool(self.n_workers) as pool:
+                for results in pool.imap_unordered(_play_games_batch_task, tasks):
+                    for result in results:
+                        yield result
+
+    def run(self, n_games, first_game_index=0):
+        results = list(self.iter_results(n_games, first_game_index))
+        results.sort(key=lambda result: result.game_index)
+        return results
+
+
+def summarize(results):
+    n_wins = [0, 0]
+    n_turns = 0
+    n_slots_won = [[0] * 9, [0] * 9]
+    for result in results:
+        n_wins[result.winner] += 1
+        n_turns += result.n_turns
+        for slot_index, slot_winner in enumerate(result.slot_winners):
+            if slot_winner is not None:
+                n_slots_won[slot_winner][slot_index] += 1
+    n_games = len(results)
+    summary = {"n_games": n_games,
+               "n_wins": n_wins,
+               "mean_turns": n_turns / n_games if n_games > 0 else 0,
+               "n_slots_won": n_slots_won}
+    profiles = [result.profile for result in results if result.profile is not None]
+    if profiles:
+        # Totals over the games, the stats of each move are in the results
+        profiler = profiling.Profiler(keep_moves=False)
+        for profile in profiles:
+            profiler.merge(profile)
+        summary["profile"] = profiler.to_dict()
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plays Player against Player without any display.")
+    parser.add_argument("n_games", type=int)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--profile", default=None,
+                        help="profile the games and write the stats of the run to this JSON file")
+    parser.add_argument("--record", default=None,
+                        help="append the records of the games to this file, gzipped if it ends with .gz")
+    parser.add_argument("--early-claims", action="store_true",
+                        help="end games as soon as a player has 5 slots won for sure")
+    parser.add_argument("--batch-size", type=int, default=None,
+                        help="games played in lockstep by each worker, their moves being evaluated together")
+    args = parser.parse_args()
+
+    runner = SelfPlayRunner(n_workers=args.workers, base_seed=args.seed, early_claims=args.early_claims,
+                            profile=args.profile is not None, record=args.record is not None,
+                            batch_size=args.batch_size)
+    if args.record is None:
+        results = runner.run(args.n_games)
+    else:
+        # Records are written as games end and not kept in memory
+        results = []
+        with GameRecordWriter(args.record) as writer:
+            for result in runner.iter_results(args.n_games):
+                writer.write(result.record)
+                results.append(result._replace(record=None))
+    summary = summarize(results)
+    if args.profile is not None:
+        with open(args.profile, "w") as f:
+            json.dump(summary.pop("profile"), f, indent=1)
+    print(summary)
@@ -0,0 +1,83 @@
+import numpy as np
+from card_combinations import CardCombinationsGenerator
+from combination_table import get_combination_table
+
+# Provable slot outcomes. The cards which are not played yet (in the deck or
+# in a hand) are the only ones that can complete a slot, so the lowest and
+# highest ranks a slot can end with are bounded by the combinations which
+# contain its cards and no other played card. A slot is decided as soon as
+# these bounds cannot overlap anymore, whatever cards are played next.
+
+
+_empty_slot_rank_range = None
+
+
+def completion_rank_range(slot, played_mask):
+    # Lowest and highest ranks of the combinations the slot can end with.
+    # None if it cannot be completed.
+    global _empty_slot_rank_range
+    table = get_combination_table()
+    ccg = CardCombinationsGenerator
+    if len(slot) == 3:
+        rank = table.rank_list[table.id_by_mask[slot.mask]]
+        return rank, rank
+    if len(slot) == 0:
+        # Shared by all the empty slots of a turn. Read once, since players
+        # thinking in other threads may replace it.
+        cached_range = _empty_slot_rank_range
+        if cached_range is not None and cached_range[0] == played_mask:
+            return cached_range[1]
+        comb_ids = ccg.get_all_combination_ids(played_mask)
+    elif len(slot) == 1:
+        slot_card, = slot
+        comb_ids = ccg.get_combination_ids_from_card(slot_card, played_mask)
+    else:
+        slot_card1, slot_card2, = slot
+        comb_ids = ccg.get_combination_ids_from_pair_of_cards(slot_card1, slot_card2, played_mask)
+    if len(comb_ids) == 0:
+        rank_range = None
+    else:
+        ranks = table.ranks[comb_ids]
+        rank_range = int(np.min(ranks)), int(np.max(ranks))
+    if len(slot) == 0:
+        _empty_slot_rank_range = (played_mask, rank_range)
+    return rank_range
+
+
+def get_decided_slot_winner(slot0, slot1, played_mask, first_to_finish=None):
+    # Player who wins the slot whatever cards are played next, None if it is
+    # not decided yet. first_to_finish is the player who completed the slot
+    # first, if any, who wins ties.
+    range0 = completion_rank_range(slot0, played_mask)
+    range1 = completion_rank_range(slot1, played_mask)
+    if range0 is None or range1 is None:
+        return None
+    (min0, max0), (min1, max1) = range0, range1
+    if min0 > max1:
+        return 0
+    if min1 > max0:
+        return 1
+    # Ties go to the first to finish, only known once a side is complete
+    if first_to_finish == 0 and min0 >= max1:
+        return 0
+    if first_to_finish == 1 and min1 >= max0:
+        return 1
+    return None
+
+
+def get_decided_slots(my_slots, opp_slots, played_mask):
+    # Indexes of the slots whose winner is known, seen by a player who does
+    # not know who completed a slot first when both sides are full
+    decided_slots = []
+    for slot_index, (my_slot, opp_slot) in enumerate(zip(my_slots, opp_slots)):
+        if len(my_slot) == 3 and len(opp_slot) == 3:
+            decided_slots.append(slot_index)
+            continue
+        first_to_finish = None
+        if len(my_slot) == 3:
+            first_to_finish = 0
+        elif len(opp_slot) == 3:
+            first_to_finish = 1
+        if get_decided_slot_winner(my_slot, opp_slot, played_mask, first_to_finish) is not None:
+            decided_slots.append(slot_index)
+    return decided_slots
@@ -0,0 +1,232 @@
+import argparse
+import importlib
+import itertools
+import json
+import math
+import multiprocessing
+from combination_scoring import ScoringScheme
+from game import Player
+from self_play import game_seed, play_game
+
+# Round robin tournament between player configurations ("entrants", given as
+# player specs, see self_play).
+#
+# Games are played by pairs on the same deck, each entrant playing the first
+# seat once, which removes most of the luck of the deal. The score of a pair
+# (0, 0.5 or 1 for the first entrant of the match) is the unit of the
+# statistics: Elo differences with their confidence interval are computed
+# from the mean and variance of pair scores.
+#
+# A match stops early once a sequential probability ratio test (SPRT)
+# decides between H0: Elo difference = elo0 and H1: Elo difference = elo1,
+# using the normal approximation of the log-likelihood ratio. Matches are
+# played by rounds of pairs on a process pool, and only the matches which
+# are not decided get new pairs.
+
+
+def expected_score(elo):
+    return 1 / (1 + 10 ** (-elo / 400))
+
+
+def elo_from_score(score):
+    # Clipped so that a perfect score gives a finite difference
+    score = min(max(score, 1e-3), 1 - 1e-3)
+    return -400 * math.log10(1 / score - 1)
+
+
+class MatchStats:
+    # Pair scores of the first entrant of a match
+
+    def __init__(self):
+        self.n_pairs = 0
+        self.score_sum = 0.
+        self.score_square_sum = 0.
+
+    def add(self, pair_score):
+        self.n_pairs += 1
+        self.score_sum += pair_score
+        self.score_square_sum += pair_score * pair_score
+
+    @property
+    def score(self):
+        return self.score_sum / self.n_pairs if self.n_pairs > 0 else 0.5
+
+    @property
+    def variance(self):
+        # Variance of a pair score
+        if self.n_pairs == 0:
+            return 0.
+        return max(self.score_square_sum / self.n_pairs - self.score ** 2, 0.)
+
+    def elo(self):
+        return elo_from_score(self.score)
+
+    def elo_interval(self, z=1.96):
+        # Bounds of the confidence interval of the Elo difference
+        if self.n_pairs == 0:
+            return -math.inf, math.inf
+        margin = z * math.sqrt(self.variance / self.n_pairs)
+        return elo_from_score(self.score - margin), elo_from_score(self.score + margin)
+
+    def llr(self, elo0, elo1):
+        # Log-likelihood ratio of H1 against H0, normal approximation
+        if self.n_pairs == 0 or self.variance == 0:
+            return 0.
+        score0, score1 = expected_score(elo0), expected_score(elo1)
+        return self.n_pairs * (score1 - score0) * (2 * self.score - score0 - score1) / (2 * self.variance)
+
+
+class SPRT:
+    def __init__(self, elo0=0., elo1=20., alpha=0.05, beta=0.05):
+        self.elo0 = elo0
+        self.elo1 = elo1
+        self.lower_bound = math.log(beta / (1 - alpha))
+        self.upper_bound = math.log((1 - beta) / alpha)
+
+    def decide(self, stats):
+        # "H1", "H0", or None while the test goes on
+        llr = stats.llr(self.elo0, self.elo1)
+        if llr >= self.upper_bound:
+            return "H1"
+        if llr <= self.lower_bound:
+            return "H0"
+        return None
+
+
+def play_pair(player_specs, seed, early_claims=False):
+    # Score of the first player for two games on the same deck, seats swapped
+    first = play_game(player_specs, seed, early_claims=early_claims)
+    second = play_game((player_specs[1], player_specs[0]), seed, early_claims=early_claims)
+    return ((first.winner == 0) + (second.winner == 1)) / 2
+
+
+def _play_pair_task(args):
+    match, pair_index, player_specs, seed, early_claims = args
+    return match, pair_index, play_pair(player_specs, seed, early_claims)
+
+
+class Tournament:
+    # entrants: name -> player spec
+    # max_pairs: pairs per match when SPRT does not stop it earlier
+    # sprt: SPRT, or None to always play max_pairs
+    # round_pairs: pairs scheduled per match and per round
+    def __init__(self, entrants, max_pairs=200, sprt=None, n_workers=None, base_seed=0, round_pairs=16,
+                 early_claims=False):
+        if len(entrants) < 2:
+            raise ValueError("Tournament.__init__: at least 2 entrants are needed, {} found".format(len(entrants)))
+        self.entrants = dict(entrants)
+        self.max_pairs = max_pairs
+        self.sprt = sprt
+        self.n_workers = multiprocessing.cpu_count() if n_workers is None else n_workers
+        self.base_seed = base_seed
+        self.round_pairs = round_pairs
+        self.early_claims = early_claims
+        self.matches = list(itertools.combinations(self.entrants, 2))
+        self.stats = {match: MatchStats() for match in self.matches}
+        self.decisions = {match: None for match in self.matches}
+
+    def is_active(self, match):
+        return self.decisions[match] is None and self.stats[match].n_pairs < self.max_pairs
+
+    def _round_tasks(self):
+        tasks = []
+        for match in self.matches:
+            if not self.is_active(match):
+                continue
+            n_pairs = self.stats[match].n_pairs
+            player_specs = (self.entrants[match[0]], self.entrants[match[1]])
+            for pair_index in range(n_pairs, min(n_pairs + self.round_pairs, self.max_pairs)):
+                # All the matches are played on the same decks
+                tasks.append((match, pair_index, player_specs, game_seed(self.base_seed, pair_index),
+                              self.early_claims))
+        return tasks
+
+    def _add_results(self, results):
+        # Pairs are added in order, for the results not to depend on the
+        # number of workers
+        for match, pair_index, pair_score in sorted(results, key=lambda result: result[:2]):
+            self.stats[match].add(pair_score)
+        if self.sprt is not None:
+            for match in self.matches:
+                if self.decisions[match] is None:
+                    self.decisions[match] = self.sprt.decide(self.stats[match])
+
+    def run(self):
+        pool = None
+        if self.n_workers > 1:
+            pool = multiprocessing.Pool(self.n_workers)
+        try:
+            tasks = self._round_tasks()
+            while tasks:
+                if pool is None:
+                    results = [_play_pair_task(task) for task in tasks]
+                else:
+                    results = pool.map(_play_pair_task, tasks)
+                self._add_results(results)
+                tasks = self._round_tasks()
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        return self.summary()
+
+    def summary(self):
+        matches = []
+        total_scores = {name: [0., 0] for name in self.entrants}
+        for match in self.matches:
+            stats = self.stats[match]
+            matches.append({"entrants": list(match),
+                            "n_pairs": stats.n_pairs,
+                            "score": stats.score,
+                            "elo": stats.elo(),
+                            "elo_interval": list(stats.elo_interval()),
+                            "decision": self.decisions[match]})
+            total_scores[match[0]][0] += stats.score_sum
+            total_scores[match[1]][0] += stats.n_pairs - stats.score_sum
+            for name in match:
+                total_scores[name][1] += stats.n_pairs
+        scores = {name: score / n_pairs if n_pairs > 0 else 0.5
+                  for name, (score, n_pairs) in total_scores.items()}
+        return {"matches": matches, "scores": scores}
+
+
+def load_entrants(path):
+    # JSON file: {name: {"class": "module.Class", "kwargs": {...}}}. An
+    # entrant may also give "category_factors": [...], such as the best
+    # factors of tuning, passed to the player as its scoring_scheme.
+    with open(path) as f:
+        entrants_config = json.load(f)
+    entrants = {}
+    for name, config in entrants_config.items():
+        module_name, class_name = config["class"].rsplit(".", 1)
+        player_class = getattr(importlib.import_module(module_name), class_name)
+        kwargs = dict(config.get("kwargs", {}))
+        if "category_factors" in config:
+            kwargs["scoring_scheme"] = ScoringScheme(tuple(config["category_factors"]))
+        entrants[name] = (player_class, kwargs)
+    return entrants
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Round robin tournament between players.")
+    parser.add_argument("--entrants", default=None,
+                        help='JSON file: {name: {"class": "module.Class", "kwargs": {...}}}, '
+                             'with optionally "category_factors": [...] for the scoring scheme. '
+                             'Defaults to Player against Player skipping decided slots.')
+    parser.add_argument("--max-pairs", type=int, default=200)
+    parser.add_argument("--no-sprt", action="store_true")
+    parser.add_argument("--elo0", type=float, default=0.)
+    parser.add_argument("--elo1", type=float, default=20.)
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument("--beta", type=float, default=0.05)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.entrants is None:
+        entrants = {"player": Player, "skip_decided": (Player, {"skip_decided_slots": True})}
+    else:
+        entrants = load_entrants(args.entrants)
+    sprt = None if args.no_sprt else SPRT(args.elo0, args.elo1, args.alpha, args.beta)
+    tournament = Tournament(entrants, args.max_pairs, sprt, args.workers, args.seed)
+    print(json.dumps(tournament.run(), indent=1))
@@ -0,0 +1,219 @@
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import random
+from combination_scoring import ScoringScheme
+from game import Player
+from self_play import game_seed
+from tournament import MatchStats, play_pair
+
+# Search of ScoringScheme category factors by self-play.
+#
+# Candidates are Players weighting the combinations of their moves with a
+# ScoringScheme (see MoveEvaluator). Each candidate plays pairs of games
+# (see tournament.play_pair) against a fixed baseline player, and its
+# fitness is its mean pair score. Every candidate plays the same decks, so
+# that candidates are compared on the same deals.
+#
+# method="random" plays min_pairs pairs with every candidate. With
+# method="halving" (successive halving), the candidates play min_pairs
+# pairs, the best 1/eta of them go on to eta times more pairs, and so on
+# until one candidate is left or max_pairs is reached: most of the games
+# are spent on the best candidates.
+#
+# Moves are only ranked by scores, so that multiplying all the factors by
+# the same number does not change a player: the first factor is fixed to 1
+# and each factor is the previous one times a ratio drawn log-uniformly in
+# [1, max_ratio], which keeps them non-decreasing.
+#
+# Pairs are played on a process pool. The state of the search is saved to a
+# JSON checkpoint every checkpoint_every pairs, and a search started with
+# the checkpoint of the same configuration resumes from it.
+
+CHECKPOINT_VERSION = 1
+
+
+def sample_factors(rng, max_ratio=4.):
+    factors = [1.]
+    for _ in range(4):
+        factors.append(round(factors[-1] * math.exp(rng.uniform(0, math.log(max_ratio))), 3))
+    return tuple(factors)
+
+
+def _play_candidate_pair(args):
+    candidate_index, pair_index, player_specs, seed, early_claims = args
+    return candidate_index, pair_index, play_pair(player_specs, seed, early_claims)
+
+
+class FactorSearch:
+    # baseline_spec: player spec of the baseline, see self_play
+    # method: "random" or "halving", see the module comment
+    # min_pairs: pairs per candidate, in the first rung for "halving"
+    # max_pairs: maximum pairs per candidate for "halving", None for no limit
+    # candidates: factors to try, None to draw n_candidates of them
+    # checkpoint_path: JSON file the search is saved to, None not to save it
+    def __init__(self, n_candidates=27, method="halving", min_pairs=8, eta=3, max_pairs=None,
+                 baseline_spec=Player, n_workers=None, base_seed=0, max_ratio=4., candidates=None,
+                 checkpoint_path=None, checkpoint_every=64, early_claims=False):
+        if method not in ("random", "halving"):
+            raise ValueError("FactorSearch.__init__: unknown method {}".format(method))
+        if eta < 2:
+            raise ValueError("FactorSearch.__init__: eta must be at least 2, {} found".format(eta))
+        self.method = method
+        self.min_pairs = min_pairs
+        self.eta = eta
+        self.max_pairs = max_pairs
+        self.baseline_spec = baseline_spec
+        self.n_workers = multiprocessing.cpu_count() if n_workers is None else n_workers
+        self.base_seed = base_seed
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_every = checkpoint_every
+        self.early_claims = early_claims
+        if candidates is None:
+            rng = random.Random(base_seed)
+            candidates = [sample_factors(rng, max_ratio) for _ in range(n_candidates)]
+        self.candidates = []
+        for factors in candidates:
+            factors = tuple(factors)
+            # Raises ValueError for factors ScoringScheme does not accept
+            ScoringScheme(factors)
+            self.candidates.append(factors)
+        # Pair scores of each candidate, in the order of the pairs
+        self.pair_scores = [[] for _ in self.candidates]
+        self.rung = 0
+        self.alive = list(range(len(self.candidates)))
+        self.done = False
+        if checkpoint_path is not None and os.path.exists(checkpoint_path):
+            self.load_checkpoint()
+
+    def get_config(self):
+        # What a checkpoint must match to be resumed
+        return {"method": self.method, "min_pairs": self.min_pairs, "eta": self.eta,
+                "max_pairs": self.max_pairs, "base_seed": self.base_seed, "early_claims": self.early_claims,
+                "candidates": [list(factors) for factors in self.candidates]}
+
+    def save_checkpoint(self):
+        state = {"v": CHECKPOINT_VERSION, "config": self.get_config(), "pair_scores": self.pair_scores,
+                 "rung": self.rung, "alive": self.alive, "done": self.done}
+        # Written next to the checkpoint then renamed, for an interrupted
+        # save not to lose the previous checkpoint
+        temp_path = self.checkpoint_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(temp_path, self.checkpoint_path)
+
+    def load_checkpoint(self):
+        with open(self.checkpoint_path) as f:
+            state = json.load(f)
+        if state.get("v") != CHECKPOINT_VERSION:
+            raise ValueError("FactorSearch.load_checkpoint: unsupported checkpoint version {}".format(state.get("v")))
+        if state["config"] != self.get_config():
+            raise ValueError("FactorSearch.load_checkpoint: {} is the checkpoint of another search"
+                             .format(self.checkpoint_path))
+        self.pair_scores = state["pair_scores"]
+        self.rung = state["rung"]
+        self.alive = state["alive"]
+        self.done = state["done"]
+
+    def get_player_spec(self, candidate_index):
+        return Player, {"scoring_scheme": ScoringScheme(self.candidates[candidate_index])}
+
+    def get_stats(self, candidate_index):
+        stats = MatchStats()
+        for pair_score in self.pair_scores[candidate_index]:
+            stats.add(pair_score)
+        return stats
+
+    def rung_pairs(self):
+        # Pairs each alive candidate has to play in the current rung
+        if self.method == "random":
+            return self.min_pairs
+        n_pairs = self.min_pairs * self.eta ** self.rung
+        return n_pairs if self.max_pairs is None else min(n_pairs, self.max_pairs)
+
+    def _rung_tasks(self):
+        n_pairs = self.rung_pairs()
+        tasks = []
+        for candidate_index in self.alive:
+            player_specs = (self.get_player_spec(candidate_index), self.baseline_spec)
+            for pair_index in range(len(self.pair_scores[candidate_index]), n_pairs):
+                tasks.append((candidate_index, pair_index, player_specs, game_seed(self.base_seed, pair_index),
+                              self.early_claims))
+        return tasks
+
+    def _play(self, tasks, pool):
+        for start in range(0, len(tasks), self.checkpoint_every):
+            batch = tasks[start:start + self.checkpoint_every]
+            if pool is None:
+                results = [_play_candidate_pair(task) for task in batch]
+            else:
+                results = pool.map(_play_candidate_pair, batch)
+            # Tasks of a candidate are in the order of its pairs
+            for candidate_index, pair_index, pair_score in results:
+                self.pair_scores[candidate_index].append(pair_score)
+            if self.checkpoint_path is not None:
+                self.save_checkpoint()
+
+    def _next_rung(self):
+        if self.method == "random" or (self.max_pairs is not None and self.rung_pairs() >= self.max_pairs):
+            self.done = True
+            return
+        # Ties are broken by candidate index, for a reproducible search
+        n_kept = max(len(self.alive) // self.eta, 1)
+        self.alive = sorted(self.alive, key=lambda candidate_index: -self.get_stats(candidate_index).score)[:n_kept]
+        self.alive.sort()
+        self.rung += 1
+        self.done = len(self.alive) == 1
+
+    def run(self):
+        pool = None
+        if self.n_workers > 1:
+            pool = multiprocessing.Pool(self.n_workers)
+        try:
+            while not self.done:
+                self._play(self._rung_tasks(), pool)
+                self._next_rung()
+                if self.checkpoint_path is not None:
+                    self.save_checkpoint()
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        return self.summary()
+
+    def summary(self):
+        # Candidates sorted from the best, those which played the most pairs
+        # first
+        candidates = []
+        for candidate_index, factors in enumerate(self.candidates):
+            stats = self.get_stats(candidate_index)
+            candidates.append({"factors": list(factors),
+                               "n_pairs": stats.n_pairs,
+                               "score": stats.score,
+                               "elo": stats.elo(),
+                               "elo_interval": list(stats.elo_interval())})
+        candidates.sort(key=lambda candidate: (-candidate["n_pairs"], -candidate["score"]))
+        return {"best": candidates[0]["factors"], "rung": self.rung, "candidates": candidates}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Searches ScoringScheme category factors by self-play "
+                                                 "against Player.")
+    parser.add_argument("--method", choices=["random", "halving"], default="halving")
+    parser.add_argument("--candidates", type=int, default=27)
+    parser.add_argument("--min-pairs", type=int, default=8)
+    parser.add_argument("--eta", type=int, default=3)
+    parser.add_argument("--max-pairs", type=int, default=None)
+    parser.add_argument("--max-ratio", type=float, default=4.)
+    parser.add_argument("--checkpoint", default=None, help="JSON file to save the search to and resume it from")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--early-claims", action="store_true")
+    args = parser.parse_args()
+
+    search = FactorSearch(args.candidates, args.method, args.min_pairs, args.eta, args.max_pairs,
+                          n_workers=args.workers, base_seed=args.seed, max_ratio=args.max_ratio,
+                          checkpoint_path=args.checkpoint, early_claims=args.early_claims)
+    print(json.dumps(search.run(), indent=1))
@@ -1,12 +1,40 @@
 import sys
+import random
 import unittest
 import collections
 import itertools
+import json
+import os
+import tempfile
+import pickle
+import asyncio
+import concurrent.futures
+import multiprocessing
+import numpy as np
 from card_combinations import CardCombination, CardCombinationsGenerator
-from game_elements import Card, ALL_CARDS, MAX_CARDS_PER_HAND
+from game_elements import Card, ALL_CARDS, MAX_CARDS_PER_HAND, ALL_CARDS_MASK, CARDS_BY_INDEX, \
+    CardSet, cards_to_mask, mask_to_cards
 from game import Slot, GameState, HumanPlayer, Player, Game
-from proba_engine import ProbaEngine
+from proba_engine import ProbaEngine, IncrementalProbaEngine
 from combination_scoring import ScoringScheme
+from game_observers import GameObserver
+from benchmarks import POSITIONS, compare, get_benchmarks, get_position, run_benchmarks
+from self_play import SelfPlayRunner, make_player, play_game, play_games_batch, summarize
+from mcts_player import MCTSPlayer, SimulationState, determinize, get_search_position, search
+from slot_outcomes import completion_rank_range, get_decided_slot_winner, get_decided_slots
+from zobrist import slots_key
+import profiling
+from game_records import GameRecordWriter, GameRecorder, decode_move, encode_move, get_moves, read_game_records
+from replay import ReplayEngine, iter_positions, replay_record, replay_records_batch, summarize_replay
+from tournament import SPRT, MatchStats, Tournament, elo_from_score, expected_score, load_entrants
+from move_evaluator import MoveEvaluator, MoveScoreCache, default_move_score_cache
+import counter_combinations
+from counter_combinations import EmptySlotCounterCounts, get_empty_slot_counts, reserve_empty_slot_counts
+from tuning import FactorSearch, sample_factors
+from game_server import GameServer, get_bot_player
+import combination_table
+from combination_table import N_COMBINATIONS, TABLE_ARRAYS, CombinationTable, combination_id, \
+    compute_category_value, get_combination_table
 
 
 """
@@ -827,6 +855,1329 @@ TestPlayer().test_make_move()
 """
 
 
+class TestCardEncoding(unittest.TestCase):
+
+    def test_card_index(self):
+        self.assertEqual(len(CARDS_BY_INDEX), 54)
+        for i, card in enumerate(CARDS_BY_INDEX):
+            self.assertEqual(card.index, i)
+            self.assertEqual(card.mask, 1 << i)
+            self.assertEqual(Card.from_index(i), card)
+            self.assertEqual(Card(card.color, card.number).index, i)
+
+        # Index order is the card order
+        cards = sorted(ALL_CARDS, key=lambda c: (c.number, c.color))
+        self.assertEqual(cards, CARDS_BY_INDEX)
+
+    def test_masks(self):
+        cards = [Card("red", 1), Card("blue", 9), Card("green", 3)]
+        mask = cards_to_mask(cards)
+        self.assertEqual(mask.bit_count(), 3)
+        self.assertEqual(mask_to_cards(mask), sorted(cards))
+        self.assertEqual(cards_to_mask(mask), mask)
+        self.assertEqual(cards_to_mask(CardSet(cards)), mask)
+        self.assertEqual(cards_to_mask(ALL_CARDS), ALL_CARDS_MASK)
+
+    def test_card_set(self):
+        cs = CardSet([Card("red", 1), Card("blue", 9)])
+        self.assertEqual(len(cs), 2)
+        self.assertIn(Card("red", 1), cs)
+        self.assertNotIn(Card("red", 2), cs)
+        self.assertEqual(cs, {Card("red", 1), Card("blue", 9)})
+
+        cs.add(Card("red", 2))
+        cs.remove(Card("red", 1))
+        self.assertEqual(list(cs), [Card("red", 2), Card("blue", 9)])
+        self.assertRaises(KeyError, cs.remove, Card("red", 1))
+
+        other = CardSet([Card("red", 2), Card("green", 5)])
+        self.assertEqual(cs | other, {Card("red", 2), Card("blue", 9), Card("green", 5)})
+        self.assertEqual(cs & other, {Card("red", 2)})
+        self.assertEqual(cs - other, {Card("blue", 9)})
+        self.assertFalse(cs.isdisjoint(other))
+
+
+TestCardEncoding().test_card_index()
+TestCardEncoding().test_masks()
+TestCardEncoding().test_card_set()
+
+
+class TestCombinationTable(unittest.TestCase):
+
+    def test_table(self):
+        table = get_combination_table()
+        self.assertEqual(N_COMBINATIONS, 24804)
+        self.assertEqual(len(table.ranks), 24804)
+        self.assertEqual(len(table.id_by_mask), 24804)
+
+        for comb_id in range(0, N_COMBINATIONS, 97):
+            i, j, k = table.cards[comb_id].tolist()
+            self.assertTrue(i < j < k)
+            self.assertEqual(combination_id(i, j, k), comb_id)
+            cards = table.get_cards(comb_id)
+            self.assertEqual(compute_category_value(cards),
+                             (table.category_list[comb_id], table.value_list[comb_id]))
+            self.assertEqual(table.get_id(cards), comb_id)
+
+    def test_ranks(self):
+        table = get_combination_table()
+        combs = [CardCombination.from_id(comb_id) for comb_id in range(0, N_COMBINATIONS, 31)]
+        for comb1, comb2 in zip(combs, reversed(combs)):
+            by_category_value = (comb1.category, comb1.value) < (comb2.category, comb2.value)
+            self.assertEqual(comb1 < comb2, by_category_value)
+            self.assertEqual(comb1.rank == comb2.rank,
+                             (comb1.category, comb1.value) == (comb2.category, comb2.value))
+        self.assertEqual(table.n_ranks, 63)
+
+    def test_from_id(self):
+        comb = CardCombination(Card("red", 7), Card("brown", 9), Card("red", 8))
+        self.assertEqual(CardCombination.from_id(comb.id), comb)
+        self.assertIs(CardCombination.from_id(comb.id), CardCombination.from_id(comb.id))
+        self.assertEqual(comb.name, "Suite")
+
+    def test_scoring_scheme(self):
+        sc = ScoringScheme((1, 2, 3, 6, 10))
+        for comb_id in range(0, N_COMBINATIONS, 53):
+            comb = CardCombination.from_id(comb_id)
+            self.assertEqual(sc.get_score(comb),
+                             ScoringScheme.get_base_score(comb) * sc.category_factors[comb.category])
+
+    def test_cache(self):
+        computed_table = CombinationTable()
+        saved_state = (combination_table.TABLE_CACHE_DIR, combination_table._combination_table)
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                combination_table.TABLE_CACHE_DIR = directory
+                combination_table._combination_table = None
+                # Computed and saved, then loaded
+                get_combination_table()
+                self.assertTrue(os.path.isdir(combination_table.get_table_path()))
+                combination_table._combination_table = None
+                table = get_combination_table()
+                for name in TABLE_ARRAYS:
+                    array = getattr(table, name)
+                    self.assertFalse(array.flags.writeable)
+                    self.assertEqual(array.dtype, getattr(computed_table, name).dtype)
+                    self.assertTrue(np.array_equal(array, getattr(computed_table, name)))
+                self.assertEqual(table.id_by_mask, computed_table.id_by_mask)
+                self.assertEqual(table.n_ranks, computed_table.n_ranks)
+                # Saving again is harmless
+                table.save(combination_table.get_table_path())
+                self.assertEqual(os.listdir(directory), [os.path.basename(combination_table.get_table_path())])
+                # A corrupt or stale table is computed and saved again
+                table_path = combination_table.get_table_path()
+                info_path = os.path.join(table_path, combination_table.TABLE_INFO_FILE)
+                ranks = np.array(computed_table.ranks)
+                ranks[0] += 1
+                corruptions = [lambda: np.save(os.path.join(table_path, "cards.npy"), np.zeros(3)),
+                               lambda: np.save(os.path.join(table_path, "masks.npy"),
+                                               computed_table.masks.astype(np.int64)),
+                               lambda: np.save(os.path.join(table_path, "ranks.npy"), ranks),
+                               lambda: os.remove(info_path)]
+                for corrupt in corruptions:
+                    corrupt()
+                    combination_table._combination_table = None
+                    with self.assertWarns(UserWarning):
+                        get_combination_table()
+                    self.assertEqual(os.listdir(directory), [os.path.basename(table_path)])
+                    table = CombinationTable.load(table_path)
+                    self.assertTrue(np.array_equal(table.ranks, computed_table.ranks))
+                with open(info_path) as f:
+                    info = json.load(f)
+                info["version"] += 1
+                with open(info_path, "w") as f:
+                    json.dump(info, f)
+                self.assertRaises(ValueError, CombinationTable.load, table_path)
+
+                # Without a writable cache, the table is only kept in memory
+                cache_file = os.path.join(directory, "file")
+                with open(cache_file, "w"):
+                    pass
+                combination_table.TABLE_CACHE_DIR = os.path.join(cache_file, "cache")
+                combination_table._combination_table = None
+                table = get_combination_table()
+                self.assertTrue(np.array_equal(table.cards, computed_table.cards))
+                self.assertEqual(sorted(os.listdir(directory)), sorted([os.path.basename(table_path), "file"]))
+        finally:
+            combination_table.TABLE_CACHE_DIR, combination_table._combination_table = saved_state
+
+
+TestCombinationTable().test_table()
+TestCombinationTable().test_cache()
+TestCombinationTable().test_ranks()
+TestCombinationTable().test_from_id()
+TestCombinationTable().test_scoring_scheme()
+
+
+class TestCombinationIds(unittest.TestCase):
+
+    def test_get_combination_ids_from_card(self):
+        forbidden = [Card("red", 2), Card("blue", 2), Card("red", 1)]
+        for c_card in ALL_CARDS:
+            comb_ids = CardCombinationsGenerator.get_combination_ids_from_card(c_card)
+            self.assertEqual(len(comb_ids), 1378)
+
+            comb_ids = CardCombinationsGenerator.get_combination_ids_from_card(c_card, forbidden)
+            combs = CardCombinationsGenerator.combinations_from_ids(comb_ids)
+            n_allowed = 51 if c_card in forbidden else 50
+            self.assertEqual(len(combs), n_allowed * (n_allowed - 1) // 2)
+            for comb in combs:
+                self.assertIn(c_card, comb.cards)
+                for card in comb:
+                    self.assertTrue(card == c_card or card not in forbidden)
+
+    def test_get_combination_ids_from_pair_of_cards(self):
+        forbidden = cards_to_mask([Card("red", 2), Card("blue", 2)])
+        for card1, card2 in itertools.combinations(ALL_CARDS, 2):
+            comb_ids = CardCombinationsGenerator.get_combination_ids_from_pair_of_cards(card1, card2)
+            self.assertEqual(len(comb_ids), 52)
+
+            comb_ids = CardCombinationsGenerator.get_combination_ids_from_pair_of_cards(card1, card2,
+                                                                                        forbidden)
+            n_forbidden = (forbidden & ~(card1.mask | card2.mask)).bit_count()
+            self.assertEqual(len(comb_ids), 52 - n_forbidden)
+            for comb in CardCombinationsGenerator.combinations_from_ids(comb_ids):
+                self.assertIn(card1, comb.cards)
+                self.assertIn(card2, comb.cards)
+
+    def test_get_all_combination_ids(self):
+        self.assertEqual(len(CardCombinationsGenerator.get_all_combination_ids()), 24804)
+        cards = [Card("red", 1), Card("blue", 1), Card("green", 1),
+                 Card("yellow", 1), Card("brown", 1), Card("purple", 1)]
+        self.assertEqual(len(CardCombinationsGenerator.get_all_combination_ids(cards)), 17296)
+        self.assertEqual(len(CardCombinationsGenerator().get_all_combinations(cards)), 17296)
+
+
+TestCombinationIds().test_get_combination_ids_from_card()
+TestCombinationIds().test_get_combination_ids_from_pair_of_cards()
+TestCombinationIds().test_get_all_combination_ids()
+
+
+class TestCounterCombinations(unittest.TestCase):
+
+    @staticmethod
+    def get_game_state():
+        gs = GameState()
+        gs.add_to_slot(0, 0, Card("blue", 7))
+        gs.add_to_slot(0, 1, Card("red", 2))
+        gs.add_to_slot(0, 1, Card("red", 3))
+        gs.add_to_slot(1, 1, Card("blue", 6))
+        gs.add_to_slot(1, 2, Card("red", 7))
+        gs.add_to_slot(1, 2, Card("red", 8))
+        gs.add_to_slot(1, 3, Card("brown", 7))
+        gs.add_to_slot(1, 3, Card("brown", 8))
+        gs.add_to_slot(1, 3, Card("brown", 9))
+        return gs
+
+    def test_count_counter_combs(self):
+        gs = self.get_game_state()
+        player = Player()
+        combs = [CardCombination(Card("green", 1), Card("yellow", 4), Card("purple", 9)),
+                 CardCombination(Card("green", 5), Card("yellow", 5), Card("purple", 5)),
+                 CardCombination(Card("blue", 7), Card("blue", 8), Card("blue", 9)),
+                 CardCombination(Card("red", 2), Card("red", 3), Card("red", 4)),
+                 CardCombination(Card("red", 2), Card("red", 3), Card("yellow", 9))]
+        for comb in combs:
+            for i in range(4):
+                opp_slot = gs.slots[1][i]
+                winning_counter_combs = player.get_winning_counter_combs(comb, opp_slot, gs)
+                n_equal = sum(1 for wcc in winning_counter_combs if wcc.rank == comb.rank)
+                self.assertEqual(player.count_counter_combs(comb, opp_slot, gs),
+                                 (len(winning_counter_combs) - n_equal, n_equal))
+
+    def test_get_move_scores(self):
+        gs = self.get_game_state()
+        player = Player()
+        for card in [Card("green", 4), Card("red", 4), Card("yellow", 9)]:
+            for my_slot_index, opp_slot_index in [(2, 3), (1, 2), (1, 0), (0, 3)]:
+                my_slot = gs.slots[0][my_slot_index]
+                opp_slot = gs.slots[1][opp_slot_index]
+                if len(my_slot) == 0:
+                    combs = player.ccg.get_combinations_from_card(card, gs.played_cards)
+                elif len(my_slot) == 1:
+                    slot_card, = my_slot
+                    combs = player.ccg.get_combinations_from_pair_of_cards(card, slot_card,
+                                                                           gs.played_cards)
+                else:
+                    combs = [CardCombination(card, *my_slot)]
+
+                n_zero_counter = 0
+                move_score = 0
+                for comb in combs:
+                    n_better, n_equal = player.count_counter_combs(comb, opp_slot, gs)
+                    if n_better + n_equal == 0:
+                        n_zero_counter += 1
+                    else:
+                        move_score += 1 / (n_better + 0.5 * n_equal)
+
+                scores = player.get_move_scores(card, my_slot, opp_slot, gs)
+                self.assertEqual(scores[0], n_zero_counter)
+                self.assertAlmostEqual(scores[1], move_score)
+
+    def test_add_played_cards(self):
+        # Counts updated to more played cards are the counts of these cards
+        rng = random.Random(3)
+        card_indexes = rng.sample(range(len(ALL_CARDS)), 20)
+        played_mask = sum(1 << card_index for card_index in card_indexes[:5])
+        counts = EmptySlotCounterCounts(played_mask)
+        for n_played in (5, 6, 12, 20):
+            played_mask = sum(1 << card_index for card_index in card_indexes[:n_played])
+            updated = counts.copy()
+            updated.add_played_cards(played_mask)
+            expected = EmptySlotCounterCounts(played_mask)
+            for name in ("all_at_least", "card_at_least", "pair_at_least", "allowed"):
+                self.assertTrue(np.array_equal(getattr(updated, name), getattr(expected, name)), name)
+            counts = updated
+        # Cached counts are derived from those of fewer played cards
+        counts = get_empty_slot_counts(played_mask)
+        self.assertIs(get_empty_slot_counts(played_mask), counts)
+        self.assertTrue(np.array_equal(get_empty_slot_counts(played_mask | 1 << 53).pair_at_least,
+                                       EmptySlotCounterCounts(played_mask | 1 << 53).pair_at_least))
+        # Room reserved for the counts of a batch is given back after it
+        n_counts = counter_combinations._empty_slot_counts_maxsize + 8
+        card_indexes = rng.sample(range(len(ALL_CARDS)), n_counts)
+        with reserve_empty_slot_counts(n_counts):
+            for n_played in range(n_counts):
+                get_empty_slot_counts(sum(1 << card_index for card_index in card_indexes[:n_played]))
+            self.assertEqual(len(counter_combinations._empty_slot_counts), n_counts)
+        self.assertEqual(len(counter_combinations._empty_slot_counts), counter_combinations._empty_slot_counts_maxsize)
+
+    def test_threads(self):
+        # Counts derived and evicted by bots thinking in threads, see
+        # game_server
+
+        def use_counts(seed):
+            rng = random.Random(seed)
+            card_indexes = rng.sample(range(len(ALL_CARDS)), 30)
+            for n_played in range(30):
+                counts = get_empty_slot_counts(sum(1 << card_index for card_index in card_indexes[:n_played]))
+            return counts
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            with concurrent.futures.ThreadPoolExecutor(4) as executor:
+                all_counts = list(executor.map(use_counts, range(8)))
+        finally:
+            sys.setswitchinterval(switch_interval)
+        for counts in all_counts[:2]:
+            self.assertTrue(np.array_equal(counts.pair_at_least,
+                                           EmptySlotCounterCounts(counts.played_mask).pair_at_least))
+
+
+TestCounterCombinations().test_count_counter_combs()
+TestCounterCombinations().test_get_move_scores()
+TestCounterCombinations().test_add_played_cards()
+TestCounterCombinations().test_threads()
+
+
+class TestMoveEvaluator(unittest.TestCase):
+
+    def test_evaluate(self):
+        rng = random.Random(7)
+        player = Player(0)
+        for n_played in [0, 7, 20, 35]:
+            cards = list(CARDS_BY_INDEX)
+            rng.shuffle(cards)
+            gs = GameState()
+            while len(gs.played_cards) < n_played:
+                player_index = rng.randrange(2)
+                slot_index = rng.randrange(9)
+                if len(gs.slots[player_index][slot_index]) < 3:
+                    gs.add_to_slot(player_index, slot_index, cards.pop())
+            player.hand = CardSet(cards[:6])
+
+            moves_scores = player.get_moves_scores(gs)
+            for slot_index, (my_slot, opp_slot) in enumerate(zip(gs.slots[0], gs.slots[1])):
+                for card in player.hand:
+                    if len(my_slot) == 3:
+                        self.assertNotIn((slot_index, card), moves_scores)
+                        continue
+                    n_zero_counter, move_score = player.get_move_scores(card, my_slot, opp_slot, gs)
+                    self.assertEqual(moves_scores[(slot_index, card)][0], n_zero_counter)
+                    self.assertAlmostEqual(moves_scores[(slot_index, card)][1], move_score)
+
+    def test_make_move(self):
+        player = Player(0)
+        gs = GameState()
+        player.hand = CardSet([Card("red", 1), Card("blue", 5), Card("green", 9)])
+        slot_index, card = player.make_move(gs)
+        self.assertIn(card, player.hand)
+        self.assertTrue(0 <= slot_index < 9)
+
+    def test_evaluate_batch(self):
+        # Positions of different games, evaluated together or one by one
+        positions = []
+        for seed in range(4):
+            record = play_game((Player, Player), seed, record=True).record
+            for ply, player_index, gs, hand, move in iter_positions(record):
+                if ply % 7 == seed:
+                    positions.append((gs.clone(), hand.copy(), player_index))
+        for player in (Player(), Player(skip_decided_slots=True, scoring_scheme=ScoringScheme((1, 2, 3, 6, 10)))):
+            player.move_evaluator.cache = None
+            batch = [(hand, gs.slots[index], gs.slots[1 - index], gs.played_cards.mask,
+                      player.get_playable_slots(gs, index)) for gs, hand, index in positions]
+            batch_scores = player.move_evaluator.evaluate_batch(batch)
+            for position, moves_scores in zip(batch, batch_scores):
+                self.assertEqual(list(player.move_evaluator.evaluate(*position).items()), list(moves_scores.items()))
+            moves = []
+            for gs, hand, index in positions:
+                player.index, player.opponent_index, player.hand = index, 1 - index, hand
+                moves.append(player.make_move(gs))
+            self.assertEqual(player.make_moves(positions), moves)
+        self.assertEqual(Player().move_evaluator.evaluate_batch([]), [])
+
+
+TestMoveEvaluator().test_evaluate()
+TestMoveEvaluator().test_make_move()
+TestMoveEvaluator().test_evaluate_batch()
+
+
+class TestMoveScoreCache(unittest.TestCase):
+
+    def test_lru(self):
+        cache = MoveScoreCache(maxsize=2)
+        cache.put(1, (0, 1.))
+        cache.put(2, (0, 2.))
+        self.assertEqual(cache.get(1), (0, 1.))
+        cache.put(3, (0, 3.))
+        self.assertIsNone(cache.get(2))
+        self.assertEqual(cache.get(3), (0, 3.))
+        self.assertEqual(tuple(cache.info()), (2, 1, 2, 2))
+        cache.clear()
+        self.assertEqual(tuple(cache.info()), (0, 0, 2, 0))
+
+    def test_get_key(self):
+        card = Card("red", 5)
+        opp_slot = Slot([Card("blue", 1), Card("blue", 2), Card("blue", 3)])
+        played_mask = cards_to_mask(opp_slot) | Card("green", 4).mask
+        key = MoveScoreCache.get_key(card, Slot([Card("red", 6), Card("red", 7)]), opp_slot, played_mask)
+        self.assertEqual(key[3], 0)
+        key = MoveScoreCache.get_key(card, Slot([Card("red", 6)]), opp_slot, played_mask)
+        self.assertEqual(key[3], played_mask)
+        # Only the played cards of counter combinations at least as strong
+        # as the combination made by the move remain in the key
+        opp_slot = Slot([Card("blue", 1), Card("blue", 2)])
+        played_mask = Card("blue", 3).mask | Card("green", 4).mask
+        key = MoveScoreCache.get_key(card, Slot([Card("red", 6), Card("red", 7)]), opp_slot, played_mask)
+        self.assertEqual(key[3], 0)
+        key = MoveScoreCache.get_key(Card("yellow", 8), Slot([Card("red", 1), Card("green", 3)]), opp_slot,
+                                     played_mask)
+        self.assertEqual(key[3], Card("blue", 3).mask)
+
+    def test_evaluate(self):
+        cache = MoveScoreCache()
+        evaluator = MoveEvaluator(cache)
+        game, player = get_position(POSITIONS["mid"])
+        gs = game.game_state
+        args = (player.hand, gs.slots[player.index], gs.slots[player.opponent_index], gs.played_cards.mask)
+        moves_scores = MoveEvaluator().evaluate(*args)
+        self.assertEqual(list(evaluator.evaluate(*args).items()), list(moves_scores.items()))
+        n_misses = cache.misses
+        self.assertEqual(cache.hits, 0)
+        self.assertEqual(list(evaluator.evaluate(*args).items()), list(moves_scores.items()))
+        self.assertEqual(cache.hits, n_misses)
+        self.assertEqual(cache.misses, n_misses)
+
+    def test_threads(self):
+        # Lookups and evictions of bots thinking in threads, see game_server
+        cache = MoveScoreCache(maxsize=2)
+
+        def use_cache(seed):
+            rng = random.Random(seed)
+            for _ in range(20000):
+                key = rng.randrange(4)
+                if cache.get(key) is None:
+                    cache.put(key, (0, 1.))
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            with concurrent.futures.ThreadPoolExecutor(4) as executor:
+                list(executor.map(use_cache, range(4)))
+        finally:
+            sys.setswitchinterval(switch_interval)
+        self.assertEqual(cache.hits + cache.misses, 80000)
+        self.assertEqual(len(cache.entries), 2)
+
+
+TestMoveScoreCache().test_lru()
+TestMoveScoreCache().test_get_key()
+TestMoveScoreCache().test_evaluate()
+TestMoveScoreCache().test_threads()
+
+
+class TestMCTSPlayer(unittest.TestCase):
+
+    def test_simulation_state(self):
+        # A simulated game follows the rules of Game
+        game = Game(Player(), Player(), seed=5)
+        position = get_search_position(game.players[0], game.game_state)
+        state = determinize(position, random.Random(0))
+        state.hands[1] = [card.index for card in game.players[1].hand]
+        state.deck = [card.index for card in game.game_state.deck_cards()]
+        winner = None
+        while winner is None:
+            for player_index in range(2):
+                slot_index, card = game.players[player_index].make_move(game.game_state)
+                sim_winner = state.play(slot_index, card.index)
+                game.player_turn(player_index)
+            winner = game.game_winner()
+            self.assertEqual(sim_winner, winner)
+        self.assertEqual(sorted(state.hands[0]), sorted(card.index for card in game.players[0].hand))
+
+    def test_determinize(self):
+        game, player = get_position(POSITIONS["mid"])
+        position = get_search_position(player, game.game_state)
+        state = determinize(position, random.Random(1))
+        opp_hand = state.hands[player.opponent_index]
+        self.assertEqual(len(opp_hand), len(game.players[player.opponent_index].hand))
+        self.assertEqual(len(state.deck), game.game_state.deck_size)
+        seen_mask = game.game_state.played_cards.mask | player.hand.mask
+        unseen_mask = cards_to_mask(CARDS_BY_INDEX[i] for i in opp_hand + state.deck)
+        self.assertEqual(unseen_mask & seen_mask, 0)
+        self.assertEqual(unseen_mask | seen_mask, ALL_CARDS_MASK)
+
+    def test_make_move(self):
+        game, player = get_position(POSITIONS["early"])
+        root_stats = search(get_search_position(player, game.game_state), n_iterations=200, seed=0)
+        self.assertEqual(sum(visits for visits, wins in root_stats.values()), 200)
+        mcts_player = MCTSPlayer(player.index, n_iterations=50, time_budget=None, seed=0)
+        mcts_player.hand = player.hand
+        slot_index, card = mcts_player.make_move(game.game_state)
+        self.assertIn(card, player.hand)
+        self.assertLess(len(game.game_state.slots[player.index][slot_index]), 3)
+        with self.assertRaises(ValueError):
+            MCTSPlayer(n_iterations=None, time_budget=None)
+
+    def test_workers(self):
+        game, player = get_position(POSITIONS["early"])
+        with MCTSPlayer(player.index, n_iterations=20, time_budget=None, n_workers=2, seed=0) as mcts_player:
+            mcts_player.hand = player.hand
+            mcts_player.make_move(game.game_state)
+            own_pool = mcts_player._own_pool
+            self.assertIsNotNone(own_pool)
+            self.assertEqual(sum(visits for visits, wins in mcts_player.last_root_stats.values()), 40)
+        self.assertIsNone(mcts_player._own_pool)
+        with self.assertRaises(ValueError):
+            own_pool.map(abs, [1])
+        # A pool given by the caller is used and left open
+        with multiprocessing.Pool(2) as pool:
+            with MCTSPlayer(player.index, n_iterations=20, time_budget=None, n_workers=2, seed=0,
+                            pool=pool) as mcts_player:
+                mcts_player.hand = player.hand
+                mcts_player.make_move(game.game_state)
+                self.assertIsNone(mcts_player._own_pool)
+            self.assertEqual(pool.map(abs, [-1]), [1])
+
+
+TestMCTSPlayer().test_simulation_state()
+TestMCTSPlayer().test_determinize()
+TestMCTSPlayer().test_make_move()
+TestMCTSPlayer().test_workers()
+
+
+class TestSlotOutcomes(unittest.TestCase):
+
+    def test_get_decided_slot_winner(self):
+        table = get_combination_table()
+        color_suite = Slot([Card("red", 4), Card("red", 5), Card("red", 6)])
+        weak = Slot([Card("blue", 1), Card("green", 2)])
+        played_mask = cards_to_mask(color_suite) | cards_to_mask(weak)
+        rank = table.rank_list[table.id_by_mask[color_suite.mask]]
+        self.assertEqual(completion_rank_range(color_suite, played_mask), (rank, rank))
+        self.assertLess(completion_rank_range(weak, played_mask)[1], rank)
+        self.assertEqual(get_decided_slot_winner(color_suite, weak, played_mask, 0), 0)
+        self.assertEqual(get_decided_slot_winner(weak, color_suite, played_mask, 1), 1)
+        self.assertIsNone(get_decided_slot_winner(Slot(), color_suite, played_mask, 1))
+        self.assertIsNone(get_decided_slot_winner(Slot(), Slot(), played_mask))
+        self.assertEqual(get_decided_slots([color_suite] + [Slot()] * 8, [weak] + [Slot()] * 8, played_mask), [0])
+
+    def test_claims(self):
+        # Claims made during a game agree with the slots winners at the end
+        game = Game(Player(), Player(), seed=11)
+        claims = {}
+        turn = 0
+        while any(len(slot) < 3 for slots in game.game_state.slots for slot in slots):
+            game.player_turn(turn % 2)
+            turn += 1
+            gs = game.game_state
+            for i in range(9):
+                slot_winner = get_decided_slot_winner(gs.slots[0][i], gs.slots[1][i], gs.played_cards.mask,
+                                                      game.first_to_finish_slot[i])
+                if slot_winner is not None:
+                    claims.setdefault(i, slot_winner)
+        self.assertGreater(len(claims), 0)
+        for slot_index, slot_winner in claims.items():
+            self.assertEqual(game.slot_winners()[slot_index], slot_winner)
+
+    def test_early_claims(self):
+        game = Game(Player(), Player(), seed=11)
+        early_game = Game(Player(), Player(skip_decided_slots=True), seed=11, early_claims=True)
+        self.assertEqual(early_game.run(), game.run())
+        self.assertLessEqual(early_game.n_turns, game.n_turns)
+
+
+TestSlotOutcomes().test_get_decided_slot_winner()
+TestSlotOutcomes().test_claims()
+TestSlotOutcomes().test_early_claims()
+
+
+class TestSelfPlay(unittest.TestCase):
+
+    def test_run(self):
+        runner = SelfPlayRunner(n_workers=1, base_seed=1)
+        results = runner.run(2)
+        self.assertEqual([result.game_index for result in results], [0, 1])
+        self.assertNotEqual(results[0].seed, results[1].seed)
+        for result in results:
+            self.assertIn(result.winner, (0, 1))
+            self.assertEqual(len(result.slot_winners), 9)
+            self.assertGreaterEqual(result.slot_winners.count(result.winner), 5)
+            self.assertGreater(result.n_turns, 0)
+
+        # Same seeds, same games
+        self.assertEqual(play_game((Player, Player), results[1].seed, 1), results[1])
+
+        summary = summarize(results)
+        self.assertEqual(summary["n_games"], 2)
+        self.assertEqual(sum(summary["n_wins"]), 2)
+
+    def test_batch(self):
+        # Games played in lockstep are the games played one by one
+        player_specs = (Player, (Player, {"skip_decided_slots": True}))
+        runner = SelfPlayRunner(player_specs, n_workers=1, base_seed=2, early_claims=True, record=True)
+        results = runner.run(5)
+        runner.batch_size = 2
+        self.assertEqual(runner.run(5), results)
+        self.assertEqual(play_games_batch(player_specs, [result.seed for result in results[1:3]], 1, True, True),
+                         results[1:3])
+        self.assertRaises(ValueError, SelfPlayRunner, profile=True, batch_size=2)
+
+
+TestSelfPlay().test_run()
+TestSelfPlay().test_batch()
+
+
+class TestGameObservers(unittest.TestCase):
+
+    class EventRecorder(GameObserver):
+        def __init__(self):
+            self.events = []
+
+        def on_game_start(self, game):
+            self.events.append(("start",))
+
+        def on_move_played(self, game, player_index, slot_index, card):
+            self.events.append(("move", player_index, slot_index, card))
+
+        def on_slot_completed(self, game, player_index, slot_index):
+            self.events.append(("slot", player_index, slot_index))
+
+        def on_card_drawn(self, game, player_index, card):
+            self.events.append(("draw", player_index, card))
+
+        def on_game_over(self, game, winner):
+            self.events.append(("over", winner))
+
+    def test_events(self):
+        game = Game(Player(), Player(), seed=3)
+        recorder = TestGameObservers.EventRecorder()
+        game.add_observer(recorder)
+        # Observers do not need to implement every event
+        game.add_observer(GameObserver())
+        winner = game.run()
+
+        events = recorder.events
+        self.assertEqual(events[0], ("start",))
+        self.assertEqual(events[-1], ("over", winner))
+        moves = [event for event in events if event[0] == "move"]
+        self.assertEqual(len(moves), game.n_turns)
+        self.assertEqual(len(game.game_state.played_cards), game.n_turns)
+        self.assertEqual([move[1] for move in moves[:4]], [0, 1, 0, 1])
+        draws = [event for event in events if event[0] == "draw"]
+        self.assertEqual(len(draws), min(game.n_turns, 54 - 12))
+        n_full_slots = sum(len(slot) == 3 for slots in game.game_state.slots for slot in slots)
+        self.assertEqual(len([event for event in events if event[0] == "slot"]), n_full_slots)
+
+
+TestGameObservers().test_events()
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_run_benchmarks(self):
+        results = run_benchmarks(repeat=1, min_time=0.001, name_filter="CardCombination")
+        self.assertEqual([(r["position"], r["name"]) for r in results["results"]],
+                         [(position, "CardCombination") for position in POSITIONS])
+        for result in results["results"]:
+            self.assertGreater(result["best"], 0)
+            self.assertLessEqual(result["best"], result["mean"])
+        self.assertEqual(len(compare(results, results).splitlines()), len(POSITIONS))
+
+    def test_get_position(self):
+        game, player = get_position(POSITIONS["mid"])
+        self.assertEqual(len(game.game_state.played_cards), POSITIONS["mid"])
+        self.assertEqual(player.index, 0)
+
+    def test_make_move_uncached(self):
+        game, player = get_position(POSITIONS["early"])
+        benchmarks = get_benchmarks(game, player)
+        hits = default_move_score_cache.hits
+        self.assertEqual(benchmarks["make_move"](), benchmarks["make_move"]())
+        self.assertEqual(default_move_score_cache.hits, hits)
+        self.assertEqual(benchmarks["make_move_cached"](), benchmarks["make_move"]())
+
+
+TestBenchmarks().test_run_benchmarks()
+TestBenchmarks().test_get_position()
+TestBenchmarks().test_make_move_uncached()
+
+
+class TestIncrementalProbaEngine(unittest.TestCase):
+
+    def test_combination_probas_from_slot(self):
+        game = Game(Player(), Player(), seed=2)
+        player = game.players[1]
+        engine = IncrementalProbaEngine(player, game.game_state)
+        game.add_observer(engine)
+
+        for turn in range(40):
+            game.player_turn(turn % 2)
+            if turn % 13 != 0 and turn < 36:
+                continue
+            for slot_index in range(9):
+                for for_opponent in (False, True):
+                    self.assertEqual(engine.combination_probas_from_slot(slot_index, for_opponent),
+                                     ProbaEngine.combination_probas_from_slot(player, game.game_state,
+                                                                              slot_index, for_opponent))
+
+
+TestIncrementalProbaEngine().test_combination_probas_from_slot()
+
+
+class TestComputeProbasForSlot(unittest.TestCase):
+
+    @staticmethod
+    def reference_probas(player, allowed_combs, slot_index, game_state, for_opponent=False):
+        # The card by card computation the masks replaced
+        my_slots = game_state.slots[player.index]
+        op_slots = game_state.slots[player.opponent_index]
+        slot = op_slots[slot_index] if for_opponent else my_slots[slot_index]
+        other_slots_cards = set()
+        for i in range(9):
+            if for_opponent or i != slot_index:
+                other_slots_cards |= set(my_slots[i])
+            if not for_opponent or i != slot_index:
+                other_slots_cards |= set(op_slots[i])
+        if for_opponent:
+            card_proba = ProbaEngine.deck_or_hand_proba(game_state.deck_size)
+        else:
+            card_proba = ProbaEngine.deck_proba(game_state.deck_size)
+        comb_probas = {}
+        for comb in allowed_combs:
+            proba = 1
+            for card in comb:
+                if card in other_slots_cards or (for_opponent and card in player.hand):
+                    proba = 0
+                    break
+                if card not in slot and (for_opponent or card not in player.hand):
+                    proba *= card_proba
+            if proba != 0:
+                comb_probas[comb] = proba
+        return comb_probas
+
+    def test_reference(self):
+        # Same probabilities, bit for bit, on positions of a game
+        all_combs = CardCombinationsGenerator().get_all_combinations()
+        game = Game(Player(), Player(), seed=6)
+        player = game.players[0]
+        for turn in range(34):
+            game.player_turn(turn % 2)
+            if turn not in (4, 33):
+                continue
+            for slot_index in range(9):
+                for for_opponent in (False, True):
+                    self.assertEqual(ProbaEngine._compute_probas_for_slot(player, all_combs, slot_index,
+                                                                          game.game_state, for_opponent),
+                                     self.reference_probas(player, all_combs, slot_index, game.game_state,
+                                                           for_opponent))
+
+
+TestComputeProbasForSlot().test_reference()
+
+
+class TestGameServer(unittest.TestCase):
+
+    @staticmethod
+    async def open_client(server):
+        if isinstance(server.get_address(), str):
+            reader, writer = await asyncio.open_unix_connection(server.get_address())
+        else:
+            reader, writer = await asyncio.open_connection(*server.get_address()[:2])
+
+        async def send(message):
+            writer.write((json.dumps(message) + "\n").encode())
+            await writer.drain()
+
+        async def receive():
+            return json.loads(await reader.readline())
+        return send, receive, writer
+
+    @staticmethod
+    async def play(send, receive, n_games, messages=None):
+        # Plays the lowest card on the first slot which is not full until
+        # n_games are over
+        game_overs = {}
+        while len(game_overs) < n_games:
+            message = await receive()
+            if messages is not None:
+                messages.append(message)
+            if message["type"] == "state" and message["to_move"]:
+                slot_index = min(i for i, slot in enumerate(message["slots"][message["seat"]]) if len(slot) < 3)
+                await send({"type": "move", "game_id": message["game_id"], "slot": slot_index,
+                            "card": min(message["hand"])})
+            elif message["type"] == "game_over":
+                game_overs[message["game_id"]] = message
+        return game_overs
+
+    async def run_bot_games(self, path=None):
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            server = GameServer({"player": Player}, executor=executor)
+            await server.start(path=path)
+            send, receive, writer = await self.open_client(server)
+            await send({"type": "bots"})
+            self.assertEqual(await receive(), {"type": "bots", "bots": ["player"]})
+            for seat_index in range(2):
+                await send({"type": "new_game", "opponent": "player", "seat": seat_index, "seed": 7})
+            messages = []
+            game_overs = await self.play(send, receive, 2, messages)
+            created = [message for message in messages if message["type"] == "game_created"]
+            self.assertEqual([message["seat"] for message in created], [0, 1])
+            self.assertFalse(any(message["type"] == "error" for message in messages))
+            for game_over in game_overs.values():
+                self.assertIn(game_over["winner"], (0, 1))
+                n_moves = sum(message["type"] == "move_played" and message["game_id"] == game_over["game_id"]
+                              for message in messages)
+                self.assertEqual(n_moves, game_over["n_turns"])
+            self.assertEqual(server.games, {})
+            writer.close()
+            await server.close()
+
+    async def run_human_games(self):
+        with concurrent.futures.ThreadPoolExecutor(1) as executor:
+            server = GameServer(executor=executor)
+            await server.start()
+            send0, receive0, writer0 = await self.open_client(server)
+            send1, receive1, writer1 = await self.open_client(server)
+            await send0({"type": "new_game", "opponent": "human", "seat": 1, "seed": 3})
+            created = await receive0()
+            self.assertEqual(created["seat"], 1)
+            await send1({"type": "join", "game_id": created["game_id"]})
+            self.assertEqual((await receive1())["seat"], 0)
+            state = await receive1()
+            self.assertEqual((state["type"], len(state["hand"]), state["deck_size"]), ("state", 6, 42))
+            self.assertFalse((await receive0())["to_move"])
+
+            # Errors leave the game as it was
+            await send0({"type": "move", "game_id": created["game_id"], "slot": 0, "card": 0})
+            self.assertIn("not your turn", (await receive0())["message"])
+            self.assertTrue((await receive1())["to_move"])
+            card_index = next(i for i in range(54) if i not in state["hand"])
+            await send1({"type": "move", "game_id": created["game_id"], "slot": 0, "card": card_index})
+            self.assertIn("not in the hand", (await receive1())["message"])
+            await send1({"type": "join", "game_id": created["game_id"]})
+            self.assertEqual((await receive1())["type"], "error")
+            await send1({"type": "state", "game_id": created["game_id"]})
+
+            results = await asyncio.gather(self.play(send0, receive0, 1), self.play(send1, receive1, 1))
+            self.assertEqual(results[0], results[1])
+
+            # A client leaving abandons its games
+            await send0({"type": "new_game", "opponent": "human"})
+            game_id = (await receive0())["game_id"]
+            await send1({"type": "join", "game_id": game_id})
+            await receive1()
+            writer0.close()
+            while True:
+                message = await receive1()
+                if message["type"] == "game_over":
+                    break
+            self.assertEqual((message["game_id"], message["winner"], message["abandoned"]), (game_id, None, True))
+            writer1.close()
+            await server.close()
+
+    async def run_pending_move(self):
+        with concurrent.futures.ThreadPoolExecutor(1) as executor:
+            server = GameServer(executor=executor)
+            await server.start()
+            send, receive, writer = await self.open_client(server)
+            await send({"type": "new_game", "opponent": "player", "seed": 5})
+            game_id = (await receive())["game_id"]
+            self.assertFalse((await receive())["to_move"])
+            hand = sorted((await receive())["hand"])
+            # Two moves sent in one turn: the second one is rejected, not
+            # played on the next turn
+            for slot_index in range(2):
+                writer.write((json.dumps({"type": "move", "game_id": game_id, "slot": slot_index,
+                                          "card": hand[slot_index]}) + "\n").encode())
+            await writer.drain()
+            messages = []
+            while not messages or not (messages[-1]["type"] == "state" and messages[-1]["to_move"]):
+                messages.append(await receive())
+            self.assertEqual(sum(message["type"] == "error" for message in messages), 1)
+            self.assertEqual([(message["player_index"], message["slot"], message["card"]) for message in messages
+                              if message["type"] == "move_played"][0], (0, 0, hand[0]))
+            self.assertEqual(sum(message["type"] == "move_played" for message in messages), 2)
+            self.assertIn(hand[1], messages[-1]["hand"])
+            await send({"type": "state", "game_id": game_id})
+            self.assertEqual(await receive(), messages[-1])
+            writer.close()
+            await server.close()
+
+    def test_bot_games(self):
+        asyncio.run(self.run_bot_games())
+        asyncio.run(self.run_bot_games(os.path.join(tempfile.mkdtemp(), "server.sock")))
+
+    def test_human_games(self):
+        asyncio.run(self.run_human_games())
+
+    def test_pending_move(self):
+        asyncio.run(self.run_pending_move())
+
+    def test_bot_players(self):
+        # Bots are built once per worker thread, spec and index
+        spec = (Player, {"skip_decided_slots": True})
+        player = get_bot_player(spec, 1)
+        self.assertEqual(player.index, 1)
+        self.assertTrue(player.skip_decided_slots)
+        self.assertIs(get_bot_player((Player, {"skip_decided_slots": True}), 1), player)
+        self.assertIsNot(get_bot_player(spec, 0), player)
+        self.assertIsNot(get_bot_player((Player, {}), 1), player)
+        with concurrent.futures.ThreadPoolExecutor(1) as executor:
+            self.assertIsNot(executor.submit(get_bot_player, spec, 1).result(), player)
+
+
+TestGameServer().test_bot_games()
+TestGameServer().test_human_games()
+TestGameServer().test_pending_move()
+TestGameServer().test_bot_players()
+
+
+class TestGameStateClone(unittest.TestCase):
+
+    def test_clone(self):
+        gs = GameState(ALL_CARDS)
+        gs.add_to_slot(0, 3, gs.draw_deck())
+        snapshot = gs.snapshot()
+        clone = gs.clone()
+        clone.add_to_slot(1, 3, clone.draw_deck())
+        self.assertEqual(gs.deck_size, 53)
+        self.assertEqual(len(gs.played_cards), 1)
+        self.assertEqual(len(gs.slots[1][3]), 0)
+        self.assertEqual(clone.deck_size, 52)
+        self.assertEqual(clone.deck_cards(), tuple(ALL_CARDS)[:52])
+        self.assertEqual(clone.slots[0][3], gs.slots[0][3])
+
+        card = gs.draw_deck()
+        gs.add_to_slot(0, 3, card)
+        gs.restore(snapshot)
+        self.assertEqual(gs.snapshot(), snapshot)
+        self.assertEqual(len(gs.slots[0][3]), 1)
+        self.assertEqual(gs.draw_deck(), card)
+        self.assertEqual(GameState.from_snapshot(snapshot).snapshot(), snapshot)
+
+        gs = GameState()
+        self.assertRaises(IndexError, gs.draw_deck)
+        with self.assertRaises(AttributeError):
+            gs.hand = CardSet()
+
+
+TestGameStateClone().test_clone()
+
+
+class TestUndoMove(unittest.TestCase):
+
+    @staticmethod
+    def get_game_position(game):
+        return (game.game_state.snapshot(), game.players[0].hand.mask, game.players[1].hand.mask,
+                tuple(game.first_to_finish_slot), tuple(game.claimed_slot_winners), game.n_turns)
+
+    def test_game_state(self):
+        gs = GameState(CARDS_BY_INDEX[:3])
+        snapshot = gs.snapshot()
+        undo = gs.apply_move(1, 4, CARDS_BY_INDEX[10])
+        self.assertEqual(undo.drawn_card, CARDS_BY_INDEX[2])
+        gs.undo_move(undo)
+        self.assertEqual(gs.snapshot(), snapshot)
+        self.assertRaises(ValueError, gs.remove_from_slot, 1, 4, CARDS_BY_INDEX[10])
+        self.assertRaises(ValueError, gs.undraw_deck, CARDS_BY_INDEX[2])
+
+    def test_game(self):
+        # Moves undone in reverse order give back every position of the game
+        game = Game(Player(), Player(skip_decided_slots=True), seed=8, early_claims=True)
+        positions = []
+        undos = []
+        while game.game_winner() is None:
+            for player_index in range(2):
+                positions.append(self.get_game_position(game))
+                undos.append(game.player_turn(player_index))
+        winner = game.game_winner()
+        final_position = self.get_game_position(game)
+        moves = [(undo.state_undo.player_index, undo.state_undo.slot_index, undo.state_undo.card)
+                 for undo in undos]
+        while undos:
+            game.undo_move(undos.pop())
+            self.assertEqual(self.get_game_position(game), positions[-1])
+            # Checking the winners does not change the game
+            game.slot_winners()
+            self.assertEqual(self.get_game_position(game), positions.pop())
+
+        # And replaying the moves gives back the end of the game, slots being
+        # claimed by the moves whether or not the winner is checked
+        for move in moves:
+            game.apply_move(*move)
+        self.assertEqual(game.game_winner(), winner)
+        self.assertEqual(self.get_game_position(game), final_position)
+
+    def test_apply_move_errors(self):
+        game = Game(Player(), Player(), seed=8)
+        position = self.get_game_position(game)
+        card = min(game.players[1].hand)
+        self.assertRaises(ValueError, game.apply_move, 0, 0, card)
+        self.assertEqual(self.get_game_position(game), position)
+
+
+TestUndoMove().test_game_state()
+TestUndoMove().test_game()
+TestUndoMove().test_apply_move_errors()
+
+
+class TestZobrist(unittest.TestCase):
+
+    def test_incremental_key(self):
+        game = Game(Player(), Player(), seed=4)
+        gs = game.game_state
+        keys = {gs.key}
+        undos = []
+        for turn in range(20):
+            undos.append(game.player_turn(turn % 2))
+            self.assertEqual(gs.key, slots_key(gs.slots))
+            keys.add(gs.key)
+        self.assertEqual(len(keys), 21)
+        self.assertEqual(gs.clone().key, gs.key)
+        for undo in reversed(undos):
+            game.undo_move(undo)
+        self.assertEqual(gs.key, 0)
+
+    def test_position_key(self):
+        # Transpositions give the same key
+        cards = CARDS_BY_INDEX[:4]
+        gs1 = GameState()
+        gs2 = GameState()
+        for player_index, slot_index, card in [(0, 1, cards[0]), (1, 1, cards[1]), (0, 2, cards[2])]:
+            gs1.add_to_slot(player_index, slot_index, card)
+        for player_index, slot_index, card in [(0, 2, cards[2]), (0, 1, cards[0]), (1, 1, cards[1])]:
+            gs2.add_to_slot(player_index, slot_index, card)
+        self.assertEqual(gs1.position_key(1), gs2.position_key(1))
+        self.assertNotEqual(gs1.position_key(0), gs1.position_key(1))
+        hand = CardSet(CARDS_BY_INDEX[10:16])
+        self.assertEqual(gs1.position_key(1, hand), gs2.position_key(1, list(hand)))
+        self.assertNotEqual(gs1.position_key(1, hand), gs1.position_key(1))
+        gs2.add_to_slot(1, 2, cards[3])
+        self.assertNotEqual(gs1.position_key(1), gs2.position_key(1))
+
+
+TestZobrist().test_incremental_key()
+TestZobrist().test_position_key()
+
+
+class TestAnytimePlayer(unittest.TestCase):
+
+    def test_make_move(self):
+        for n_played in POSITIONS.values():
+            game, player = get_position(n_played)
+            move = player.make_move(game.game_state)
+            self.assertTrue(player.last_move_finished)
+            timed_player = Player(player.index, time_budget=60.)
+            timed_player.hand = player.hand
+            self.assertEqual(timed_player.make_move(game.game_state), move)
+            self.assertTrue(timed_player.last_move_finished)
+
+    def test_deadline(self):
+        game, player = get_position(POSITIONS["mid"])
+        my_slots = game.game_state.slots[player.index]
+        all_scores = player.get_moves_scores(game.game_state)
+        # Past the deadline, the moves of one of the slots with the most
+        # cards are still scored
+        slot_index, card = player.make_move(game.game_state, deadline=0.)
+        self.assertFalse(player.last_move_finished)
+        self.assertIn(card, player.hand)
+        self.assertEqual(len(my_slots[slot_index]), max(len(my_slots[i]) for i, _ in all_scores))
+
+        # With a small budget, the best of the moves scored in time is played
+        timed_player = Player(player.index, time_budget=0.0005)
+        timed_player.hand = player.hand
+        scored = {}
+        get_moves_scores = timed_player.get_moves_scores
+
+        def get_scored_moves(*args):
+            moves_scores = get_moves_scores(*args)
+            scored.update(moves_scores)
+            return moves_scores
+        timed_player.get_moves_scores = get_scored_moves
+        move = timed_player.make_move(game.game_state)
+        self.assertIn(move, scored)
+        self.assertEqual(move, Player.choose_move(scored))
+        self.assertEqual(timed_player.last_move_finished, len(scored) == len(all_scores))
+        for scored_move, scores in scored.items():
+            self.assertEqual(scores, all_scores[scored_move])
+
+
+TestAnytimePlayer().test_make_move()
+TestAnytimePlayer().test_deadline()
+
+
+class TestProfiling(unittest.TestCase):
+
+    def test_self_play(self):
+        self.assertIsNone(profiling.active_profiler)
+        player_spec = (Player, {"move_score_cache": MoveScoreCache()})
+        result = play_game((player_spec, player_spec), seed=6, profile=True)
+        self.assertIsNone(profiling.active_profiler)
+        profile = json.loads(json.dumps(result.profile))
+        self.assertEqual(profile["n_moves"], result.n_turns)
+        self.assertEqual(len(profile["moves"]), result.n_turns)
+        for phase in ["move", "ranking", "counter_scoring", "combination_generation"]:
+            self.assertGreater(profile["times"][phase][1], 0)
+        counters = profile["counters"]
+        self.assertEqual(counters["moves_evaluated"], counters["move_score_cache_misses"])
+        self.assertTrue(0 <= counters["move_score_cache_hit_rate"] <= 1)
+        self.assertEqual(sum(move["times"]["move"][1] for move in profile["moves"]), profile["times"]["move"][1])
+
+        summary = summarize([result, result._replace(profile=None), result])
+        self.assertEqual(summary["profile"]["n_moves"], 2 * result.n_turns)
+        self.assertNotIn("moves", summary["profile"])
+        self.assertNotIn("profile", summarize([play_game((Player, Player), seed=6)]))
+
+    def test_proba_engine(self):
+        game, player = get_position(POSITIONS["mid"])
+        profiler = profiling.enable(profiling.Profiler(keep_moves=False))
+        try:
+            probas = ProbaEngine.combination_probas_from_slot(player, game.game_state, 0, True)
+        finally:
+            self.assertIs(profiling.disable(), profiler)
+        stats = profiler.to_dict()
+        self.assertEqual(stats["counters"]["proba_combinations_possible"], len(probas))
+        self.assertEqual(stats["times"]["proba_computation"][0], 1)
+
+
+TestProfiling().test_self_play()
+TestProfiling().test_proba_engine()
+
+
+class TestGameRecords(unittest.TestCase):
+
+    def test_encode_move(self):
+        codes = set()
+        for move in itertools.product(range(2), range(9), range(54)):
+            code = encode_move(*move)
+            self.assertEqual(decode_move(code), move)
+            codes.add(code)
+        self.assertEqual(codes, set(range(2 * 9 * 54)))
+
+    def test_record(self):
+        # The game can be played again from its record
+        result = play_game((Player, Player), seed=9, record=True)
+        record = result.record
+        self.assertEqual(record["seed"], 9)
+        self.assertEqual((record["winner"], record["n_turns"], record["slot_winners"]),
+                         (result.winner, result.n_turns, result.slot_winners))
+        game = Game(HumanPlayer(), HumanPlayer(), seed=9)
+        self.assertEqual([[card.index for card in player.hand] for player in game.players], record["hands"])
+        self.assertEqual([card.index for card in game.game_state.deck_cards()], record["deck"])
+        for player_index, slot_index, card_index in get_moves(record):
+            game.apply_move(player_index, slot_index, CARDS_BY_INDEX[card_index])
+        self.assertEqual(game.game_winner(), record["winner"])
+        self.assertEqual(game.n_turns, record["n_turns"])
+
+    def test_writer_reader(self):
+        records = [play_game((Player, Player), seed, record=True).record for seed in range(3)]
+        with tempfile.TemporaryDirectory() as directory:
+            for file_name in ["games.jsonl", "games.jsonl.gz"]:
+                path = os.path.join(directory, file_name)
+                with GameRecordWriter(path) as writer:
+                    writer.write(records[0])
+                # Files are appended to
+                with GameRecordWriter(path) as writer:
+                    for record in records[1:]:
+                        writer.write(record)
+                self.assertEqual(list(read_game_records(path)), records)
+
+
+TestGameRecords().test_encode_move()
+TestGameRecords().test_record()
+TestGameRecords().test_writer_reader()
+
+
+class TestReplay(unittest.TestCase):
+
+    def test_iter_positions(self):
+        game = Game(Player(), Player(), seed=10)
+        recorder = GameRecorder()
+        game.add_observer(recorder)
+        game.run()
+        record = recorder.record
+        # Positions of the record are the ones of the game
+        game = Game(HumanPlayer(), HumanPlayer(), seed=10)
+        for ply, player_index, game_state, hand, move in iter_positions(record):
+            self.assertEqual(game_state.snapshot(), game.game_state.snapshot())
+            self.assertEqual(hand, game.players[player_index].hand)
+            game.apply_move(player_index, *move)
+        self.assertEqual(ply + 1, record["n_turns"])
+
+    def test_replay(self):
+        records = [play_game((Player, Player), seed, record=True).record for seed in range(2)]
+        results = list(ReplayEngine(Player, n_workers=1).iter_results(records))
+        self.assertEqual(results, replay_record(records[0], Player, game_index=0) +
+                         replay_record(records[1], Player, game_index=1))
+        self.assertEqual(summarize_replay(results)["agreement"], 1)
+        # Records replayed in lockstep give the same results as one by one
+        results = list(ReplayEngine(Player, "moves_scores", n_workers=1, batch_size=None).iter_results(records))
+        self.assertEqual(replay_records_batch(records, Player, "moves_scores"), results)
+
+        results = replay_record(records[0], (Player, {}), "moves_scores")
+        self.assertTrue(all(result["agree"] for result in results))
+        for result in results:
+            self.assertIn(result["move"], [scores[:2] for scores in result["scores"]])
+        self.assertRaises(ValueError, replay_record, records[0], Player, "unknown")
+
+
+TestReplay().test_iter_positions()
+TestReplay().test_replay()
+
+
+class TestTournament(unittest.TestCase):
+
+    def test_match_stats(self):
+        for elo in [-300, -20, 0, 45, 250]:
+            self.assertAlmostEqual(elo_from_score(expected_score(elo)), elo)
+        stats = MatchStats()
+        self.assertEqual(stats.llr(0, 20), 0)
+        for pair_score in [1, 0.5, 1, 0, 1, 0.5, 1, 1]:
+            stats.add(pair_score)
+        self.assertEqual(stats.score, 0.75)
+        low, high = stats.elo_interval()
+        self.assertTrue(low < stats.elo() < high)
+        # Winning more is evidence for H1
+        self.assertGreater(stats.llr(0, 20), 0)
+        self.assertLess(stats.llr(300, 320), 0)
+
+    def test_sprt(self):
+        sprt = SPRT(0, 20)
+        stats = MatchStats()
+        for pair_score in [1, 0.5] * 200:
+            stats.add(pair_score)
+        self.assertEqual(sprt.decide(stats), "H1")
+        stats = MatchStats()
+        for pair_score in [0, 0.5] * 200:
+            stats.add(pair_score)
+        self.assertEqual(sprt.decide(stats), "H0")
+        stats = MatchStats()
+        for pair_score in [1, 0] * 3:
+            stats.add(pair_score)
+        self.assertIsNone(sprt.decide(stats))
+
+    def test_run(self):
+        # A player with no time to think, which only scores the moves of one
+        # slot, loses quickly
+        entrants = {"player": Player, "weak": (Player, {"time_budget": 0.})}
+        tournament = Tournament(entrants, max_pairs=100, sprt=SPRT(0, 50), n_workers=1, round_pairs=4)
+        summary = tournament.run()
+        match, = summary["matches"]
+        self.assertEqual(match["decision"], "H1")
+        self.assertLess(match["n_pairs"], 100)
+        self.assertEqual(match["n_pairs"] % 4, 0)
+        self.assertAlmostEqual(summary["scores"]["player"] + summary["scores"]["weak"], 1)
+
+        # Without SPRT, max_pairs pairs are played
+        tournament = Tournament(entrants, max_pairs=2, n_workers=1)
+        self.assertEqual(tournament.run()["matches"][0]["n_pairs"], 2)
+        self.assertRaises(ValueError, Tournament, {"player": Player})
+
+    def test_load_entrants(self):
+        entrants_config = {"player": {"class": "game.Player"},
+                           "tuned": {"class": "game.Player", "kwargs": {"skip_decided_slots": True},
+                                     "category_factors": [1, 2, 3, 6, 10]}}
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "entrants.json")
+            with open(path, "w") as f:
+                json.dump(entrants_config, f)
+            entrants = load_entrants(path)
+        self.assertEqual(entrants["player"], (Player, {}))
+        player = make_player(entrants["tuned"], 1)
+        self.assertTrue(player.skip_decided_slots)
+        self.assertEqual(player.move_evaluator.scoring_scheme.category_factors, (1, 2, 3, 6, 10))
+        # Entrants are sent to worker processes
+        self.assertEqual(pickle.loads(pickle.dumps(entrants["tuned"]))[1]["scoring_scheme"].category_factors,
+                         (1, 2, 3, 6, 10))
+
+
+TestTournament().test_match_stats()
+TestTournament().test_sprt()
+TestTournament().test_run()
+TestTournament().test_load_entrants()
+
+
+class TestTuning(unittest.TestCase):
+
+    def test_sample_factors(self):
+        rng = random.Random(0)
+        for _ in range(100):
+            factors = sample_factors(rng, max_ratio=3.)
+            ScoringScheme(factors)
+            self.assertEqual(factors[0], 1)
+            self.assertTrue(all(1 <= factors[i + 1] / factors[i] <= 3.001 for i in range(4)))
+        self.assertRaises(ValueError, FactorSearch, candidates=[(1, 2, 1, 3, 4)])
+
+    def test_scoring_scheme(self):
+        scheme = ScoringScheme((1, 2, 3, 6, 10))
+        self.assertEqual(list(pickle.loads(pickle.dumps(scheme)).scores), list(scheme.scores))
+        game, player = get_position(POSITIONS["mid"])
+        gs = game.game_state
+        args = (player.hand, gs.slots[player.index], gs.slots[player.opponent_index], gs.played_cards.mask)
+        cache = MoveScoreCache()
+        moves_scores = MoveEvaluator(cache).evaluate(*args)
+        weighted_scores = MoveEvaluator(cache, scheme).evaluate(*args)
+        self.assertEqual(cache.hits, 0)
+        self.assertEqual(list(weighted_scores), list(moves_scores))
+        for move, (n_zero_counter, score) in weighted_scores.items():
+            self.assertEqual(n_zero_counter, moves_scores[move][0])
+            self.assertGreaterEqual(score, moves_scores[move][1])
+
+    def test_search(self):
+        candidates = [(1, 1, 1, 1, 1), (1, 2, 3, 6, 10), (1, 1.5, 2, 2.5, 3), (1, 2, 4, 8, 16)]
+        kwargs = dict(method="halving", min_pairs=1, eta=2, n_workers=1, candidates=candidates)
+        summary = FactorSearch(**kwargs).run()
+        self.assertEqual(summary["rung"], 2)
+        self.assertEqual(sorted(candidate["n_pairs"] for candidate in summary["candidates"]), [1, 1, 2, 2])
+        self.assertEqual(summary["best"], summary["candidates"][0]["factors"])
+
+        # Search interrupted after its first checkpoint, then resumed
+        checkpoint_path = os.path.join(tempfile.mkdtemp(), "search.json")
+        search = FactorSearch(checkpoint_path=checkpoint_path, checkpoint_every=1, **kwargs)
+        search._play(search._rung_tasks()[:1], None)
+        resumed_search = FactorSearch(checkpoint_path=checkpoint_path, **kwargs)
+        self.assertEqual(resumed_search.pair_scores, search.pair_scores)
+        self.assertEqual(resumed_search.run(), summary)
+        self.assertTrue(FactorSearch(checkpoint_path=checkpoint_path, **kwargs).done)
+        kwargs["min_pairs"] = 2
+        self.assertRaises(ValueError, FactorSearch, checkpoint_path=checkpoint_path, **kwargs)
+
+
+TestTuning().test_sample_factors()
+TestTuning().test_scoring_scheme()
+TestTuning().test_search()
+
+
 class TestPlayer(unittest.TestCase):
     def test_get_winning_counter_combs(self):
         gs = GameState(ALL_CARDS)
@@ -0,0 +1,35 @@
+import random
+from game_elements import N_CARDS
+
+# Zobrist keys of positions. A position key is the XOR of random 64 bits
+# numbers, one per (player, slot, card) placement, one per card in the hand
+# of the player to move and one when player 1 is to move, so that it is
+# updated with a single XOR per placement. Keys are drawn from a fixed seed:
+# they are the same in every process and can be stored.
+
+ZOBRIST_SEED = 0x5A0B
+_rng = random.Random(ZOBRIST_SEED)
+# PLACEMENT_KEYS[player_index][slot_index][card_index]
+PLACEMENT_KEYS = [[[_rng.getrandbits(64) for _ in range(N_CARDS)] for _ in range(9)] for _ in range(2)]
+HAND_KEYS = [_rng.getrandbits(64) for _ in range(N_CARDS)]
+SIDE_TO_MOVE_KEY = _rng.getrandbits(64)
+del _rng
+
+
+def hand_key(hand_mask):
+    key = 0
+    while hand_mask:
+        low_bit = hand_mask & -hand_mask
+        key ^= HAND_KEYS[low_bit.bit_length() - 1]
+        hand_mask ^= low_bit
+    return key
+
+
+def slots_key(slots):
+    # Key of the placements of slots, computed from scratch
+    key = 0
+    for player_index in range(2):
+        for slot_index, slot in enumerate(slots[player_index]):
+            for card in slot:
+                key ^= PLACEMENT_KEYS[player_index][slot_index][card.index]
+    return key